@@ -0,0 +1,147 @@
+"""The capacity module answers availability questions about a master
+allocation and its mirrors without going to the database for each sibling.
+
+Allocation.is_available queries the blocked periods and walks the reserved
+slots of a single allocation every time it is called. Finding a free spot
+amongst the master and the mirrors of an allocation with a quota of 200
+therefore used to cost hundreds of queries.
+
+The Capacity class loads the siblings of a master allocation (including their
+reserved slots) and the blocked periods overlapping the relevant timespan
+once. All further questions are answered in memory.
+
+Note that a capacity is a snapshot. Reserved slots added to the siblings
+after the capacity was created are not seen by it. Create a new capacity
+whenever the reserved slots might have changed.
+
+"""
+
+from seantis.reservation import Session
+from seantis.reservation import postgres
+from seantis.reservation import utils
+from seantis.reservation.models import BlockedPeriod
+
+
+class Capacity(object):
+    """Holds the siblings of a master allocation together with the
+    information needed to tell which of them are available.
+
+    """
+
+    def __init__(self, master, start=None, end=None):
+        assert master.is_master
+
+        self.master = master
+        self.siblings = master.siblings()
+
+        self.reserved = dict(
+            (s.resource, set(slot.start for slot in s.reserved_slots))
+            for s in self.siblings
+        )
+
+        self.window = None
+        self.blocked_periods = []
+        self.load_blocked_periods(*self.expand_window(start, end))
+
+    @property
+    def mirrors(self):
+        return self.siblings[1:]
+
+    def expand_window(self, start=None, end=None):
+        """Returns the timespan covering the master allocation and the given
+        start and end date (which are optional).
+
+        """
+        window_start, window_end = self.master.start, self.master.end
+
+        if start and end:
+            start, end = utils.as_machine_date(start, end)
+            window_start = min(window_start, start)
+            window_end = max(window_end, end)
+
+        return window_start, window_end
+
+    def load_blocked_periods(self, start, end):
+        """Loads the blocked periods of all siblings overlapping the given
+        timespan in a single query.
+
+        """
+        resources = [s.resource for s in self.siblings]
+
+        query = Session.query(BlockedPeriod)
+        query = query.filter(BlockedPeriod.resource.in_(resources))
+
+        query = postgres.filter_overlapping(
+            query, BlockedPeriod.start, BlockedPeriod.end, start, end
+        )
+
+        self.window = (start, end)
+        self.blocked_periods = query.all()
+
+    def covers(self, start, end):
+        return self.window[0] <= start and end <= self.window[1]
+
+    def is_blocked(self, allocation, start=None, end=None):
+        """Same as Allocation.is_blocked, without the query. """
+
+        if not (start and end):
+            start, end = allocation.start, allocation.end
+        else:
+            start, end = utils.as_machine_date(start, end)
+
+        if not self.covers(start, end):
+            self.load_blocked_periods(*self.expand_window(start, end))
+
+        for period in self.blocked_periods:
+            if period.resource != allocation.resource:
+                continue
+
+            if period.start <= end and period.end >= start:
+                return True
+
+        return False
+
+    def is_available(self, allocation, start=None, end=None):
+        """Same as Allocation.is_available, without the queries. """
+
+        if not (start and end):
+            start, end = allocation.start, allocation.end
+
+        assert(allocation.overlaps(start, end))
+
+        if self.is_blocked(allocation, start, end):
+            return False
+
+        reserved = self.reserved[allocation.resource]
+        for slot_start, slot_end in allocation.all_slots(start, end):
+            if slot_start in reserved:
+                return False
+
+        return True
+
+    def reserve(self, allocation, starts):
+        """Marks the slots with the given starts of the given sibling as
+        reserved, for slots written after the capacity was created. """
+
+        self.reserved[allocation.resource].update(starts)
+
+    def release(self, allocation, starts):
+        """Reverts Capacity.reserve. """
+
+        self.reserved[allocation.resource].difference_update(starts)
+
+    def find_spot(self, start, end):
+        """Returns the first free sibling or None. """
+
+        for allocation in self.siblings:
+            if self.is_available(allocation, start, end):
+                return allocation
+
+        return None
+
+    def free_count(self, start, end):
+        """Returns the number of free siblings. """
+
+        return sum(
+            1 for s in self.siblings if self.is_available(s, start, end)
+        )
@@ -1,15 +1,19 @@
+import csv
 import transaction
 
 from logging import getLogger
 log = getLogger('seantis.reservation')
 
 from uuid import UUID, uuid1 as new_uuid
-from datetime import datetime, timedelta, MINYEAR, MAXYEAR
+from cStringIO import StringIO
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta, MINYEAR, MAXYEAR
+from bisect import bisect_right
 from itertools import groupby
 
-from zope.event import notify
 
-from sqlalchemy.sql import and_, or_
+from sqlalchemy.sql import and_, case, or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload, exc
 from sqlalchemy import func, null
 
@@ -26,7 +30,8 @@ from seantis.reservation.events import (
 )
 
 from seantis.reservation.models import (
-    Allocation, BlockedPeriod, ReservedSlot, Reservation, Recurrence
+    Allocation, BlockedPeriod, ReservedSlot, Reservation, Recurrence,
+    ResourceVersion
 )
 
 from seantis.reservation.error import (
@@ -50,14 +55,32 @@ from seantis.reservation.error import (
     UnblockableAlreadyReservedError,
 )
 
-from seantis.reservation.session import serialized
-from seantis.reservation.raster import rasterize_span, MIN_RASTER_VALUE
+from seantis.reservation.session import (
+    is_retryable,
+    lock_resource,
+    notify,
+    serialized,
+    serialized_resource
+)
+from seantis.reservation.capacity import Capacity
+from seantis.reservation.raster import (
+    rasterize_end,
+    rasterize_span,
+    rasterize_start,
+    MIN_RASTER_VALUE
+)
 from seantis.reservation.interfaces import validate_email
+from seantis.reservation import postgres
 from seantis.reservation import utils
 from seantis.reservation import Session
 
 
 def all_allocations_in_range(start, end):
+    if postgres.range_indexes_enabled():
+        return Session.query(Allocation).filter(postgres.overlaps(
+            Allocation._start, Allocation._end, start, end
+        ))
+
     # Query version of utils.overlaps
     return Session.query(Allocation).filter(
         or_(
@@ -73,6 +96,136 @@ def all_allocations_in_range(start, end):
     )
 
 
+def copy_value(value):
+    """ Returns the given value as it should appear in the CSV data of a
+    PostgreSQL COPY statement. """
+
+    if value is None:
+        return ''
+
+    if isinstance(value, bool):
+        return value and 't' or 'f'
+
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+
+    return str(value)
+
+
+def bulk_insert(table, rows):
+    """ Inserts the given rows (dictionaries keyed by column name) into the
+    given table, bypassing the ORM.
+
+    On PostgreSQL with psycopg2 the rows are written using COPY, on other
+    databases using a single executemany statement. Since COPY does not know
+    about column defaults or the custom types, each row needs to contain
+    plain values for all columns which should not be NULL.
+
+    """
+    if not rows:
+        return
+
+    # make sure that pending changes are written before the rows (e.g. a
+    # recurrence referenced by the rows)
+    Session.flush()
+
+    if Session.bind.dialect.driver != 'psycopg2':
+        Session.execute(table.insert(), rows)
+        return
+
+    columns = sorted(rows[0].keys())
+
+    data = StringIO()
+    writer = csv.writer(data)
+    for row in rows:
+        writer.writerow([copy_value(row[column]) for column in columns])
+    data.seek(0)
+
+    statement = 'COPY {} ({}) FROM STDIN WITH CSV'.format(
+        table.name, ', '.join('"{}"'.format(c) for c in columns)
+    )
+
+    cursor = Session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(statement, data)
+    finally:
+        cursor.close()
+
+
+def flush_constrained(error):
+    """ Flushes the session, raising the given error if the exclusion
+    constraint between reserved slots and blocked periods is violated
+    (see postgres.exclusion_constraints_enabled).
+
+    """
+    try:
+        Session.flush()
+    except IntegrityError, e:
+        if postgres.is_exclusion_violation(e):
+            raise error
+        raise
+
+
+def bump_resource_version(resource):
+    """Increases the version of the given resource (see ResourceVersion),
+    in the current transaction. The new version is seen by others once the
+    transaction is committed and rolled back together with the change.
+
+    Called by all writes of the scheduler through serialized_resource.
+    Writes changing resources otherwise need to call it themselves.
+
+    """
+    table = ResourceVersion.__table__
+    now = utils.utcnow()
+
+    if postgres.supports_on_conflict():
+        connection = Session.connection()
+        statement = table.insert().values(
+            resource=utils.string_uuid(resource), version=1,
+            created=now, modified=now
+        ).compile(dialect=connection.dialect)
+
+        connection.execute(
+            u'%s ON CONFLICT (resource) DO UPDATE SET '
+            u'version = resource_versions.version + 1, '
+            u'modified = excluded.modified' % statement, statement.params
+        )
+    else:
+        updated = Session.execute(
+            table.update().where(table.c.resource == resource).values(
+                version=table.c.version + 1, modified=now
+            )
+        ).rowcount
+
+        if not updated:
+            Session.execute(table.insert().values(
+                resource=resource, version=1, created=now, modified=now
+            ))
+
+
+def resource_versions(resources):
+    """Returns the versions of the given resources (uuids or resources) in
+    a dictionary keyed by uuid. Resources which have never been changed
+    are at version 0.
+
+    """
+    uuids = [utils.real_uuid(r) for r in resources]
+    versions = dict((uuid, 0) for uuid in uuids)
+
+    if uuids:
+        query = Session.query(
+            ResourceVersion.resource, ResourceVersion.version
+        )
+        query = query.filter(ResourceVersion.resource.in_(uuids))
+
+        versions.update(query.all())
+
+    return versions
+
+
 @serialized
 def unblock_periods(reservation, start=None, end=None):
     """Unblock periods for any resource based o a reservation.
@@ -85,8 +238,13 @@ def unblock_periods(reservation, start=None, end=None):
         query = query.filter(BlockedPeriod.start >= start)
     if end:
         query = query.filter(BlockedPeriod.end <= end)
+
+    resources = query.with_entities(BlockedPeriod.resource).distinct().all()
     query.delete('fetch')
 
+    for resource, in resources:
+        bump_resource_version(resource)
+
 
 @serialized
 def remove_orphan_recurrences():
@@ -117,16 +275,24 @@ def grouped_reservation_view(query):
     return query
 
 
-def availability_by_allocations(allocations):
+def availability_by_allocations(allocations, blocked_periods=None):
     """Takes any iterator with alloctions and calculates the availability.
     Counts missing mirrors as 100% free and returns a value between 0-100 in
     any case.
     For single allocations check the allocation.availability property.
 
+    If the blocked periods of the allocations are known already, they may
+    be passed as a dictionary of lists keyed by resource.
+
     """
     total, expected_count, count = 0, 0, 0
     for allocation in allocations:
-        total += allocation.availability
+        if blocked_periods is None:
+            total += allocation.availability
+        else:
+            total += allocation.calculate_availability(
+                blocked_periods.get(allocation.resource, ())
+            )
         count += 1
 
         # Sum up the expected number of allocations. Missing allocations
@@ -164,6 +330,22 @@ def availability_by_day(start, end, resources, is_exposed):
     a dictionary is returned with each day in the range as key and a tuple of
     availability and the resources counted for that day.
 
+    On PostgreSQL the availability is aggregated by the database, see
+    aggregated_availability_by_day.
+
+    """
+    if postgres.is_postgresql():
+        return aggregated_availability_by_day(
+            start, end, resources, is_exposed
+        )
+
+    return materialized_availability_by_day(start, end, resources, is_exposed)
+
+
+def materialized_availability_by_day(start, end, resources, is_exposed):
+    """Availability by day, calculated by loading all allocations in the
+    range together with their reserved slots.
+
     WARNING, this function should run as linearly as possible as a lot
     of records might be processed.
 
@@ -195,6 +377,70 @@ def availability_by_day(start, end, resources, is_exposed):
     return days
 
 
+# the exposure callbacks only look at the resource and the start date of the
+# allocations, which is all the aggregated query knows about
+ExposureCandidate = namedtuple('ExposureCandidate', ['mirror_of', 'start'])
+
+
+def aggregated_availability_by_day(start, end, resources, is_exposed):
+    """Availability by day, calculated by PostgreSQL. Returns the same as
+    materialized_availability_by_day without loading any allocation.
+
+    The availability of the allocations is summed up per day and resource
+    by the database. Since the exposure of an allocation only depends on
+    the day and the resource, is_exposed is called with a stand-in for
+    each of those groups.
+
+    """
+    by_day = func.date(Allocation._start)
+    expected = func.sum(case(
+        [(Allocation.resource == Allocation.mirror_of, Allocation.quota)],
+        else_=0
+    ))
+    availability = func.sum(postgres.allocation_availability(
+        Allocation, ReservedSlot, BlockedPeriod
+    ))
+
+    query = all_allocations_in_range(start, end)
+    query = query.filter(Allocation.mirror_of.in_(resources))
+    query = query.with_entities(
+        by_day, Allocation.mirror_of, func.count(Allocation.id),
+        expected, availability
+    )
+    query = query.group_by(by_day, Allocation.mirror_of)
+
+    totals = {}
+    for day, resource, count, quota, total in query:
+
+        candidate = ExposureCandidate(resource, datetime.combine(day, time()))
+        if not is_exposed(candidate):
+            continue
+
+        if day not in totals:
+            totals[day] = [0, 0, 0, set()]
+
+        totals[day][0] += total
+        totals[day][1] += count
+        totals[day][2] += quota
+        totals[day][3].add(resource)
+
+    days = {}
+
+    # see availability_by_allocations
+    for day, (total, count, expected_count, members) in totals.items():
+
+        if not expected_count:
+            days[day] = (0, members)
+            continue
+
+        missing = expected_count - count
+        total += missing * 100
+
+        days[day] = (total / expected_count, members)
+
+    return days
+
+
 def reservations_by_session(session_id):
 
     # be sure to not query for all reservations. since a query should be
@@ -237,6 +483,9 @@ def confirm_reservations_for_session(session_id, token=None, language=None):
     for reservation in reservations:
         reservation.session_id = None
 
+    for resource in set(r.resource for r in reservations):
+        bump_resource_version(resource)
+
     notify(ReservationsConfirmedEvent(reservations, language))
 
 
@@ -251,6 +500,7 @@ def remove_reservation_from_session(session_id, token):
 
     reservation = query.one()
     Session.delete(reservation)
+    bump_resource_version(reservation.resource)
 
     # if we get here the token must be valid, we should then check if the
     # token is used in the reserved slots, because with autoapproval these
@@ -352,11 +602,15 @@ def extinguish_resource(resource_uuid):
     # set the language as this may be called when deleting plone which
     # will render all plone utils calls, like portal_languages, useless
     scheduler = Scheduler(resource_uuid, language='en')
+    lock_resource(scheduler.uuid)
+
     scheduler.managed_reservations().delete('fetch')
     scheduler.managed_reserved_slots().delete('fetch')
     scheduler.managed_allocations().delete('fetch')
     scheduler.managed_blocked_periods().delete('fetch')
 
+    bump_resource_version(scheduler.uuid)
+
     remove_orphan_recurrences()
 
 
@@ -402,6 +656,11 @@ class Scheduler(object):
         else:
             self.language = utils.get_current_site_language()
 
+    def version(self):
+        """ Returns the version of the resource, which changes with every
+        transaction changing the resource (see ResourceVersion). """
+        return resource_versions([self.uuid])[self.uuid]
+
     # using the managed_* functions as a starting point for queries is a good
     # idea because the querie's scope will always be correctly limited
 
@@ -435,7 +694,7 @@ class Scheduler(object):
 
         return query
 
-    @serialized
+    @serialized_resource
     def allocate(self, dates, raster=15, quota=None, partly_available=False,
                  grouped=False, approve_manually=True,
                  reservation_quota_limit=0, whole_day=False, rrule=None
@@ -480,24 +739,7 @@ class Scheduler(object):
         # possible raster value
         raster = partly_available and raster or MIN_RASTER_VALUE
 
-        # the whole day option results in the dates being aligned to
-        # the beginning of the day / end of it -> not timezone aware!
-        if whole_day:
-            for ix, (start, end) in enumerate(dates):
-                dates[ix] = utils.align_range_to_day(start, end)
-
-        # Ensure that the list of dates contains no overlaps inside
-        for start, end in dates:
-            if utils.count_overlaps(dates, start, end) > 1:
-                raise InvalidAllocationError
-
-        # Make sure that this span does not overlap another master
-        for start, end in dates:
-            start, end = rasterize_span(start, end, raster)
-
-            existing = self.allocations_in_range(start, end).first()
-            if existing:
-                raise OverlappingAllocationError(start, end, existing)
+        dates = self._prepare_allocation_dates(dates, raster, whole_day)
 
         # Write the master allocations
         allocations = []
@@ -525,7 +767,114 @@ class Scheduler(object):
 
         return allocations
 
-    @serialized
+    @serialized_resource
+    def allocate_bulk(self, dates, raster=15, quota=None,
+                      partly_available=False, grouped=False,
+                      approve_manually=True, reservation_quota_limit=0,
+                      whole_day=False, rrule=None, mirrors=False):
+        """Allocates spots in the calendar like Scheduler.allocate, but
+        without creating an ORM object for each allocation. Meant for large
+        amounts of dates, e.g. recurrences spanning years.
+
+        The allocations are written using COPY on PostgreSQL or a single
+        executemany statement on other databases.
+
+        If 'mirrors' is True, the mirrors of each master are written in the
+        same statement. Reservations made later then never have to create
+        the mirrors on the fly (see Allocation.siblings).
+
+        Returns a list of (id, group) tuples for the new master allocations,
+        ordered by start.
+
+        """
+        dates = utils.pairs(dates)
+
+        group = new_uuid()
+        quota = quota or 1
+
+        raster = partly_available and raster or MIN_RASTER_VALUE
+
+        dates = self._prepare_allocation_dates(dates, raster, whole_day)
+
+        # the recurrence needs an id before the allocations are written
+        if not grouped and len(dates) > 1:
+            recurrence = Recurrence(rrule=rrule)
+            Session.add(recurrence)
+            Session.flush()
+        else:
+            recurrence = None
+
+        if mirrors:
+            resources = [self.uuid] + utils.generate_uuids(self.uuid, quota)
+        else:
+            resources = [self.uuid]
+
+        created = utils.utcnow()
+        groups = []
+        rows = []
+
+        for start, end in dates:
+            groups.append(grouped and group or new_uuid())
+
+            for resource in resources:
+                rows.append({
+                    'resource': resource,
+                    'mirror_of': self.uuid,
+                    'group': groups[-1],
+                    'quota': quota,
+                    'partly_available': partly_available,
+                    'approve_manually': approve_manually,
+                    'reservation_quota_limit': reservation_quota_limit,
+                    '_start': rasterize_start(start, raster),
+                    '_end': rasterize_end(end, raster),
+                    '_raster': raster,
+                    'recurrence_id': recurrence and recurrence.id or None,
+                    'created': created
+                })
+
+        bulk_insert(Allocation.__table__, rows)
+
+        query = self.managed_allocations()
+        query = query.filter(Allocation.resource == self.uuid)
+
+        if recurrence:
+            query = query.filter(Allocation.recurrence_id == recurrence.id)
+        else:
+            query = query.filter(Allocation.group.in_(set(groups)))
+
+        query = query.with_entities(Allocation.id, Allocation.group)
+        query = query.order_by(Allocation._start)
+
+        return query.all()
+
+    def _prepare_allocation_dates(self, dates, raster, whole_day):
+        """ Returns the dates of new allocations, aligned to the day if
+        requested. Raises an error if the dates overlap each other or an
+        existing master allocation.
+
+        """
+        dates = utils.pairs(dates)
+
+        # the whole day option results in the dates being aligned to
+        # the beginning of the day / end of it -> not timezone aware!
+        if whole_day:
+            for ix, (start, end) in enumerate(dates):
+                dates[ix] = utils.align_range_to_day(start, end)
+
+        # Ensure that the list of dates contains no overlaps inside
+        overlaps = utils.find_overlaps(dates)
+        if overlaps:
+            raise InvalidAllocationError(overlaps)
+
+        # Make sure that this span does not overlap another master
+        conflicts = self.overlapping_allocations(dates, raster)
+        if conflicts:
+            start, end, existing = conflicts[0]
+            raise OverlappingAllocationError(start, end, existing, conflicts)
+
+        return dates
+
+    @serialized_resource
     def change_quota(self, master, new_quota):
         """ Changes the quota of a master allocation.
 
@@ -586,17 +935,19 @@ class Scheduler(object):
             return
 
         # Make sure that the quota can be decreased
-        mirrors = self.allocation_mirrors_by_master(master)
-        allocations = [master] + mirrors
+        capacity = self.capacity(master)
+        allocations = capacity.siblings
 
-        free_allocations = [a for a in allocations if a.is_available()]
+        free_allocations = [a for a in allocations if capacity.is_available(a)]
 
         required = master.quota - new_quota
         if len(free_allocations) < required:
             raise AffectedReservationError(None)
 
         # get a map pointing from the existing uuid to the newly assigned uuid
-        reordered = self.reordered_keylist(allocations, new_quota)
+        reordered = self.reordered_keylist(
+            allocations, new_quota, capacity.is_available
+        )
 
         # unused keys are the ones not present in the newly assignd uuid list
         unused = set(reordered.keys()) - set(reordered.values()) - set((None,))
@@ -643,14 +994,19 @@ class Scheduler(object):
             query = query.filter(Allocation._start == master._start)
             query.delete('fetch')
 
-    def reordered_keylist(self, allocations, new_quota):
+    def reordered_keylist(self, allocations, new_quota, is_available=None):
         """ Creates the map for the keylist reorganzation.
 
         Each key of the returned dictionary is a resource uuid pointing to the
         resource uuid it should be moved to. If the allocation should not be
         moved they key-value is None.
 
+        The optional is_available function is called with each allocation
+        instead of allocation.is_available (see Scheduler.capacity).
+
         """
+        is_available = is_available or (lambda a: a.is_available())
+
         masters = [a for a in allocations if a.is_master]
         assert(len(masters) == 1)
 
@@ -668,7 +1024,7 @@ class Scheduler(object):
         # for a non-free allocation is acquired
         offset = 0
         for ix, key in enumerate(keylist):
-            if allocations[key].is_available():
+            if is_available(allocations[key]):
                 offset += 1
             else:
                 reordered[key] = keylist[ix - offset]
@@ -697,24 +1053,82 @@ class Scheduler(object):
 
     def allocations_in_range(self, start, end, masters_only=True):
         query = self.managed_allocations()
-        query = query.filter(
-            or_(
-                and_(
-                    Allocation._start <= start,
-                    start <= Allocation._end
-                ),
-                and_(
-                    start <= Allocation._start,
-                    Allocation._start <= end
+
+        if postgres.range_indexes_enabled():
+            query = query.filter(postgres.overlaps(
+                Allocation._start, Allocation._end, start, end
+            ))
+        else:
+            query = query.filter(
+                or_(
+                    and_(
+                        Allocation._start <= start,
+                        start <= Allocation._end
+                    ),
+                    and_(
+                        start <= Allocation._start,
+                        Allocation._start <= end
+                    )
                 )
             )
-        )
 
         if masters_only:
             query = query.filter(Allocation.resource == self.uuid)
 
         return query
 
+    def overlapping_allocations(self, dates, raster):
+        """ Returns a list of (start, end, existing) tuples for each of the
+        given dates overlapping an existing master allocation. The dates are
+        rasterized with the given raster first.
+
+        Instead of running a query for each date, the masters within the
+        whole span of the dates are fetched at once and matched with the
+        dates in memory. Since the masters of a resource cannot overlap,
+        they are sorted by start and end alike.
+
+        """
+        dates = sorted(rasterize_span(s, e, raster) for s, e in dates)
+
+        if not dates:
+            return []
+
+        span_start = dates[0][0]
+        span_end = max(end for start, end in dates)
+
+        query = self.allocations_in_range(span_start, span_end)
+        query = query.with_entities(
+            Allocation.id, Allocation._start, Allocation._end
+        )
+        query = query.order_by(Allocation._start)
+
+        existing = query.all()
+        starts = [e[1] for e in existing]
+
+        conflicts = []
+        for start, end in dates:
+
+            # walk back from the last master starting before the end
+            ix = bisect_right(starts, end)
+            while ix > 0:
+                ix -= 1
+                id, existing_start, existing_end = existing[ix]
+
+                if existing_end < start:
+                    break
+
+                conflicts.append((start, end, id))
+
+        if not conflicts:
+            return []
+
+        ids = set(c[2] for c in conflicts)
+        query = self.managed_allocations()
+        query = query.filter(Allocation.id.in_(ids))
+
+        allocations = dict((a.id, a) for a in query)
+        return [(s, e, allocations[id]) for s, e, id in conflicts]
+
     def allocations_by_reservation(self, reservation_token):
         query = self.managed_allocations()
         query = query.join(ReservedSlot)
@@ -748,7 +1162,7 @@ class Scheduler(object):
 
         return availability_by_range(start, end, [self.uuid], self.is_exposed)
 
-    @serialized
+    @serialized_resource
     def move_allocation(
             self, master_id, new_start=None, new_end=None,
             group=None, new_quota=None, approve_manually=None,
@@ -829,7 +1243,7 @@ class Scheduler(object):
             change.end = new.end
             change.group = group or master.group
 
-    @serialized
+    @serialized_resource
     def remove_allocation(self, id=None, group=None, recurrence_id=None):
         if recurrence_id:
             allocations = self.allocations_by_recurrence(recurrence_id).all()
@@ -895,10 +1309,12 @@ class Scheduler(object):
                 # with manual approval the reservation ends up on the
                 # waitinglist and does not yet need a spot
                 if not allocation.approve_manually:
-                    if not self.find_spot(allocation, start, end):
+                    capacity = self.capacity(allocation, start, end)
+
+                    if not capacity.find_spot(start, end):
                         raise AlreadyReservedError
 
-                    free = self.free_allocations_count(allocation, start, end)
+                    free = capacity.free_count(start, end)
                     if free < quota:
                         raise AlreadyReservedError
 
@@ -982,7 +1398,7 @@ class Scheduler(object):
             reservation.description = description
         return reservation
 
-    @serialized
+    @serialized_resource
     def reserve(self, email, dates=None, group=None, data=None,
                 session_id=None, quota=1, rrule=None, description=None):
         """ First step of the reservation.
@@ -1021,7 +1437,7 @@ class Scheduler(object):
 
         return token
 
-    @serialized
+    @serialized_resource
     def generate_reserved_slots(self, token, reservation, dates=None):
         slots_to_reserve = []
 
@@ -1031,6 +1447,9 @@ class Scheduler(object):
         # dates which are approved
         dates = dates * reservation.quota
 
+        if postgres.optimistic_slots_enabled():
+            return self._insert_reserved_slots(token, dates)
+
         for start, end in dates:
             for allocation in self.reservation_targets(start, end):
 
@@ -1050,9 +1469,132 @@ class Scheduler(object):
                 # must make it realz yo
                 if allocation.is_transient:
                     Session.add(allocation)
+
+        if postgres.exclusion_constraints_enabled():
+            flush_constrained(AlreadyReservedError)
+
+        return slots_to_reserve
+
+    def _insert_reserved_slots(self, token, dates):
+        """ Writes the reserved slots of the given dates without checking
+        the availability of the allocations first. The slots are inserted
+        into one sibling after the other until the database accepts all of
+        them (see postgres.optimistic_slots_enabled).
+
+        """
+        slots_to_reserve = []
+
+        # the siblings and blocked periods of each master allocation
+        capacities = {}
+
+        # the index of the first sibling which might be free, by master and
+        # dates (the ones before are known to be taken)
+        candidates = {}
+
+        created = utils.utcnow()
+
+        for start, end in dates:
+
+            query = all_allocations_in_range(start, end)
+            query = query.filter(Allocation.resource == self.uuid)
+
+            for master in query:
+
+                # may happen because start and end are not rasterized
+                if not master.overlaps(start, end):
+                    continue
+
+                if master.id not in capacities:
+                    capacities[master.id] = self.capacity(master, start, end)
+
+                capacity = capacities[master.id]
+                key = (master.id, start, end)
+
+                first = candidates.get(key, 0)
+
+                for index in range(first, len(capacity.siblings)):
+                    candidates[key] = index + 1
+
+                    sibling = capacity.siblings[index]
+
+                    if capacity.is_blocked(sibling, start, end):
+                        continue
+
+                    slots = self._insert_sibling_slots(
+                        token, sibling, start, end, created
+                    )
+
+                    if slots:
+                        slots_to_reserve.extend(slots)
+                        break
+                else:
+                    raise AlreadyReservedError
+
         return slots_to_reserve
 
-    @serialized
+    def _insert_sibling_slots(self, token, allocation, start, end, created):
+        """ Inserts the slots of the given allocation between start and end,
+        unless one of them is reserved already. Returns the inserted slots.
+
+        The slots are inserted in a savepoint, which is rolled back if not
+        all of them could be written. A mirror allocation created for the
+        slots is then rolled back as well.
+
+        """
+        savepoint = Session.begin_nested()
+
+        try:
+            # the allocation may be a fake one, in which case we must make
+            # it real to have an id for the slots
+            if allocation.is_transient:
+                Session.add(allocation)
+                Session.flush()
+
+            rows = [
+                dict(
+                    resource=str(allocation.resource),
+                    start=slot_start,
+                    end=slot_end,
+                    allocation_id=allocation.id,
+                    reservation_token=str(token),
+                    created=created
+                ) for slot_start, slot_end in allocation.all_slots(start, end)
+            ]
+
+            inserted = postgres.insert_ignoring_conflicts(
+                ReservedSlot.__table__, rows, 'start'
+            )
+        except IntegrityError, e:
+            savepoint.rollback()
+
+            if postgres.is_exclusion_violation(e):
+                raise AlreadyReservedError
+            raise
+        except:
+            savepoint.rollback()
+            raise
+
+        # the allocation is only partly free
+        if len(inserted) < len(rows):
+            savepoint.rollback()
+            return []
+
+        savepoint.commit()
+
+        # the reserved slots of the allocation in the session are outdated
+        Session.expire(allocation, ['reserved_slots'])
+
+        return [
+            ReservedSlot(
+                resource=allocation.resource,
+                start=row['start'],
+                end=row['end'],
+                allocation_id=allocation.id,
+                reservation_token=token
+            ) for row in rows
+        ]
+
+    @serialized_resource
     def approve_reservation(self, token):
         """ This function approves an existing reservation and writes the
         reserved slots accordingly.
@@ -1075,7 +1617,7 @@ class Scheduler(object):
 
         return slots_to_reserve
 
-    @serialized
+    @serialized_resource
     def deny_reservation(self, token):
         """ Denies a pending reservation, removing it from the records and
         sending an email to the reservee.
@@ -1090,7 +1632,7 @@ class Scheduler(object):
 
         notify(ReservationDeniedEvent(reservation, self.language))
 
-    @serialized
+    @serialized_resource
     def revoke_reservation(self, token, reason, send_email=True):
         """ Revoke a reservation and inform the user of that."""
 
@@ -1105,7 +1647,232 @@ class Scheduler(object):
 
         self.remove_reservation(token)
 
-    @serialized
+    def _reservations_by_tokens(self, tokens, status=None):
+        """ Returns the reservations with the given tokens ordered by id,
+        together with a dictionary of InvalidReservationToken errors keyed
+        by the tokens which were not found.
+
+        """
+        query = self.managed_reservations()
+        query = query.filter(Reservation.token.in_(tokens))
+
+        if status:
+            query = query.filter(Reservation.status == status)
+
+        reservations = query.order_by(Reservation.id).all()
+
+        found = set(utils.string_uuid(r.token) for r in reservations)
+        failures = dict(
+            (token, InvalidReservationToken()) for token in tokens
+            if utils.string_uuid(token) not in found
+        )
+
+        return reservations, failures
+
+    @serialized_resource
+    def approve_reservations(self, tokens):
+        """ Approves the given pending reservations in one transaction, one
+        after the other in the order they were made.
+
+        Reservations which cannot be approved (i.e. because no spot is left
+        for them) stay pending without affecting the others. Returns the
+        errors of those reservations in a dictionary keyed by token.
+        Reservations which are approved already are skipped.
+
+        Unlike calling approve_reservation for each token, the allocations
+        and their availability are only loaded once.
+
+        """
+        reservations, failures = self._reservations_by_tokens(tokens)
+        reservations = [r for r in reservations if r.status == u'pending']
+
+        capacities = {}
+        groups = {}
+        masters = {}
+
+        for reservation in reservations:
+            reserved = []
+
+            savepoint = Session.begin_nested()
+            try:
+                self._approve_with_capacities(
+                    reservation, capacities, groups, masters, reserved
+                )
+                savepoint.commit()
+            except Exception, e:
+                savepoint.rollback()
+
+                # the transaction is lost, there's no point in going on
+                if is_retryable(e):
+                    raise
+
+                for capacity, allocation, starts in reserved:
+                    capacity.release(allocation, starts)
+
+                failures[reservation.token] = e
+                continue
+
+            notify(ReservationSlotsCreatedEvent(reservation, self.language))
+            notify(ReservationApprovedEvent(reservation, self.language))
+
+        return failures
+
+    def _approve_with_capacities(self, reservation, capacities, groups,
+                                 masters, reserved):
+        """ Approves the given reservation for approve_reservations, sharing
+        the group dates (by group) with the other reservations, as well as
+        the arguments of _reserve_with_capacities.
+
+        """
+        if reservation.target_type == u'group':
+            if reservation.target not in groups:
+                groups[reservation.target] = reservation.target_dates()
+
+        dates = list(reservation.target_dates(groups)) * reservation.quota
+
+        if postgres.optimistic_slots_enabled():
+            slots = self._insert_reserved_slots(reservation.token, dates)
+        else:
+            slots = self._reserve_with_capacities(
+                reservation.token, dates, capacities, masters, reserved
+            )
+
+        if not slots:
+            raise NotReservableError
+
+        reservation.status = u'approved'
+
+        flush_constrained(AlreadyReservedError)
+
+    def _reserve_with_capacities(self, token, dates, capacities, masters,
+                                 reserved):
+        """ Same as generate_reserved_slots, using and updating the given
+        capacities (by master id) and master allocations (by dates). The
+        slots marked as reserved in the capacities are added to the reserved
+        list, to be released if the reservation fails later on.
+
+        """
+        slots = []
+
+        for start, end in dates:
+
+            if (start, end) not in masters:
+                query = all_allocations_in_range(start, end)
+                query = query.filter(Allocation.resource == self.uuid)
+
+                # start and end are not rasterized, so we need this check
+                masters[(start, end)] = [
+                    m for m in query if m.overlaps(start, end)
+                ]
+
+            for master in masters[(start, end)]:
+
+                if master.id not in capacities:
+                    capacities[master.id] = self.capacity(master, start, end)
+
+                capacity = capacities[master.id]
+                allocation = capacity.find_spot(start, end)
+
+                if not allocation:
+                    raise AlreadyReservedError
+
+                starts = []
+                for slot_start, slot_end in allocation.all_slots(start, end):
+                    slot = ReservedSlot()
+                    slot.start = slot_start
+                    slot.end = slot_end
+                    slot.resource = allocation.resource
+                    slot.reservation_token = token
+
+                    allocation.reserved_slots.append(slot)
+                    slots.append(slot)
+                    starts.append(slot_start)
+
+                capacity.reserve(allocation, starts)
+                reserved.append((capacity, allocation, starts))
+
+                if allocation.is_transient:
+                    Session.add(allocation)
+
+        return slots
+
+    @serialized_resource
+    def deny_reservations(self, tokens):
+        """ Denies the given pending reservations in one transaction. Returns
+        the errors of the tokens which could not be denied in a dictionary
+        keyed by token.
+
+        """
+        reservations, failures = self._reservations_by_tokens(
+            tokens, status=u'pending'
+        )
+
+        for reservation in reservations:
+            notify(ReservationDeniedEvent(reservation, self.language))
+
+        found = [r.token for r in reservations]
+
+        if found:
+            slots = self.managed_reserved_slots()
+            slots = slots.filter(ReservedSlot.reservation_token.in_(found))
+            slots.delete('fetch')
+
+            query = self.managed_reservations()
+            query = query.filter(Reservation.token.in_(found))
+            query.delete('fetch')
+
+        return failures
+
+    @serialized_resource
+    def revoke_reservations(self, tokens, reason, send_email=True):
+        """ Revokes the given approved reservations in one transaction,
+        informing the reservees. Returns the errors of the tokens which could
+        not be revoked (i.e. because they are not approved) in a dictionary
+        keyed by token.
+
+        """
+        reason = reason or u''
+
+        reservations, failures = self._reservations_by_tokens(
+            tokens, status=u'approved'
+        )
+
+        # like revoke_reservation, the reservees are informed before the
+        # reserved slots the mails list are removed, but only once the pending
+        # changes are flushed
+        Session.flush()
+
+        for reservation in reservations:
+            notify(ReservationRevokedEvent(
+                reservation, self.language, reason, send_email
+            ))
+
+        found = [r.token for r in reservations]
+
+        if found:
+            slots = self.managed_reserved_slots()
+            slots = slots.filter(ReservedSlot.reservation_token.in_(found))
+            slots.delete('fetch')
+
+            # the blocked periods may belong to other resources
+            periods = Session.query(BlockedPeriod)
+            periods = periods.filter(BlockedPeriod.token.in_(found))
+
+            resources = periods.with_entities(
+                BlockedPeriod.resource
+            ).distinct().all()
+            periods.delete('fetch')
+
+            for resource, in resources:
+                bump_resource_version(resource)
+
+            query = self.managed_reservations()
+            query = query.filter(Reservation.token.in_(found))
+            query.delete('fetch')
+
+        return failures
+
+    @serialized_resource
     def remove_reservation(self, token):
         """ Removes all reserved slots of the given reservation token.
 
@@ -1126,7 +1893,7 @@ class Scheduler(object):
 
         self.reservation_by_token(token).delete()
 
-    @serialized
+    @serialized_resource
     def remove_reservation_slots(self, token, start, end):
         """ Removes all reserved slots of the given reservation token
         between start and end.
@@ -1215,7 +1982,7 @@ class Scheduler(object):
 
         return changed
 
-    @serialized
+    @serialized_resource
     def update_reservation(self, token, start, end, email, description, data):
         time_changed = False
         reservation = self.reservation_by_token(token).one()
@@ -1243,7 +2010,7 @@ class Scheduler(object):
             notify(ReservationUpdatedEvent(reservation, self.language,
                                            old_data, time_changed))
 
-    @serialized
+    @serialized_resource
     def update_reservation_data(self, token, data):
         reservation = self.reservation_by_token(token).one()
 
@@ -1260,7 +2027,7 @@ class Scheduler(object):
         reservation.data = new_data
         return new_data != old_data
 
-    @serialized
+    @serialized_resource
     def confirm_reservations_for_session(self, session_id, token=None):
         """ Confirms all reservations of the given session id. Optionally
         confirms only the reservations with the given token. All if None.
@@ -1281,7 +2048,7 @@ class Scheduler(object):
 
         notify(ReservationsConfirmedEvent(reservations, self.language))
 
-    @serialized
+    @serialized_resource
     def remove_reservation_from_session(self, session_id, token):
         """ Removes the reservation with the given session_id and token. """
 
@@ -1320,6 +2087,15 @@ class Scheduler(object):
 
         query.update({"modified": utils.utcnow()})
 
+    def capacity(self, master_allocation, start=None, end=None):
+        """ Returns the capacity of the given master allocation, which loads
+        the master, the mirrors and their blocked periods at once. Use it
+        when asking more than one availability question about the same
+        allocation. See seantis.reservation.capacity.
+
+        """
+        return Capacity(master_allocation, start, end)
+
     def find_spot(self, master_allocation, start, end):
         """ Returns the first free allocation spot amongst the master and the
         mirrors. Honors the quota set on the master and will only try the
@@ -1328,42 +2104,15 @@ class Scheduler(object):
         If no spot can be found, None is returned.
 
         """
-        master = master_allocation
-        if master.is_available(start, end):
-            return master
-
-        if master.quota == 1:
-            return None
-
-        mirrors = self.allocation_mirrors_by_master(master)
-        tries = master.quota - 1
-
-        for mirror in mirrors:
-            if mirror.is_available(start, end):
-                return mirror
-
-            if tries >= 1:
-                tries -= 1
-            else:
-                return None
+        capacity = self.capacity(master_allocation, start, end)
+        return capacity.find_spot(start, end)
 
     def free_allocations_count(self, master_allocation, start, end):
         """ Returns the number of free allocations between master_allocation
         and it's mirrors. """
 
-        free_allocations = 0
-
-        if master_allocation.is_available(start, end):
-            free_allocations += 1
-
-        if master_allocation.quota == 1:
-            return free_allocations
-
-        for mirror in self.allocation_mirrors_by_master(master_allocation):
-            if mirror.is_available(start, end):
-                free_allocations += 1
-
-        return free_allocations
+        capacity = self.capacity(master_allocation, start, end)
+        return capacity.free_count(start, end)
 
     def reservation_targets(self, start, end):
         """ Returns a list of allocations that are free within start and end.
@@ -1474,7 +2223,7 @@ class Scheduler(object):
 
         return False
 
-    @serialized
+    @serialized_resource
     def block_periods(self, reservation):
         """Block periods for the scheduler's resource based on another
         reservation.
@@ -1483,14 +2232,18 @@ class Scheduler(object):
         for start, end in reservation.timespans():
             self.block_period(start, end, reservation.token)
 
-    @serialized
+    @serialized_resource
     def block_period(self, start, end, token):
         """Block the period from start to end for the scheduler's resource.
 
         """
         start, end = utils.as_machine_date(start, end)
 
-        if self.has_reserved_slot_in_range(start, end):
+        # with the exclusion constraints postgres detects the conflicts when
+        # the blocked period is written, otherwise they are looked up first
+        constrained = postgres.exclusion_constraints_enabled()
+
+        if not constrained and self.has_reserved_slot_in_range(start, end):
             raise UnblockableAlreadyReservedError
 
         blocked_period = BlockedPeriod(
@@ -1500,3 +2253,6 @@ class Scheduler(object):
             end=end
         )
         Session.add(blocked_period)
+
+        if constrained:
+            flush_constrained(UnblockableAlreadyReservedError)
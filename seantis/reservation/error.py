@@ -18,11 +18,14 @@ class ReservationError(Exception):
 
 class OverlappingAllocationError(ReservationError):
 
-    def __init__(self, start, end, existing):
+    def __init__(self, start, end, existing, conflicts=None):
         self.start = start
         self.end = end
         self.existing = existing
 
+        # all (start, end, existing) tuples found, not just the first one
+        self.conflicts = conflicts or [(start, end, existing)]
+
 
 class AffectedReservationError(ReservationError):
 
@@ -93,7 +96,10 @@ class QuotaImpossible(ReservationError):
 
 
 class InvalidAllocationError(ReservationError):
-    pass
+
+    def __init__(self, conflicts=None):
+        # the pairs of overlapping dates which made the allocation invalid
+        self.conflicts = conflicts or []
 
 
 class NoRecurringReservationError(ReservationError):
@@ -108,6 +114,12 @@ class UnblockableAlreadyReservedError(ReservationError):
     pass
 
 
+class ReservationQueueError(ReservationError):
+
+    def __init__(self, msg=None):
+        self.msg = msg
+
+
 
 errormap = {
 
@@ -172,7 +184,10 @@ errormap = {
     _('This is not a recurring reservation'),
 
     NoReservedSlotsLeftError:
-    _('No reserved slots would be left after this operation')
+    _('No reserved slots would be left after this operation'),
+
+    ReservationQueueError:
+    _(u'Your reservation could not be processed. Please try again.')
 }
 
 if HAS_PSYCOPG2:
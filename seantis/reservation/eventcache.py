@@ -0,0 +1,323 @@
+""" Caches the events rendered by the slots view (see resource.Slots).
+
+Many users look at the same week of the same resource, for which the slots
+view renders the very same events each time. With the event cache enabled
+the rendered events are shared by all users seeing the same events, that is
+users of the same language, with the same roles on the resource and the same
+timeframes applying.
+
+The cached events are stored together with the version of the resource
+(see db.resource_versions). Events cached for an older version are not
+used, so any change of the resource is seen by the next request.
+
+The cache is off by default and may be enabled in the product-config:
+
+    <product-config seantis.reservation>
+        event-cache memory
+        event-cache-size 64
+    </product-config>
+
+The events are either kept in memory by each process ('memory') or in the
+event_cache table, shared by all ZEO clients ('postgres'). Further backends
+may be added to the backends dictionary.
+
+The size is the maximum size of the cached events in megabytes (of utf-8
+encoded json). If the cache grows larger, the least recently used (memory)
+or the oldest (postgres) events are dropped. The postgres backend checks
+its size at most once every EVICTION_INTERVAL seconds per process, so the
+table may grow beyond its size for a while.
+
+The hits and misses are recorded for each backend, see CacheStatistics.
+Managers may look at them through the reservation-event-cache-statistics
+view (see maintenance.py).
+
+"""
+
+import time
+import threading
+
+from sqlalchemy import func, select, text
+from zope.component import getUtility
+
+from seantis.reservation import postgres
+from seantis.reservation import utils
+from seantis.reservation.models import CachedEvents
+from seantis.reservation.session import ISessionUtility
+from seantis.reservation.session import get_independent_engine
+
+# the default maximum size of the cache in megabytes
+DEFAULT_SIZE = 64
+
+# seconds between the size checks of the postgres backend
+EVICTION_INTERVAL = 60
+
+# the backends created by get_cache, keyed by name and dsn
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def payload_size(payload):
+    """ Returns the size of the given events in bytes. """
+
+    if isinstance(payload, unicode):
+        payload = payload.encode('utf-8')
+
+    return len(payload)
+
+
+class CacheStatistics(object):
+    """ Counts the hits and misses of a cache, as well as the events which
+    were dropped to keep the cache within its size. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def hit(self):
+        with self.lock:
+            self.hits += 1
+
+    def miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def evicted(self, count):
+        with self.lock:
+            self.evictions += count
+
+    def as_dict(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hit_ratio=lookups and float(self.hits) / lookups or 0.0
+            )
+
+
+class MemoryBackend(object):
+    """ Keeps the events in memory, dropping the least recently used events
+    once the given size (in bytes) is exceeded. """
+
+    def __init__(self, max_size, dsn=None):
+        self.max_size = max_size
+        self.items = utils.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.statistics = CacheStatistics()
+
+    def get(self, key, version):
+        with self.lock:
+            item = self.items.pop(key, None)
+
+            if item is None or item[0] != version:
+                if item is not None:
+                    self.size -= payload_size(item[1])
+
+                self.statistics.miss()
+                return None
+
+            self.items[key] = item
+
+        self.statistics.hit()
+        return item[1]
+
+    def set(self, key, version, payload):
+        size = payload_size(payload)
+
+        if size > self.max_size:
+            return
+
+        evicted = 0
+
+        with self.lock:
+            previous = self.items.pop(key, None)
+
+            if previous is not None:
+                self.size -= payload_size(previous[1])
+
+            self.items[key] = (version, payload)
+            self.size += size
+
+            while self.size > self.max_size:
+                dropped = self.items.popitem(last=False)[1][1]
+                self.size -= payload_size(dropped)
+                evicted += 1
+
+        if evicted:
+            self.statistics.evicted(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def total_size(self):
+        return self.size
+
+
+class PostgresBackend(object):
+    """ Keeps the events in the event_cache table, dropping the oldest
+    events once the given size (in bytes) is exceeded.
+
+    The table is read and written outside the zope transaction, so the
+    events cached by a request are kept even if its transaction fails.
+
+    """
+
+    def __init__(self, max_size, dsn=None):
+        self.max_size = max_size
+        self.engine = get_independent_engine(dsn)
+        self.table = CachedEvents.__table__
+        self.statistics = CacheStatistics()
+        self.lock = threading.Lock()
+        self.last_eviction = time.time()
+
+    def get(self, key, version):
+        query = select([self.table.c.payload])
+        query = query.where(self.table.c.key == key)
+        query = query.where(self.table.c.version == version)
+
+        payload = self.engine.execute(query).scalar()
+
+        if payload is None:
+            self.statistics.miss()
+        else:
+            self.statistics.hit()
+
+        return payload
+
+    def set(self, key, version, payload):
+        size = payload_size(payload)
+
+        if size > self.max_size:
+            return
+
+        values = dict(
+            key=key, version=version, payload=payload, size=size,
+            created=utils.utcnow()
+        )
+
+        with self.engine.begin() as connection:
+            if postgres.supports_on_conflict(connection.dialect):
+                statement = self.table.insert().values(**values).compile(
+                    dialect=connection.dialect
+                )
+                connection.execute(
+                    u'%s ON CONFLICT (key) DO UPDATE SET '
+                    u'version = excluded.version, '
+                    u'payload = excluded.payload, '
+                    u'size = excluded.size, '
+                    u'created = excluded.created' % statement,
+                    statement.params
+                )
+            else:
+                connection.execute(
+                    self.table.delete().where(self.table.c.key == key)
+                )
+                connection.execute(self.table.insert().values(**values))
+
+        self.evict()
+
+    def evict(self, now=None):
+        """ Drops the oldest events if the cache is larger than its size.
+        Does nothing if the last eviction is less than EVICTION_INTERVAL
+        seconds ago. """
+
+        now = now or time.time()
+
+        with self.lock:
+            if now - self.last_eviction < EVICTION_INTERVAL:
+                return
+
+            self.last_eviction = now
+
+        if self.total_size() <= self.max_size:
+            return
+
+        evicted = self.engine.execute(text("""
+            DELETE FROM event_cache WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, sum(size) OVER (
+                        ORDER BY created DESC, key
+                    ) AS total FROM event_cache
+                ) AS sizes WHERE total > :max_size
+            )
+        """), max_size=self.max_size).rowcount
+
+        if evicted:
+            self.statistics.evicted(evicted)
+
+    def clear(self):
+        self.engine.execute(self.table.delete())
+
+    def __len__(self):
+        return self.engine.execute(
+            select([func.count()]).select_from(self.table)
+        ).scalar()
+
+    def total_size(self):
+        return self.engine.execute(
+            select([func.coalesce(func.sum(self.table.c.size), 0)])
+        ).scalar()
+
+
+backends = {
+    'memory': MemoryBackend,
+    'postgres': PostgresBackend
+}
+
+
+def get_cache():
+    """ Returns the configured cache backend (see module docstring) or None
+    if the event cache is disabled. """
+
+    name = (utils.get_config('event-cache') or '').strip().lower()
+
+    if not name:
+        return None
+
+    assert name in backends, "unknown event-cache backend: %s" % name
+
+    # the memory backend is shared by all sites of the process
+    if name == 'memory':
+        dsn = None
+    else:
+        dsn = getUtility(ISessionUtility).get_dsn(utils.getSite())
+
+    if (name, dsn) not in _caches:
+        with _caches_lock:
+            if (name, dsn) not in _caches:
+                size = utils.get_config('event-cache-size') or DEFAULT_SIZE
+                _caches[(name, dsn)] = backends[name](
+                    int(float(size) * 1024 * 1024), dsn
+                )
+
+    return _caches[(name, dsn)]
+
+
+def cached_events(key, version, render):
+    """ Returns the events cached under the given key for the given version
+    of the resource. If there are none, they are rendered by calling the
+    given function and cached for later requests.
+
+    """
+    cache = get_cache()
+
+    if cache is None:
+        return render()
+
+    payload = cache.get(key, version)
+
+    if payload is None:
+        payload = render()
+        cache.set(key, version, payload)
+
+    return payload
@@ -1,5 +1,10 @@
 import codecs
-from collections import namedtuple
+import csv
+import json
+import pkg_resources
+import tempfile
+from collections import namedtuple, OrderedDict
+from cStringIO import StringIO
 
 from five import grok
 from zope.interface import Interface
@@ -9,7 +14,17 @@ from seantis.reservation import form
 from seantis.reservation import utils
 from seantis.reservation import exports
 
-Source = namedtuple('Source', ['id', 'title', 'description', 'method'])
+try:
+    pkg_resources.get_distribution('XlsxWriter')
+    from xlsxwriter.workbook import Workbook
+except pkg_resources.DistributionNotFound:
+    HAS_XLSXWRITER = False
+else:
+    HAS_XLSXWRITER = True
+
+Source = namedtuple(
+    'Source', ['id', 'title', 'description', 'method', 'records']
+)
 
 sources = [
     Source('reservations', _(u'Reservations (Normal)'), 
@@ -19,6 +34,9 @@ sources = [
         ), 
         lambda resources, language: exports.reservations.dataset(
             resources, language, compact=False
+        ),
+        lambda resources, language: exports.reservations.records(
+            resources, language, compact=False
         )
     ),
 
@@ -30,6 +48,9 @@ sources = [
         ), 
         lambda resources, language: exports.reservations.dataset(
             resources, language, compact=True
+        ),
+        lambda resources, language: exports.reservations.records(
+            resources, language, compact=True
         )
     )
 ]
@@ -41,6 +62,9 @@ extensions = {
     'json': _(u'JSON Format')
 }
 
+if HAS_XLSXWRITER:
+    extensions['xlsx'] = _(u'Excel 2007 Format')
+
 
 def get_exports(context, request, uuids):
     Export = namedtuple(
@@ -120,16 +144,25 @@ class ExportView(grok.View, form.ResourceParameterView):
     def language(self):
         return self.request.get('lang', 'en')
 
-    @property
-    def source(self):
+    def get_source(self):
         source_id = self.request.get('source')
         source = next((s for s in sources if s.id == source_id), None)
 
         if not source:
             raise NotImplementedError
 
+        return source
+
+    @property
+    def source(self):
+        source = self.get_source()
         return lambda: source.method(self.resources, self.language)
 
+    @property
+    def records(self):
+        source = self.get_source()
+        return lambda: source.records(self.resources, self.language)
+
     def render(self, **kwargs):
         filename = '%s.%s' % (self.context.title, self.file_extension)
         filename = codecs.utf_8_encode('filename="%s"' % filename)[0]
@@ -147,19 +180,162 @@ class ExportView(grok.View, form.ResourceParameterView):
         return output
 
 
+def csv_chunks(headers, records, chunk_size=100):
+    """ Yields the csv lines of the given headers and records, joined into
+    chunks of chunk_size lines. The output is the same as tablib's.
+
+    """
+    output = StringIO()
+    writer = csv.writer(output)
+
+    def encode(value):
+        if value is None:
+            return ''
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
+
+    writer.writerow([encode(h) for h in headers])
+
+    for ix, record in enumerate(records, start=1):
+        writer.writerow([encode(v) for v in record])
+
+        if ix % chunk_size == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+
+    yield output.getvalue()
+
+
+def json_chunks(headers, records, chunk_size=100):
+    """ Yields the json list of the given headers and records, one object per
+    record, joined into chunks of chunk_size records.
+
+    """
+    def dump(record):
+        return json.dumps(OrderedDict(zip(headers, record)), default=unicode)
+
+    chunk = ['[']
+
+    for ix, record in enumerate(records):
+        if ix > 0:
+            chunk.append(', ')
+
+        chunk.append(dump(record))
+
+        if len(chunk) >= chunk_size * 2:
+            yield ''.join(chunk)
+            chunk = []
+
+    chunk.append(']')
+    yield ''.join(chunk)
+
+
+# the number of rows in an xlsx worksheet, including the headers
+XLSX_MAX_ROWS = 1048576
+
+
+def xlsx_chunks(headers, records, chunk_size=64 * 1024):
+    """ Writes the given headers and records to an xlsx workbook and yields
+    the resulting file in chunks of chunk_size bytes.
+
+    The workbook is written in constant memory mode, where each row is
+    flushed to disk once the next row is written. If the records don't fit
+    in a single worksheet, further worksheets are added as needed.
+
+    Requires XlsxWriter.
+
+    """
+    with tempfile.NamedTemporaryFile(suffix='.xlsx') as output:
+
+        workbook = Workbook(output.name, {'constant_memory': True})
+
+        worksheet, row = None, XLSX_MAX_ROWS
+        for record in records:
+
+            if row == XLSX_MAX_ROWS:
+                worksheet = workbook.add_worksheet()
+                worksheet.write_row(0, 0, headers)
+                row = 1
+
+            worksheet.write_row(row, 0, record)
+            row += 1
+
+        if worksheet is None:
+            workbook.add_worksheet().write_row(0, 0, headers)
+
+        workbook.close()
+
+        output.seek(0)
+        for chunk in iter(lambda: output.read(chunk_size), ''):
+            yield chunk
+
+
+class StreamingExportView(ExportView):
+    """Exports the reservations without loading them all first. The output
+    is written to the response in chunks while the reservations are read
+    from the database.
+
+    """
+
+    grok.baseclass()
+
+    def serialize(self, headers, records):
+        raise NotImplementedError
+
+    def render(self, **kwargs):
+        filename = '%s.%s' % (self.context.title, self.file_extension)
+        filename = codecs.utf_8_encode('filename="%s"' % filename)[0]
+
+        headers, records = self.records()
+
+        # the length is not known in advance, so there's no Content-Length
+        RESPONSE = self.request.RESPONSE
+        RESPONSE.setHeader("Content-disposition", filename)
+        RESPONSE.setHeader(
+            "Content-Type", "%s;charset=utf-8" % self.content_type
+        )
+
+        for chunk in self.serialize(headers, records):
+            RESPONSE.write(chunk)
+
+        return ''
+
+
 class XlsExportView(ExportView):
     grok.name('reservation-export.xls')
     content_type = 'application/xls'
     file_extension = 'xls'
 
 
-class JsonExportView(ExportView):
+class JsonExportView(StreamingExportView):
     grok.name('reservation-export.json')
     content_type = 'application/json'
     file_extension = 'json'
 
+    def serialize(self, headers, records):
+        return json_chunks(headers, records)
+
 
-class CsvExportView(ExportView):
+class CsvExportView(StreamingExportView):
     grok.name('reservation-export.csv')
     content_type = 'application/csv'
     file_extension = 'csv'
+
+    def serialize(self, headers, records):
+        return csv_chunks(headers, records)
+
+
+if HAS_XLSXWRITER:
+
+    class XlsxExportView(StreamingExportView):
+        grok.name('reservation-export.xlsx')
+        content_type = (
+            'application/'
+            'vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+        file_extension = 'xlsx'
+
+        def serialize(self, headers, records):
+            return xlsx_chunks(headers, records)
@@ -3,12 +3,19 @@ from seantis.reservation import _
 from seantis.reservation import utils
 from seantis.reservation.form import ReservationDataView
 from seantis.reservation.models import Reservation
+from seantis.reservation.models.reservation import timespans_by_reservation
 from zope import i18n
 from zope.component.hooks import getSite
 from zope.i18n import translate
 from zope.i18nmessageid import Message
+from sqlalchemy.orm import undefer
 import tablib
 
+# the number of reservations read at once when exporting
+CHUNK_SIZE = 500
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M'
+
 
 class Translator(object):
 
@@ -66,64 +73,80 @@ def dataset(resources, language, compact=False):
 
     """
 
+    headers, rows = records(resources, language, compact)
+
+    # put the results in a tablib dataset
+    return generate_dataset(headers, rows)
+
+
+def records(resources, language, compact=False):
+    """ Returns the headers and a generator of records of the reservations
+    export (see dataset).
+
+    The reservations are read in chunks and the records are generated while
+    iterating, so the export never has to be held in memory as a whole.
+
+    """
+
     translator = Translator(language)
-    reservations = fetch_records(resources)
 
     # create the headers
     headers = translator.translate(basic_headers())
-    dataheaders = additional_headers(reservations)
+    dataheaders = stream_additional_headers(resources)
     headers.extend(dataheaders)
 
-    # use dataview for display info helper view (yep, could be nicer)
-    dataview = ReservationDataView()
-
-    # for each reservation get a record per timeslot (which is a single slot
-    # for reservations targeting an allocation and n slots for a reservation
-    # targeting a group)
-    records = []
-    for r in reservations:
-
-        token = utils.string_uuid(r.token)
-        resource = resources[utils.string_uuid(r.resource)]
-
-        if compact:
-            timespans = utils.unite_dates(r.timespans())
-        else:
-            timespans = r.timespans()
-
-        datetime_format = '%Y-%m-%d %H:%M'
-
-        for start, end in timespans:
-            record = [
-                get_parent_title(resource),
-                resource.title,
-                token,
-                r.email,
-                start.strftime(datetime_format),
-                end.strftime(datetime_format),
-                dataview.display_reservation_data(utils.whole_day(start, end)),
-                _(r.status.capitalize()),
-                r.quota,
-                r.created.strftime(datetime_format),
-                r.modified and r.modified.strftime(datetime_format) or None,
-            ]
-            record.extend(
-                additional_columns(
-                    r, dataheaders, dataview.display_reservation_data
-                )
-            )
-
-            translator.translate(record)
-            records.append(record)
+    def generate():
 
-    # put the results in a tablib dataset
-    return generate_dataset(headers, records)
+        # use dataview for display info helper view (yep, could be nicer)
+        dataview = ReservationDataView()
 
+        # for each reservation get a record per timeslot (which is a single
+        # slot for reservations targeting an allocation and n slots for a
+        # reservation targeting a group)
+        for chunk in stream_records(resources):
 
-def fetch_records(resources):
-    """ Returns the records used for the dataset. """
-    if not resources:
-        return []
+            all_timespans = timespans_by_reservation(chunk)
+
+            for r in chunk:
+
+                token = utils.string_uuid(r.token)
+                resource = resources[utils.string_uuid(r.resource)]
+
+                if compact:
+                    timespans = utils.unite_dates(all_timespans[r])
+                else:
+                    timespans = all_timespans[r]
+
+                for start, end in timespans:
+                    record = [
+                        get_parent_title(resource),
+                        resource.title,
+                        token,
+                        r.email,
+                        start.strftime(DATETIME_FORMAT),
+                        end.strftime(DATETIME_FORMAT),
+                        dataview.display_reservation_data(
+                            utils.whole_day(start, end)
+                        ),
+                        _(r.status.capitalize()),
+                        r.quota,
+                        r.created.strftime(DATETIME_FORMAT),
+                        r.modified and r.modified.strftime(DATETIME_FORMAT)
+                        or None,
+                    ]
+                    record.extend(
+                        additional_columns(
+                            r, dataheaders, dataview.display_reservation_data
+                        )
+                    )
+
+                    yield translator.translate(record)
+
+    return headers, generate()
+
+
+def records_query(resources):
+    """ Returns the query of the reservations in the export. """
 
     query = Session.query(Reservation)
     query = query.filter(Reservation.resource.in_(resources.keys()))
@@ -135,7 +158,40 @@ def fetch_records(resources):
         Reservation.token,
     )
 
-    return query.all()
+    return query
+
+
+def fetch_records(resources):
+    """ Returns the records used for the dataset. """
+    if not resources:
+        return []
+
+    return records_query(resources).all()
+
+
+def stream_records(resources, chunk_size=CHUNK_SIZE):
+    """ Yields the records used for the dataset in lists of chunk_size
+    records. On PostgreSQL the records are read using a server side cursor.
+
+    """
+    if not resources:
+        return
+
+    query = records_query(resources)
+    query = query.options(undefer('created'), undefer('modified'))
+    query = query.execution_options(stream_results=True)
+    query = query.yield_per(chunk_size)
+
+    chunk = []
+    for reservation in query:
+        chunk.append(reservation)
+
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
 
 
 def display_description(value):
@@ -170,6 +226,46 @@ def additional_headers(reservations):
     return headers
 
 
+def stream_additional_headers(resources, chunk_size=CHUNK_SIZE):
+    """ Returns the same as additional_headers(fetch_records(resources)),
+    without loading the reservations. Only the data column is read, using
+    a server side cursor on PostgreSQL.
+
+    The memory used is bounded by the number of distinct headers, not by
+    the number of reservations.
+
+    """
+    if not resources:
+        return []
+
+    query = records_query(resources)
+    query = query.filter(Reservation.data != None)
+    query = query.with_entities(Reservation.data)
+    query = query.execution_options(stream_results=True)
+    query = query.yield_per(chunk_size)
+
+    headers = []
+    known = set()
+    keys = {}
+
+    for data, in query:
+        for form in data.values():
+            for field in sorted(form["values"], key=lambda f: f["sortkey"]):
+
+                # fieldkey translates the descriptions, which is done only
+                # once for each combination
+                description = (form["desc"], field["desc"])
+                if description not in keys:
+                    keys[description] = fieldkey(form, field)
+
+                key = keys[description]
+                if key not in known:
+                    known.add(key)
+                    headers.append(key)
+
+    return headers
+
+
 def additional_columns(reservation, headers, display_info=lambda x: x):
     """ Given a reservation and the list of additional headers return a list
     of columns filled with either None or the value of the json data.
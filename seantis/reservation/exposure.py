@@ -5,12 +5,13 @@ from zope.component import getMultiAdapter
 
 from seantis.reservation.utils import is_uuid, get_resource_by_uuid
 from seantis.reservation.utils import string_uuid, real_uuid
-from seantis.reservation.timeframe import timeframes_by_context
+from seantis.reservation.timeframe import timeframe_index
 
 
-def for_allocations(context, resources):
-    """Returns a function which takes an allocation and returns true if the
-    allocation can be exposed.
+def timeframe_indexes(resources):
+    """Returns the timeframe index of each of the given resources, keyed by
+    uuid. Resources whose hidden allocations may be seen by the current user
+    get None instead of an index.
 
     resources can be a list of uuids or a list of resource objects
 
@@ -25,7 +26,7 @@ def for_allocations(context, resources):
 
     resource_objects = dict([get_object(o) for o in resources])
 
-    # get timeframes for each uuid
+    # get the timeframe index of each uuid
     timeframes = {}
     for uuid, resource in resource_objects.items():
 
@@ -34,27 +35,35 @@ def for_allocations(context, resources):
         # 'is_exposed'
         if checkPermission(
                 'seantis.reservation.ViewHiddenAllocations', resource):
-            timeframes[uuid] = []
+            timeframes[uuid] = None
         else:
-            timeframes[uuid] = timeframes_by_context(resource)
+            timeframes[uuid] = timeframe_index(resource)
+
+    return timeframes
+
+
+def for_allocations(context, resources):
+    """Returns a function which takes an allocation and returns true if the
+    allocation can be exposed.
+
+    resources can be a list of uuids or a list of resource objects
+
+    """
+
+    timeframes = timeframe_indexes(resources)
 
     # returning closure
     def is_exposed(allocation):
 
         # use the mirror_of as resource-keys of mirrors do not really exist
         # as plone objects
-        frames = timeframes[allocation.mirror_of]
+        index = timeframes[allocation.mirror_of]
 
-        if not frames:
+        if index is None:
             return True
 
         # the start date is relevant
-        day = allocation.start.date()
-        for frame in frames:
-            if frame.start <= day and day <= frame.end:
-                return frame.visible()
-
-        return False
+        return index.is_exposed(allocation.start.date())
 
     return is_exposed
 
@@ -0,0 +1,4 @@
+import reservations
+
+# Pyflakes
+reservations
@@ -0,0 +1,535 @@
+""" Imports reservations from CSV or JSON, e.g. when migrating bookings from
+another system or when booking a whole season for a club.
+
+Going through Scheduler.reserve and Scheduler.approve_reservation for each
+booking runs the sanity checks against the database for every single
+reservation and sends out a mail for each of them. The import instead
+loads the allocations of a whole chunk of records at once and validates
+the records against them in memory.
+
+Each chunk is written in a savepoint of the current transaction, which is
+committed by the caller. Entry points owning the transaction (like the
+reservation-import view) may instead commit each chunk in a transaction of
+its own, see ReservationImport.run.
+
+Records which cannot be imported are skipped and reported as conflicts.
+If a chunk fails as a whole (e.g. because another transaction reserved
+the same slots in the meantime), all its records are reported.
+
+The imported reservations are approved, unless their allocation requires
+manual approval. Those reservations are imported as pending and listed in
+the report, unless force_approve=True is given (e.g. when migrating
+bookings which were approved in the other system).
+
+No mails are sent by default. With notify=True a single confirmation mail
+is sent to each reservee per chunk.
+
+Managers may post the records as file to the reservation-import view,
+which returns the report as json:
+
+    curl -u admin -F file=@bookings.csv -F approve=on \
+        http://localhost:8080/site/@@reservation-import
+
+The records need the following fields (CSV columns):
+
+    resource    the uuid of the resource
+    email       the email of the reservee
+    start, end  the reserved timespan (YYYY-MM-DD HH:MM or ISO 8601)
+    quota       the reservation quota (optional, 1 by default)
+    data        the additional form data as json (optional)
+
+Instead of start and end, JSON records may contain a list of [start, end]
+pairs in a dates field, in which case one reservation is made per pair.
+
+"""
+
+import csv
+import json
+
+from collections import namedtuple
+from datetime import datetime
+from itertools import groupby, islice
+from operator import attrgetter
+from uuid import UUID, uuid1 as new_uuid
+
+import isodate
+
+from five import grok
+from zope.interface import Interface
+
+from seantis.reservation import db
+from seantis.reservation import error
+from seantis.reservation import utils
+from seantis.reservation import Session
+from seantis.reservation.events import ReservationsConfirmedEvent
+from seantis.reservation.exports.reservations import DATETIME_FORMAT
+from seantis.reservation.interfaces import validate_email
+from seantis.reservation.intervals import IntervalIndex
+from seantis.reservation.models import Allocation, ReservedSlot, Reservation
+from seantis.reservation.raster import rasterize_span
+from seantis.reservation.session import (
+    is_retryable,
+    lock_resource,
+    notify,
+    retry_transaction,
+    serialized_call
+)
+
+# the number of records written in one transaction
+CHUNK_SIZE = 500
+
+Record = namedtuple(
+    'Record', ['line', 'resource', 'email', 'start', 'end', 'quota', 'data']
+)
+
+
+class Conflict(namedtuple(
+    'Conflict', ['line', 'resource', 'email', 'start', 'end', 'error']
+)):
+    """ A record which could not be imported, together with the error. """
+
+    @property
+    def reason(self):
+        return describe_error(self.error)
+
+    def as_dict(self):
+        return dict(
+            line=self.line,
+            resource=self.resource and utils.string_uuid(self.resource),
+            email=self.email,
+            start=self.start,
+            end=self.end,
+            error=type(self.error).__name__,
+            reason=self.reason
+        )
+
+
+def describe_error(exception):
+    """ Returns the message shown to the user for the given error. """
+
+    if isinstance(exception, error.CustomReservationError):
+        return exception.msg
+
+    message = error.errormap.get(type(exception))
+
+    if message:
+        return message
+
+    if exception.args:
+        return exception.args[0]
+
+    return type(exception).__name__
+
+
+def read_csv(stream):
+    """ Yields the line number and the row of each record in the given csv
+    stream, which has a header with the column names. """
+
+    reader = csv.DictReader(stream)
+
+    for line, row in enumerate(reader, start=2):
+        yield line, dict(
+            (key, value.decode('utf-8')) for key, value in row.items()
+            if key and value is not None
+        )
+
+
+def read_json(stream):
+    """ Yields the position and the object of each record in the list of
+    records found in the given json stream. """
+
+    for line, entry in enumerate(json.load(stream), start=1):
+        yield line, entry
+
+
+readers = {
+    'csv': read_csv,
+    'json': read_json
+}
+
+
+def parse_datetime(value):
+    if isinstance(value, datetime):
+        return value
+
+    try:
+        return datetime.strptime(value, DATETIME_FORMAT)
+    except ValueError:
+        return isodate.parse_datetime(value)
+
+
+def parse_entry(line, entry):
+    """ Returns the records of the given entry. Raises an exception if the
+    entry is malformed. """
+
+    if not utils.is_uuid(entry.get('resource')):
+        raise error.ReservationParametersInvalid
+
+    resource = UUID(utils.string_uuid(entry['resource']))
+
+    if 'dates' in entry:
+        dates = entry['dates']
+    else:
+        dates = [(entry.get('start'), entry.get('end'))]
+
+    try:
+        dates = [(parse_datetime(s), parse_datetime(e)) for s, e in dates]
+        quota = int(entry.get('quota') or 1)
+    except (TypeError, ValueError):
+        raise error.ReservationParametersInvalid
+
+    data = entry.get('data') or None
+
+    if isinstance(data, basestring):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            raise error.ReservationParametersInvalid
+
+    return [
+        Record(line, resource, entry.get('email'), start, end, quota, data)
+        for start, end in dates
+    ]
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+
+    while True:
+        chunk = list(islice(iterator, size))
+
+        if not chunk:
+            break
+
+        yield chunk
+
+
+class ReservationImport(object):
+    """ Imports records in chunks and keeps track of the outcome. The tokens
+    of the imported reservations are found in self.imported, the records
+    which could not be imported in self.conflicts.
+
+    """
+
+    def __init__(self, language=None, approve=True, force_approve=False,
+                 notify=False, chunk_size=CHUNK_SIZE):
+        self.language = language or utils.get_current_site_language()
+        self.approve = approve
+        self.force_approve = force_approve
+        self.notify = notify
+        self.chunk_size = chunk_size
+
+        self.imported = []
+        self.conflicts = []
+
+        # the tokens of the reservations left pending, because their
+        # allocation requires manual approval
+        self.pending = []
+
+    def run(self, entries, commit=False):
+        """ Imports the given entries as yielded by the readers. Returns
+        the import itself.
+
+        The chunks are written in savepoints of the current transaction,
+        unless commit is True. Then each chunk is written and committed in
+        a transaction of its own (see session.retry_transaction), which is
+        only meant for callers owning the transaction.
+
+        """
+
+        for chunk in chunked(self.records(entries), self.chunk_size):
+            if commit:
+                self.commit_chunk(chunk)
+            else:
+                self.import_chunk(chunk)
+
+        return self
+
+    def report(self):
+        return dict(
+            imported=len(self.imported),
+            pending=[utils.string_uuid(token) for token in self.pending],
+            conflicts=[conflict.as_dict() for conflict in self.conflicts]
+        )
+
+    def records(self, entries):
+        for line, entry in entries:
+            try:
+                records = parse_entry(line, entry)
+            except Exception, e:
+                self.add_conflict(Record(
+                    line, entry.get('resource'), entry.get('email'),
+                    None, None, None, None
+                ), e)
+            else:
+                for record in records:
+                    yield record
+
+    def add_conflict(self, record, exception):
+        self.conflicts.append(Conflict(
+            record.line, record.resource, record.email, record.start,
+            record.end, exception
+        ))
+
+    def import_chunk(self, records):
+        """ Imports the given records in a savepoint, which is rolled back
+        if the chunk fails as a whole. """
+
+        marks = len(self.imported), len(self.pending), len(self.conflicts)
+
+        def write():
+            self.reset(marks)
+            return self.write_chunk(records)
+
+        try:
+            reservations = serialized_call(write)()
+        except Exception, e:
+
+            # the transaction is lost, the chunk has to be run again
+            if is_retryable(e):
+                raise
+
+            self.fail_chunk(records, marks, e)
+        else:
+            self.imported.extend(r.token for r in reservations)
+
+    def commit_chunk(self, records):
+        """ Imports the given records in a transaction of its own. """
+
+        marks = len(self.imported), len(self.pending), len(self.conflicts)
+
+        def run():
+            self.reset(marks)
+            self.import_chunk(records)
+
+        try:
+            retry_transaction(run)
+        except Exception, e:
+            self.fail_chunk(records, marks, e)
+
+    def reset(self, marks):
+        imported, pending, conflicts = marks
+
+        del self.imported[imported:]
+        del self.pending[pending:]
+        del self.conflicts[conflicts:]
+
+    def fail_chunk(self, records, marks, exception):
+        """ Replaces the outcome of the given chunk with the error which
+        caused the whole chunk to fail. """
+
+        self.reset(marks)
+
+        for record in records:
+            self.add_conflict(record, exception)
+
+    def write_chunk(self, records):
+        """ Writes the reservations of the given records, returning them.
+        The records of each resource are validated against the allocations
+        loaded at once.
+
+        """
+        reservations = []
+
+        key = lambda record: record.resource.hex
+        for resource, records in groupby(sorted(records, key=key), key=key):
+            reservations.extend(self.write_resource(resource, list(records)))
+
+        Session.flush()
+
+        if self.notify and reservations:
+            notify(ReservationsConfirmedEvent(reservations, self.language))
+
+        return reservations
+
+    def write_resource(self, resource, records):
+        lock_resource(resource)
+
+        scheduler = db.Scheduler(resource, language=self.language)
+
+        start = min(r.start for r in records)
+        end = max(r.end for r in records)
+
+        query = db.all_allocations_in_range(start, end)
+        query = query.filter(Allocation.resource == scheduler.uuid)
+
+        masters = IntervalIndex(
+            query, start=attrgetter('_start'), end=attrgetter('_end')
+        )
+        capacities = {}
+
+        reservations = []
+
+        for record in records:
+            try:
+                reservation = self.write_record(
+                    scheduler, masters, capacities, record
+                )
+            except Exception, e:
+                self.add_conflict(record, e)
+            else:
+                reservations.append(reservation)
+
+        if reservations:
+            db.bump_resource_version(scheduler.uuid)
+
+        return reservations
+
+    def write_record(self, scheduler, masters, capacities, record):
+        """ Validates the given record like Scheduler.reserve and writes it,
+        approved if the import approves reservations and the allocation does
+        not require manual approval (see force_approve). """
+
+        start, end = record.start, record.end
+
+        if abs((end - start).days) >= 1:
+            raise error.ReservationTooLong
+
+        if start > end or (end - start).seconds < 5 * 60:
+            raise error.ReservationParametersInvalid
+
+        validate_email(record.email)
+
+        candidates = [
+            m for m in masters.overlapping(start, end)
+            if m.overlaps(start, end)
+        ]
+
+        if len(candidates) != 1 or not candidates[0].contains(start, end):
+            raise error.ReservationOutOfBounds
+
+        master = candidates[0]
+
+        if record.quota < 1:
+            raise error.InvalidQuota
+
+        if 0 < master.reservation_quota_limit < record.quota:
+            raise error.QuotaOverLimit
+
+        if master.quota < record.quota:
+            raise error.QuotaImpossible
+
+        reservation = Reservation.for_allocation(master)
+        reservation.start, reservation.end = rasterize_span(
+            start, end, master.raster
+        )
+        reservation.token = new_uuid()
+        reservation.email = record.email
+        reservation.quota = record.quota
+        reservation.data = record.data
+        reservation.resource = scheduler.uuid
+
+        approve = self.approve and (
+            self.force_approve or not master.approve_manually
+        )
+
+        if approve:
+            if master.id not in capacities:
+                capacities[master.id] = scheduler.capacity(master, start, end)
+
+            self.write_slots(
+                capacities[master.id], reservation, start, end, record.quota
+            )
+            reservation.status = u'approved'
+        elif self.approve:
+            self.pending.append(reservation.token)
+
+        Session.add(reservation)
+
+        return reservation
+
+    def write_slots(self, capacity, reservation, start, end, quota):
+        """ Writes the reserved slots of the given reservation on the first
+        free siblings of the given capacity, one for each quota. """
+
+        spots = []
+
+        for i in range(quota):
+            allocation = capacity.find_spot(start, end)
+
+            if not allocation:
+                for allocation, starts in spots:
+                    capacity.release(allocation, starts)
+
+                raise error.AlreadyReservedError
+
+            starts = [s for s, e in allocation.all_slots(start, end)]
+            capacity.reserve(allocation, starts)
+            spots.append((allocation, starts))
+
+        for allocation, starts in spots:
+            for slot_start, slot_end in allocation.all_slots(start, end):
+                slot = ReservedSlot()
+                slot.start = slot_start
+                slot.end = slot_end
+                slot.resource = allocation.resource
+                slot.reservation_token = reservation.token
+
+                allocation.reserved_slots.append(slot)
+
+            if allocation.is_transient:
+                Session.add(allocation)
+
+
+def import_reservations(stream, format='csv', **options):
+    """ Imports the reservations found in the given stream of the given
+    format (csv or json). The options are passed to ReservationImport.
+    Returns the ReservationImport instance after the import.
+
+    """
+    return ReservationImport(**options).run(readers[format](stream))
+
+
+def request_flag(request, name, default=False):
+    value = request.form.get(name)
+
+    if value is None:
+        return default
+
+    return value.strip().lower() in ('on', 'true', 'yes', '1')
+
+
+class ReservationImportView(grok.View):
+    """ Imports the reservations of the csv or json file posted as 'file'
+    and returns the report as json. Each chunk of the import is committed
+    on its own.
+
+    The format is taken from the 'format' field or the file extension. The
+    'approve', 'force_approve' and 'notify' fields are passed as options
+    (see ReservationImport).
+
+    """
+
+    permission = 'cmf.ManagePortal'
+
+    grok.name('reservation-import')
+    grok.require(permission)
+
+    grok.context(Interface)
+
+    def render(self):
+        self.request.response.setHeader('Content-Type', 'application/json')
+
+        upload = self.request.form.get('file')
+
+        if self.request.get('REQUEST_METHOD') != 'POST' or not upload:
+            self.request.response.setStatus(400)
+            return json.dumps(dict(error=u'no file posted'))
+
+        format = self.request.form.get('format')
+
+        if not format:
+            filename = getattr(upload, 'filename', None) or ''
+            format = filename.lower().endswith('.json') and 'json' or 'csv'
+
+        if format not in readers:
+            self.request.response.setStatus(400)
+            return json.dumps(dict(error=u'unknown format: %s' % format))
+
+        result = ReservationImport(
+            approve=request_flag(self.request, 'approve', True),
+            force_approve=request_flag(self.request, 'force_approve'),
+            notify=request_flag(self.request, 'notify')
+        ).run(readers[format](upload), commit=True)
+
+        return json.dumps(result.report())
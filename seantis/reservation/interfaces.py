@@ -796,6 +796,16 @@ class IReservationIdForm(Interface):
     )
 
 
+class IGroupIdForm(Interface):
+    """ Describes a form with a hidden group field. Use with
+    seantis.reservation.reserve.ReservationGroupApprovalForm. """
+
+    group = schema.Text(
+        title=_(u'Group'),
+        required=False
+    )
+
+
 class IAllocationIdForm(IReservationIdForm):
     """ Describes a form with a hidden reservation-id and allocation-id field.
     Use with seantis.reservation.reserve.ReservationRemovalForm. """
@@ -0,0 +1,76 @@
+""" Lookup of the items overlapping a timespan amongst a larger set of
+items, without going through all of them.
+
+Used to share the blocked periods of a calendar range between the
+allocations rendered in it. Each allocation only needs the few periods in
+its own timespan, so a linear scan over all periods of the range for each
+allocation would be wasteful.
+
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from operator import attrgetter
+
+from seantis.reservation.sortedcollection import SortedCollection
+
+
+class IntervalIndex(object):
+    """ Holds items with a start and an end (blocked periods by default)
+    sorted by start.
+
+    Since the items may have any length, the overlapping items are found by
+    looking at the items starting between the given start minus the length
+    of the longest item and the given end.
+
+    """
+
+    def __init__(self, items=(), start=attrgetter('start'),
+                 end=attrgetter('end')):
+        self.items = SortedCollection(items, key=start)
+        self.start, self.end = start, end
+
+        self.starts = [start(item) for item in self.items]
+        self.longest = max(
+            [end(item) - start(item) for item in self.items] or [None]
+        )
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def overlapping(self, start, end):
+        """ Returns the items overlapping the given timespan, ordered by
+        start. Like utils.overlaps the start and end are inclusive.
+
+        """
+        if not self.items:
+            return []
+
+        lower = bisect_left(self.starts, start - self.longest)
+        upper = bisect_right(self.starts, end)
+
+        return [
+            item for item in self.items[lower:upper]
+            if self.end(item) >= start
+        ]
+
+
+def index_by_resource(items):
+    """ Returns a dictionary of IntervalIndex instances keyed by the resource
+    of the given items. Resources without items get an empty index.
+
+    """
+    grouped = defaultdict(list)
+
+    for item in items:
+        grouped[item.resource].append(item)
+
+    indexes = defaultdict(IntervalIndex)
+    indexes.update(
+        (resource, IntervalIndex(items)) for resource, items in grouped.items()
+    )
+
+    return indexes
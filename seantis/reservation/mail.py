@@ -23,6 +23,7 @@ from seantis.reservation.interfaces import IReservationUpdatedEvent
 from seantis.reservation.interfaces import IReservationsConfirmedEvent
 from seantis.reservation.interfaces import OverviewletManager
 from seantis.reservation.mail_templates import templates
+from seantis.reservation.models.reservation import timespans_by_reservation
 from seantis.reservation.reserve import ReservationUrls
 from z3c.form import button
 from zope.component import adapts
@@ -172,6 +173,8 @@ class NotificationMailHandler(object):
         by_recipient = groupby(
             sorted(reservations, key=groupkey), key=groupkey)
 
+        timespans = timespans_by_reservation(reservations)
+
         for recipient, grouped_reservations in by_recipient:
 
             lines = []
@@ -183,7 +186,7 @@ class NotificationMailHandler(object):
                 prefix = '' if reservation.autoapprovable else '* '
                 lines.append(prefix + utils.get_resource_title(resource))
 
-                for start, end in reservation.timespans():
+                for start, end in timespans[reservation]:
                     lines.append(utils.display_date(start, end))
 
                 lines.append('')
@@ -2,9 +2,11 @@ from logging import getLogger
 log = getLogger('seantis.reservation')
 
 import re
+import json
 import threading
 
 from five import grok
+from sqlalchemy.engine.url import make_url
 
 from zope.component import getUtility
 from zope.component.hooks import getSite
@@ -13,10 +15,13 @@ from zope.interface import Interface
 from ZServer.ClockServer import ClockServer
 
 from seantis.reservation import db
+from seantis.reservation import eventcache
+from seantis.reservation import utils
+from seantis.reservation import workqueue
 from seantis.reservation.interfaces import IResourceViewedEvent
 from seantis.reservation.session import ISessionUtility
 
-_connections = set()  # seantis.reservation database connections
+_connections = set()  # (group, seantis.reservation database connection)
 _clockservers = dict()  # list of registered Zope Clockservers
 
 # probably not needed as most operations are atomic and therefore protected
@@ -37,6 +42,13 @@ def on_resource_viewed(event):
     period = 15 * 60  # 15 minutes
     register_once_per_connection('/remove-expired-sessions', getSite(), period)
 
+    if workqueue.queue_enabled():
+        register_once_per_connection(
+            '/process-reservation-queue', getSite(), 1, group='queue',
+            user=utils.get_config('reservation-queue-user'),
+            password=utils.get_config('reservation-queue-password')
+        )
+
 
 def clear_clockservers():
     """ Clears the clockservers and connections for testing. """
@@ -50,7 +62,8 @@ def clear_clockservers():
         _clockservers.clear()
 
 
-def register_once_per_connection(method, site, period):
+def register_once_per_connection(method, site, period, group=None,
+                                 user=None, password=None):
     """ Registers the given method with a clockserver while making sure
     that the method is only registered once for each seantis.reservaiton db
     connection defined via the ISessionUtility.
@@ -62,6 +75,12 @@ def register_once_per_connection(method, site, period):
 
         period => interval by which the method is called by the clockserver
 
+        group  => the connections are tracked per group, so methods of
+                  different groups may be registered for the same connection
+
+        user,  => the credentials used by the clockserver to call the
+        password  method, if it is protected
+
     Returns True if a new server was registered, False if the connection
     was already present.
 
@@ -69,7 +88,7 @@ def register_once_per_connection(method, site, period):
 
     assert method.startswith('/')
 
-    connection = getUtility(ISessionUtility).get_dsn(site)
+    connection = (group, getUtility(ISessionUtility).get_dsn(site))
 
     if connection in _connections:
         return False
@@ -79,12 +98,12 @@ def register_once_per_connection(method, site, period):
     with locks['_connections']:
         _connections.add(connection)
 
-    register_server(method, period)
+    register_server(method, period, user, password)
 
     return True
 
 
-def register_server(method, period):
+def register_server(method, period, user=None, password=None):
     """ Registers the given method with a clockserver.
 
     Note that due to it's implementation there's no guarantee that the method
@@ -99,7 +118,8 @@ def register_server(method, period):
 
     with locks['_clockservers']:
         _clockservers[method] = ClockServer(
-            method, period, host='localhost', logger=ClockLogger(method)
+            method, period, user=user, password=password, host='localhost',
+            logger=ClockLogger(method)
         )
 
     return _clockservers[method]
@@ -152,3 +172,80 @@ class RemoveExpiredSessions(grok.View):
         log.info('removed the following reservation sessions: %s' % removed)
 
         return "removed %i reservation sessions" % len(removed)
+
+
+class ProcessReservationQueue(grok.View):
+    """ Makes the next batch of queued reservations (see workqueue.py) and
+    removes the old processed ones. Requires the manager permission, the
+    clockserver logs in with the configured queue user.
+
+    """
+
+    permission = "cmf.ManagePortal"
+
+    grok.name('process-reservation-queue')
+    grok.require(permission)
+
+    grok.context(Interface)
+
+    def render(self):
+        processed = workqueue.process_queue()
+        removed = workqueue.remove_processed()
+
+        return "processed %i queued reservations, removed %i" % (
+            processed, removed
+        )
+
+
+class PoolStatistics(grok.View):
+    """ Returns the connection checkout statistics of the shared pools as
+    json, to help sizing the pools. The passwords in the dsns are hidden.
+
+    """
+
+    permission = "cmf.ManagePortal"
+
+    grok.name('reservation-pool-statistics')
+    grok.require(permission)
+
+    grok.context(Interface)
+
+    def render(self):
+        statistics = getUtility(ISessionUtility).pool_statistics()
+
+        self.request.response.setHeader('Content-Type', 'application/json')
+
+        return json.dumps(sorted(
+            dict(dsn=repr(make_url(dsn)), isolation_level=level, **values)
+            for (dsn, level), values in statistics.items()
+        ))
+
+
+class EventCacheStatistics(grok.View):
+    """ Returns the hits, misses and evictions of the event cache as json,
+    together with the number and the size (in bytes) of the cached events.
+
+    """
+
+    permission = "cmf.ManagePortal"
+
+    grok.name('reservation-event-cache-statistics')
+    grok.require(permission)
+
+    grok.context(Interface)
+
+    def render(self):
+        cache = eventcache.get_cache()
+
+        self.request.response.setHeader('Content-Type', 'application/json')
+
+        if cache is None:
+            return json.dumps(dict(enabled=False))
+
+        statistics = cache.statistics.as_dict()
+        statistics['enabled'] = True
+        statistics['entries'] = len(cache)
+        statistics['size'] = cache.total_size()
+        statistics['max_size'] = cache.max_size
+
+        return json.dumps(statistics)
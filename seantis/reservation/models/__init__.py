@@ -1,13 +1,19 @@
 from allocation import Allocation
 from blocked_period import BlockedPeriod
+from cached_events import CachedEvents
+from queued_reservation import QueuedReservation
 from recurrence import Recurrence
 from reservation import Reservation
+from resource_version import ResourceVersion
 from reserved_slot import ReservedSlot
 
 
 # Pyflakes
 Allocation
 BlockedPeriod
+CachedEvents
+QueuedReservation
 ReservedSlot
 Reservation
+ResourceVersion
 Recurrence
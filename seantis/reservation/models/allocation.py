@@ -14,6 +14,7 @@ from sqlalchemy.orm import backref
 from sqlalchemy.orm.util import has_identity
 
 from seantis.reservation import ORMBase
+from seantis.reservation import postgres
 from seantis.reservation import utils
 from seantis.reservation.models import customtypes
 from seantis.reservation.raster import rasterize_span
@@ -231,18 +232,49 @@ class Allocation(TimestampMixin, ORMBase, OtherModels):
         else:
             start, end = utils.as_machine_date(start, end)
 
-        BlockedPeriod = self.models.BlockedPeriod
-        query = self._query_blocked_periods()
-        query = query.filter(BlockedPeriod.start <= end)
-        query = query.filter(BlockedPeriod.end >= start)
-
+        query = self._query_blocked_periods(start, end)
         return query.first() is not None
 
-    def _query_blocked_periods(self):
-        query = Session.query(self.models.BlockedPeriod)
+    def _query_blocked_periods(self, start=None, end=None):
+        """ Returns the blocked periods of the allocation's resource which
+        overlap the given timespan (the allocation by default).
+
+        """
+        if not (start and end):
+            start, end = self.start, self.end
+
+        BlockedPeriod = self.models.BlockedPeriod
+
+        query = Session.query(BlockedPeriod)
         query = query.filter_by(resource=self.resource)
+
+        query = postgres.filter_overlapping(
+            query, BlockedPeriod.start, BlockedPeriod.end, start, end
+        )
+
         return query
 
+    def blocked_slots(self, blocked_periods, start=None, end=None):
+        """ Returns the start of each slot of the given timespan (the
+        allocation by default) which is covered by one of the given blocked
+        periods. Blocked periods outside the timespan are ignored.
+
+        """
+        if not (start and end):
+            start, end = self.start, self.end
+
+        blocked = set()
+
+        for period in blocked_periods:
+            if not utils.overlaps(period.start, period.end, start, end):
+                continue
+
+            blocked.update(slot_start for slot_start, slot_end in iterate_span(
+                max(period.start, start), min(period.end, end), self.raster
+            ))
+
+        return blocked
+
     @property
     def pending_reservations(self):
         """ Returns the pending reservations query for this allocation.
@@ -266,16 +298,24 @@ class Allocation(TimestampMixin, ORMBase, OtherModels):
     def availability(self):
         """Returns the availability in percent."""
 
+        return self.calculate_availability(self._query_blocked_periods())
+
+    def calculate_availability(self, blocked_periods):
+        """Returns the availability in percent, counting the slots covered
+        by the given blocked periods of the allocation's resource. See
+        Allocation.availability.
+
+        """
+
         if self.partly_available:
             total = sum(1 for s in self.all_slots())
         else:
             total = 1
 
+        # each blocked period is counted on its own
         count = len(self.reserved_slots)
-        for blocked_period in self._query_blocked_periods():
-            count += len(list(iterate_span(blocked_period.start,
-                                           blocked_period.end,
-                                           self.raster)))
+        for blocked_period in blocked_periods:
+            count += len(self.blocked_slots([blocked_period]))
 
         if total == count:
             return 0.0
@@ -314,7 +354,8 @@ class Allocation(TimestampMixin, ORMBase, OtherModels):
 
         return True
 
-    def availability_partitions(self, scheduler):
+    def availability_partitions(self, scheduler, resource=None,
+                                blocked_periods=None, reservations=None):
         """Partitions the space between start and end into blocks of either
         free, blocked or reserved time. Each block has a percentage
         representing the space the block occupies compared to the size of the
@@ -341,8 +382,14 @@ class Allocation(TimestampMixin, ORMBase, OtherModels):
         Makes sure to only display slots that are within it's resources
         first_hour/last_hour timespan.
 
+        The resource object, the blocked periods of the allocation and a
+        dictionary of reservations keyed by token may be passed if they are
+        known already. Otherwise they are looked up.
+
         """
-        resource = get_resource_by_uuid(scheduler.uuid).getObject()
+        if resource is None:
+            resource = get_resource_by_uuid(scheduler.uuid).getObject()
+
         first_hour, last_hour = utils.as_machine_time(
             resource.first_hour,
             resource.last_hour
@@ -355,14 +402,15 @@ class Allocation(TimestampMixin, ORMBase, OtherModels):
 
         reserved = dict((r.start, r) for r in self.reserved_slots if
                         r.start >= display_start and r.end <= display_end)
-        blocked = set()
-        for blocked_period in self._query_blocked_periods():
-            blocked.update(start for start, end in
-                           iterate_span(max(blocked_period.start,
-                                            display_start),
-                                        min(blocked_period.end,
-                                            display_end),
-                                        self.raster))
+
+        if blocked_periods is None:
+            blocked_periods = self._query_blocked_periods(
+                display_start, display_end
+            )
+
+        blocked = self.blocked_slots(
+            blocked_periods, display_start, display_end
+        )
 
         if not (reserved or blocked):
             return [(100.0, None)]
@@ -378,7 +426,10 @@ class Allocation(TimestampMixin, ORMBase, OtherModels):
             if slot[0] in reserved:
                 reserved_slot = reserved[slot[0]]
                 token = reserved_slot.reservation_token
-                reservation = scheduler.reservation_by_token(token).one()
+                if reservations is None:
+                    reservation = scheduler.reservation_by_token(token).one()
+                else:
+                    reservation = reservations[token]
                 piece = ('reserved', reservation.description, reservation.id)
             elif slot[0] in blocked:
                 piece = ('blocked', None)
@@ -0,0 +1,32 @@
+from seantis.reservation import ORMBase
+from seantis.reservation import utils
+from seantis.reservation.models.other import OtherModels
+from sqlalchemy import types
+from sqlalchemy.schema import Column
+from sqlalchemy.schema import Index
+
+
+class CachedEvents(ORMBase, OtherModels):
+    """Describes the events of a calendar cached by the postgres backend of
+    seantis.reservation.eventcache.
+
+    """
+
+    __tablename__ = 'event_cache'
+
+    key = Column(types.String(40), primary_key=True)
+
+    # the version of the resource the events were rendered for
+    version = Column(types.BigInteger(), nullable=False)
+
+    # the events as json and the length of the json
+    payload = Column(types.Text(), nullable=False)
+    size = Column(types.Integer(), nullable=False)
+
+    created = Column(
+        types.DateTime(timezone=True), nullable=False, default=utils.utcnow
+    )
+
+    __table_args__ = (
+        Index('event_cache_created_ix', 'created'),
+    )
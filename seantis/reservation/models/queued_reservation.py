@@ -0,0 +1,49 @@
+from seantis.reservation import ORMBase
+from seantis.reservation.models import customtypes
+from seantis.reservation.models.other import OtherModels
+from seantis.reservation.models.timestamp import TimestampMixin
+from sqlalchemy import types
+from sqlalchemy.schema import Column
+from sqlalchemy.schema import Index
+
+
+class QueuedReservation(TimestampMixin, ORMBase, OtherModels):
+    """Describes a reservation waiting to be made by the queue worker (see
+    seantis.reservation.workqueue).
+
+    """
+
+    __tablename__ = 'reservation_queue'
+
+    id = Column(types.Integer(), primary_key=True, autoincrement=True)
+    ticket = Column(customtypes.GUID(), nullable=False, unique=True)
+    resource = Column(customtypes.GUID(), nullable=False)
+    language = Column(types.String(8), nullable=True)
+
+    # the arguments passed to Scheduler.reserve
+    arguments = Column(customtypes.JSONEncodedDict(), nullable=False)
+
+    # identifies the same reservation queued again by the same session
+    key = Column(types.String(40), nullable=True)
+
+    # True if the reservation is approved right after it was made
+    approve = Column(types.Boolean(), nullable=False, default=False)
+
+    status = Column(
+        types.Enum(u'queued', u'done', u'failed',
+                   name='reservation_queue_status'),
+        nullable=False,
+        default=u'queued'
+    )
+
+    # the token of the reservation once it is made
+    reservation_token = Column(customtypes.GUID(), nullable=True)
+
+    # the class name and the message of the error if the reservation failed
+    error = Column(types.String(64), nullable=True)
+    message = Column(types.Unicode(), nullable=True)
+
+    __table_args__ = (
+        Index('reservation_queue_status_ix', 'status', 'id'),
+        Index('reservation_queue_key_ix', 'key'),
+    )
@@ -1,4 +1,4 @@
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 from datetime import timedelta
 
 from sqlalchemy import types
@@ -7,6 +7,7 @@ from sqlalchemy.schema import Index
 
 from seantis.reservation import ORMBase
 from seantis.reservation import Session
+from seantis.reservation.intervals import IntervalIndex
 from seantis.reservation.models import customtypes
 from seantis.reservation.models.other import OtherModels
 from seantis.reservation.models.timestamp import TimestampMixin
@@ -156,14 +157,11 @@ class Reservation(TimestampMixin, ORMBase, OtherModels):
         return query
 
     def timespan_entries(self, start=None, end=None):
-        if self.status == 'pending':
-            return self._pending_timespans(start, end)
-        else:
-            return self._approved_timespans(start, end)
+        return timespan_entries_by_reservation([self], start, end)[self]
 
-    def _pending_timespans(self, start_time, end_time):
+    def _pending_timespans(self, start_time, end_time, target_dates):
         result = []
-        for start, end in self.target_dates():
+        for start, end in target_dates:
             if start_time and not start >= start_time:
                 continue
             if end_time and not end <= end_time:
@@ -176,27 +174,22 @@ class Reservation(TimestampMixin, ORMBase, OtherModels):
             result.append(timespan)
         return result
 
-    def _approved_timespans(self, start, end):
-        ReservedSlot = self.models.ReservedSlot
-        query = Session.query(ReservedSlot)\
-                .filter_by(reservation_token=self.token)
-        if start:
-            query = query.filter(ReservedSlot.start >= start)
-        if end:
-            query = query.filter(ReservedSlot.end <= end)
+    def _approved_timespans(self, target_dates, reserved_slots):
+        """ Returns the timespans of the given target dates which still
+        contain one of the given reserved slots (an IntervalIndex).
+
+        """
 
         # find the slots that are still reserved
         result = []
-        for start, end in self.target_dates():
-            reserved_slot = query.filter(ReservedSlot.start <= end)\
-                            .filter(ReservedSlot.end >= start)\
-                            .first()
-            if not reserved_slot:
+        for start, end in target_dates:
+            overlapping = reserved_slots.overlapping(start, end)
+            if not overlapping:
                 continue
             # build tuple containing necessary info for deletion links
             timespan = Timespan(start=start,
                                 end=end + timedelta(microseconds=1),
-                                allocation_id=reserved_slot.allocation_id,
+                                allocation_id=overlapping[0].allocation_id,
                                 token=self.token)
             result.append(timespan)
         return result
@@ -210,7 +203,7 @@ class Reservation(TimestampMixin, ORMBase, OtherModels):
         """
         return [(each.start, each.end) for each in self.timespan_entries()]
 
-    def target_dates(self):
+    def target_dates(self, groups=None):
         """ Returns the dates this reservation targets. Those should not be
         confused with the dates this reservation actually reserved.
 
@@ -221,11 +214,17 @@ class Reservation(TimestampMixin, ORMBase, OtherModels):
         This function only returns dates the reservation was originally
         targeted at.
 
+        The dates of group reservations may be passed as a dictionary of
+        groups, if they are known already.
+
         """
         if self.target_type == u'allocation':
             return ((self.start, self.end),)
 
         if self.target_type == u'group':
+            if groups is not None:
+                return groups.get(self.target, [])
+
             return self._target_allocations().with_entities(
                 self.models.Allocation._start,
                 self.models.Allocation._end
@@ -263,3 +262,84 @@ class Reservation(TimestampMixin, ORMBase, OtherModels):
 
     def get_resource(self):
         return self.get_resource_brain().getObject()
+
+
+def timespan_entries_by_reservation(reservations, start=None, end=None):
+    """ Returns the timespan entries (see Reservation.timespan_entries) of
+    the given reservations as a dictionary keyed by reservation.
+
+    The reserved slots of all approved reservations are fetched in a single
+    query and matched to the target dates in memory. The same goes for the
+    target dates of the group reservations.
+
+    """
+    reservations = list(reservations)
+
+    if not reservations:
+        return {}
+
+    models = reservations[0].models
+    Allocation, ReservedSlot = models.Allocation, models.ReservedSlot
+
+    # fetch the target dates of all group reservations
+    groups = defaultdict(list)
+    targets = set(r.target for r in reservations if r.target_type == u'group')
+
+    if targets:
+        query = Session.query(Allocation.group, Allocation._start,
+                              Allocation._end)
+        query = query.filter(Allocation.group.in_(targets))
+        query = query.filter(Allocation.resource == Allocation.mirror_of)
+        query = query.order_by(Allocation._start)
+
+        for group, group_start, group_end in query:
+            groups[group].append((group_start, group_end))
+
+    # fetch the reserved slots of all approved reservations
+    slots = defaultdict(list)
+    tokens = set(r.token for r in reservations if r.status != 'pending')
+
+    if tokens:
+        query = Session.query(ReservedSlot).with_entities(
+            ReservedSlot.reservation_token, ReservedSlot.start,
+            ReservedSlot.end, ReservedSlot.allocation_id
+        )
+        query = query.filter(ReservedSlot.reservation_token.in_(tokens))
+
+        if start:
+            query = query.filter(ReservedSlot.start >= start)
+        if end:
+            query = query.filter(ReservedSlot.end <= end)
+
+        for slot in query:
+            slots[slot.reservation_token].append(slot)
+
+    slots = dict((token, IntervalIndex(s)) for token, s in slots.items())
+
+    result = {}
+    for reservation in reservations:
+        dates = reservation.target_dates(groups)
+
+        if reservation.status == 'pending':
+            result[reservation] = reservation._pending_timespans(
+                start, end, dates
+            )
+        else:
+            result[reservation] = reservation._approved_timespans(
+                dates, slots.get(reservation.token, IntervalIndex())
+            )
+
+    return result
+
+
+def timespans_by_reservation(reservations):
+    """ Returns the timespans (see Reservation.timespans) of the given
+    reservations as a dictionary keyed by reservation.
+
+    """
+    entries = timespan_entries_by_reservation(reservations)
+
+    return dict(
+        (reservation, [(each.start, each.end) for each in timespans])
+        for reservation, timespans in entries.items()
+    )
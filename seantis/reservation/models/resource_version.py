@@ -0,0 +1,21 @@
+from seantis.reservation import ORMBase
+from seantis.reservation.models import customtypes
+from seantis.reservation.models.other import OtherModels
+from seantis.reservation.models.timestamp import TimestampMixin
+from sqlalchemy import types
+from sqlalchemy.schema import Column
+
+
+class ResourceVersion(TimestampMixin, ORMBase, OtherModels):
+    """Counts the changes of a resource. The version is increased by every
+    transaction changing the allocations, reservations, reserved slots or
+    blocked periods of the resource (see db.bump_resource_version).
+
+    Resources without record have never been changed (version 0).
+
+    """
+
+    __tablename__ = 'resource_versions'
+
+    resource = Column(customtypes.GUID(), primary_key=True)
+    version = Column(types.BigInteger(), nullable=False, default=0)
@@ -39,10 +39,13 @@ class Overviewlet(grok.Viewlet):
         # Put the uuidmap in the json so it can be used by overview.js
         uuidmap = self.manager.uuidmap
 
+        # the events are fetched with GET so the browser may cache them
+        # (see CalendarRequest.etag)
         options = {}
         options['events'] = {
             'url': self.overview_url(),
-            'type': 'POST',
+            'type': 'GET',
+            'cache': True,
             'data': {
                 'uuid': uuidmap.keys()
             },
@@ -80,6 +83,9 @@ class Overview(grok.View, CalendarRequest):
 
         return uuids
 
+    def calendar_resources(self):
+        return self.uuids()
+
     def render(self):
         result = CalendarRequest.render(self)
         return result
@@ -0,0 +1,351 @@
+""" SQL versions of functions which are otherwise run in Python, for queries
+which should be evaluated by PostgreSQL as a whole instead of materializing
+the records. The expressions use PostgreSQL specific functions and
+intervals, so callers need to check is_postgresql first.
+
+"""
+
+from sqlalchemy import types
+from sqlalchemy.sql import case, cast, extract, func, literal_column, select
+
+from seantis.reservation import Session
+from seantis.reservation import utils
+
+MINUTE = literal_column("interval '1 minute'")
+MICROSECOND = literal_column("interval '1 microsecond'")
+INCLUSIVE = literal_column("'[]'")
+
+# the tsrange expression indexes created by create_range_indexes, as
+# (name, table, start column, end column)
+RANGE_INDEXES = (
+    ('allocations_range_ix', 'allocations', '_start', '_end'),
+    ('blocked_periods_range_ix', 'blocked_periods', 'start', 'end'),
+)
+
+
+# the sqlstate of exclusion constraint violations
+EXCLUSION_VIOLATION = '23P01'
+
+# The reserved slots and blocked periods are mirrored by triggers into the
+# occupancy table, where an exclusion constraint ensures that no slot
+# overlaps a blocked period of the same resource (kind 0 are slots, kind 1
+# blocked periods). Requires the btree_gist extension.
+#
+# Slots of mirror allocations are stored with the resource of the master
+# allocation (mirror_of), which is the resource of the blocked periods. Their
+# own resource is kept in slot_resource, to find them again.
+EXCLUSION_CONSTRAINTS = """
+    CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+    CREATE TABLE occupancy (
+        kind smallint NOT NULL,
+        resource uuid NOT NULL,
+        slot_resource uuid,
+        "start" timestamp NOT NULL,
+        "end" timestamp NOT NULL,
+        blocked_period_id integer,
+        EXCLUDE USING gist (
+            (resource::text) WITH =,
+            tsrange("start", "end", '[]') WITH &&,
+            kind WITH <>
+        )
+    );
+
+    CREATE INDEX occupancy_slots_ix
+        ON occupancy (slot_resource, "start") WHERE kind = 0;
+    CREATE INDEX occupancy_blocked_periods_ix
+        ON occupancy (blocked_period_id) WHERE kind = 1;
+
+    CREATE OR REPLACE FUNCTION reserved_slots_occupancy()
+    RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            DELETE FROM occupancy WHERE kind = 0
+                AND slot_resource = OLD.resource AND "start" = OLD."start";
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO occupancy
+                (kind, resource, slot_resource, "start", "end")
+                SELECT 0, mirror_of, NEW.resource, NEW."start", NEW."end"
+                FROM allocations WHERE id = NEW.allocation_id;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION blocked_periods_occupancy()
+    RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            DELETE FROM occupancy WHERE kind = 1
+                AND blocked_period_id = OLD.id;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO occupancy
+                (kind, resource, "start", "end", blocked_period_id)
+                VALUES (1, NEW.resource, NEW."start", NEW."end", NEW.id);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    INSERT INTO occupancy (kind, resource, slot_resource, "start", "end")
+        SELECT 0, allocations.mirror_of, reserved_slots.resource,
+            reserved_slots."start", reserved_slots."end"
+        FROM reserved_slots
+        JOIN allocations ON allocations.id = reserved_slots.allocation_id;
+    INSERT INTO occupancy (kind, resource, "start", "end", blocked_period_id)
+        SELECT 1, resource, "start", "end", id FROM blocked_periods;
+
+    DROP TRIGGER IF EXISTS reserved_slots_occupancy ON reserved_slots;
+    CREATE TRIGGER reserved_slots_occupancy
+        AFTER INSERT OR UPDATE OR DELETE ON reserved_slots
+        FOR EACH ROW EXECUTE PROCEDURE reserved_slots_occupancy();
+
+    DROP TRIGGER IF EXISTS blocked_periods_occupancy ON blocked_periods;
+    CREATE TRIGGER blocked_periods_occupancy
+        AFTER INSERT OR UPDATE OR DELETE ON blocked_periods
+        FOR EACH ROW EXECUTE PROCEDURE blocked_periods_occupancy();
+"""
+
+
+def is_postgresql(session=None):
+    """ Returns True if the given session (or the current one) is bound to
+    a PostgreSQL database. """
+    return (session or Session).bind.dialect.name == 'postgresql'
+
+
+def range_indexes_enabled(dialect=None):
+    """ Returns True if the range indexes are enabled. They are off by
+    default and may be turned on in the product-config::
+
+        <product-config seantis.reservation>
+            range-indexes on
+        </product-config>
+
+    The range indexes are only supported on PostgreSQL.
+
+    """
+    if not utils.get_config_flag('range-indexes'):
+        return False
+
+    dialect = dialect or Session.bind.dialect
+    return dialect.name == 'postgresql'
+
+
+def exclusion_constraints_enabled(dialect=None):
+    """ Returns True if the conflicts between reserved slots and blocked
+    periods are detected by postgres, through the exclusion constraint of
+    the occupancy table. They are off by default and may be turned on in
+    the product-config::
+
+        <product-config seantis.reservation>
+            exclusion-constraints on
+        </product-config>
+
+    The btree_gist extension must be available to create the constraint.
+
+    """
+    if not utils.get_config_flag('exclusion-constraints'):
+        return False
+
+    dialect = dialect or Session.bind.dialect
+    return dialect.name == 'postgresql'
+
+
+def is_exclusion_violation(exception):
+    """ Returns True if the given exception (usually an IntegrityError) was
+    caused by an exclusion constraint. """
+    original = getattr(exception, 'orig', exception)
+    return getattr(original, 'pgcode', None) == EXCLUSION_VIOLATION
+
+
+def optimistic_slots_enabled(dialect=None):
+    """ Returns True if the reserved slots are written optimistically using
+    INSERT ... ON CONFLICT DO NOTHING, instead of checking the availability
+    of each allocation first. Off by default, it may be turned on in the
+    product-config::
+
+        <product-config seantis.reservation>
+            optimistic-slots on
+        </product-config>
+
+    Requires PostgreSQL 9.5 or later.
+
+    """
+    if not utils.get_config_flag('optimistic-slots'):
+        return False
+
+    return supports_on_conflict(dialect)
+
+
+def supports_on_conflict(dialect=None):
+    """ Returns True if the database supports INSERT ... ON CONFLICT, which
+    was added in PostgreSQL 9.5.
+
+    """
+    dialect = dialect or Session.bind.dialect
+
+    if dialect.name != 'postgresql':
+        return False
+
+    return (dialect.server_version_info or (0, )) >= (9, 5)
+
+
+def insert_ignoring_conflicts(table, rows, returning, session=None):
+    """ Inserts the given rows into the given table in a single statement,
+    skipping the rows which conflict with existing rows. Returns the values
+    of the given column of the inserted rows.
+
+    The rows are handed to the database driver as they are, without the
+    processing of custom column types (i.e. uuids need to be strings).
+
+    """
+    connection = (session or Session).connection()
+    statement = table.insert().values(rows).compile(
+        dialect=connection.dialect
+    )
+
+    sql = u'%s ON CONFLICT DO NOTHING RETURNING "%s"' % (statement, returning)
+    return [row[0] for row in connection.execute(sql, statement.params)]
+
+
+def tsrange(start, end):
+    """ Returns an inclusive tsrange of the given start and end. """
+    return func.tsrange(start, end, INCLUSIVE)
+
+
+def overlaps(start_column, end_column, start, end):
+    """ Query version of utils.overlaps using the && range operator. The
+    clause is able to use the range indexes if the given columns are the
+    ones found in RANGE_INDEXES.
+
+    """
+    return tsrange(start_column, end_column).op('&&')(tsrange(start, end))
+
+
+def filter_overlapping(query, start_column, end_column, start, end):
+    """ Limits the given query to the records whose start and end columns
+    overlap the given timespan. Uses the && operator if the range indexes
+    are enabled, plain comparisons otherwise.
+
+    """
+    if range_indexes_enabled():
+        return query.filter(overlaps(start_column, end_column, start, end))
+
+    query = query.filter(start_column <= end)
+    query = query.filter(end_column >= start)
+
+    return query
+
+
+def create_range_indexes(connection):
+    """ Creates the tsrange GiST indexes on the given connection, unless
+    they exist already.
+
+    """
+    existing = set(r[0] for r in connection.execute(
+        "SELECT relname FROM pg_class WHERE relkind = 'i'"
+    ))
+
+    for name, table, start, end in RANGE_INDEXES:
+        if name in existing:
+            continue
+
+        connection.execute(
+            'CREATE INDEX "{}" ON "{}" USING gist '
+            '(tsrange("{}", "{}", \'[]\'))'.format(name, table, start, end)
+        )
+
+
+def create_exclusion_constraints(connection):
+    """ Creates the occupancy table with its exclusion constraint and the
+    triggers filling it, unless the table exists already.
+
+    Fails if there are reserved slots overlapping blocked periods.
+
+    """
+    exists = connection.execute(
+        "SELECT 1 FROM pg_class WHERE relname = 'occupancy' AND relkind = 'r'"
+    ).scalar()
+
+    if not exists:
+        connection.execute(EXCLUSION_CONSTRAINTS)
+
+
+def rasterize_start(column, raster):
+    """ SQL version of seantis.reservation.raster.rasterize_start. """
+    remainder = cast(extract('minute', column), types.Integer) % raster
+    return func.date_trunc('minute', column) - remainder * MINUTE
+
+
+def rasterize_end(column, raster):
+    """ SQL version of seantis.reservation.raster.rasterize_end. """
+    remainder = cast(extract('minute', column), types.Integer) % raster
+    return case(
+        [(
+            remainder != 0,
+            rasterize_start(column, raster) + raster * MINUTE - MICROSECOND
+        )],
+        else_=column - MICROSECOND
+    )
+
+
+def span_slot_count(start, end, raster):
+    """ SQL version of len(list(raster.iterate_span(start, end, raster))).
+
+    """
+    start = rasterize_start(start, raster)
+    end = rasterize_end(end, raster)
+
+    seconds = extract('epoch', end - start)
+
+    return case(
+        [(end >= start, func.floor(seconds / (raster * 60)) + 1)],
+        else_=0
+    )
+
+
+def allocation_availability(Allocation, ReservedSlot, BlockedPeriod):
+    """ SQL version of Allocation.availability, to be used in queries
+    selecting from the allocations table.
+
+    """
+
+    if_partly_available = span_slot_count(
+        Allocation._start, Allocation._end, Allocation._raster
+    )
+    total = case(
+        [(Allocation.partly_available, if_partly_available)], else_=1
+    )
+
+    reserved = select([func.count(ReservedSlot.start)])
+    reserved = reserved.where(ReservedSlot.allocation_id == Allocation.id)
+
+    blocked = select([func.coalesce(func.sum(span_slot_count(
+        func.greatest(BlockedPeriod.start, Allocation._start),
+        func.least(BlockedPeriod.end, Allocation._end),
+        Allocation._raster
+    )), 0)])
+    blocked = blocked.where(BlockedPeriod.resource == Allocation.resource)
+
+    if range_indexes_enabled():
+        blocked = blocked.where(overlaps(
+            BlockedPeriod.start, BlockedPeriod.end,
+            Allocation._start, Allocation._end
+        ))
+    else:
+        blocked = blocked.where(BlockedPeriod.start <= Allocation._end)
+        blocked = blocked.where(BlockedPeriod.end >= Allocation._start)
+
+    count = reserved.as_scalar() + blocked.as_scalar()
+
+    return case(
+        [
+            (count == total, 0.0),
+            (count == 0, 100.0)
+        ],
+        else_=(
+            100.0 - cast(count, types.Float) / cast(total, types.Float) * 100.0
+        )
+    )
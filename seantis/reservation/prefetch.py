@@ -0,0 +1,166 @@
+"""The prefetch module loads everything the slots calendar shows about the
+allocations of a resource in a fixed number of queries.
+
+Rendering a single event used to cost several queries: the availability of
+the allocation, the blocked periods of each sibling, the length of the
+waitinglist, the check whether the allocation is part of a group and a
+lookup for each reservation shown in the partitions. With a few hundred
+events in view this quickly adds up.
+
+The CalendarPrefetch class loads all of this for the whole requested range
+at once and answers the same questions from memory.
+
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import func
+
+from seantis.reservation import Session
+from seantis.reservation import db
+from seantis.reservation import postgres
+from seantis.reservation.intervals import index_by_resource
+from seantis.reservation.models import Allocation, BlockedPeriod, Reservation
+
+
+class CalendarPrefetch(object):
+    """Holds the allocations of a scheduler in the given range, together
+    with everything needed to render them in the calendar.
+
+    """
+
+    def __init__(self, scheduler, start, end, resource=None):
+        self.scheduler = scheduler
+        self.resource = resource
+
+        query = scheduler.allocations_in_range(start, end, masters_only=False)
+        query = query.order_by(Allocation._start)
+
+        self.masters = []
+        self.siblings = defaultdict(list)
+
+        for allocation in query:
+            if allocation.is_master:
+                self.masters.append(allocation)
+
+            self.siblings[allocation._start].append(allocation)
+
+        self.blocked_periods = self.load_blocked_periods()
+        self.waitinglist_lengths = self.load_waitinglist_lengths()
+        self.group_sizes = self.load_group_sizes()
+        self.reservations = self.load_reservations()
+
+    def load_blocked_periods(self):
+        """Returns the blocked periods overlapping the allocations as
+        dictionary of interval indexes keyed by resource.
+
+        """
+        allocations = [a for s in self.siblings.values() for a in s]
+
+        if not allocations:
+            return index_by_resource(())
+
+        start = min(a.start for a in allocations)
+        end = max(a.end for a in allocations)
+
+        query = Session.query(BlockedPeriod)
+        query = query.filter(
+            BlockedPeriod.resource.in_(set(a.resource for a in allocations))
+        )
+
+        query = postgres.filter_overlapping(
+            query, BlockedPeriod.start, BlockedPeriod.end, start, end
+        )
+
+        return index_by_resource(query)
+
+    def blocked_periods_of(self, allocation):
+        """Returns the blocked periods overlapping the given allocation. """
+
+        return self.blocked_periods[allocation.resource].overlapping(
+            allocation.start, allocation.end
+        )
+
+    def load_waitinglist_lengths(self):
+        """Returns the number of pending reservations keyed by the group
+        of the allocations which need manual approval.
+
+        """
+        groups = set(a.group for a in self.masters if a.approve_manually)
+
+        if not groups:
+            return {}
+
+        query = Session.query(Reservation.target, func.count(Reservation.id))
+        query = query.filter(Reservation.target.in_(groups))
+        query = query.filter(Reservation.status == u'pending')
+        query = query.group_by(Reservation.target)
+
+        return dict(query.all())
+
+    def load_group_sizes(self):
+        """Returns the number of master allocations in each group. """
+
+        groups = set(a.group for a in self.masters)
+
+        if not groups:
+            return {}
+
+        query = Session.query(Allocation.group, func.count(Allocation.id))
+        query = query.filter(Allocation.resource == self.scheduler.uuid)
+        query = query.filter(Allocation.group.in_(groups))
+        query = query.group_by(Allocation.group)
+
+        return dict(query.all())
+
+    def load_reservations(self):
+        """Returns the reservations of the slots shown in the partitions of
+        the partly available allocations, keyed by token.
+
+        """
+        tokens = set(
+            slot.reservation_token
+            for a in self.masters if a.partly_available
+            for slot in a.reserved_slots
+        )
+
+        if not tokens:
+            return {}
+
+        query = self.scheduler.managed_reservations()
+        query = query.filter(Reservation.token.in_(tokens))
+
+        return dict((r.token, r) for r in query)
+
+    def availability(self, allocation):
+        """Same as scheduler.availability(allocation.start, allocation.end)
+        for an exposed master allocation, without the queries.
+
+        """
+        siblings = self.siblings[allocation._start]
+        blocked_periods = dict(
+            (s.resource, self.blocked_periods_of(s)) for s in siblings
+        )
+
+        return db.availability_by_allocations(siblings, blocked_periods)
+
+    def waitinglist_length(self, allocation):
+        """Same as allocation.waitinglist_length, without the query. """
+
+        return self.waitinglist_lengths.get(allocation.group, 0)
+
+    def in_group(self, allocation):
+        """Same as allocation.in_group, without the query. """
+
+        return self.group_sizes.get(allocation.group, 0) > 1
+
+    def availability_partitions(self, allocation):
+        """Same as allocation.availability_partitions, without the queries.
+
+        """
+        return allocation.availability_partitions(
+            self.scheduler,
+            resource=self.resource,
+            blocked_periods=self.blocked_periods_of(allocation),
+            reservations=self.reservations
+        )
@@ -28,6 +28,7 @@ from seantis.reservation import _
 from seantis.reservation import db
 from seantis.reservation import plone_session
 from seantis.reservation import utils
+from seantis.reservation import workqueue
 from seantis.reservation.error import DirtyReadOnlySession
 from seantis.reservation.form import (
     ResourceBaseForm,
@@ -38,6 +39,7 @@ from seantis.reservation.form import (
 from seantis.reservation.interfaces import (
     IResourceBase,
     IReservation,
+    IGroupIdForm,
     IGroupReservation,
     IRevokeReservation,
     IReservationIdForm
@@ -338,6 +340,13 @@ class ReservationBaseForm(ResourceBaseForm):
         else:
             run_pre_reserve_script(self.context, None, None, additional_data)
 
+        if workqueue.queue_enabled():
+            return self.run_queued_reserve(
+                email, approve_manually, dates=dates, group=group,
+                data=additional_data, session_id=session_id, quota=quota,
+                rrule=rrule, description=description
+            )
+
         def run():
             if dates:
                 return self.scheduler.reserve(
@@ -362,6 +371,36 @@ class ReservationBaseForm(ResourceBaseForm):
 
         return token
 
+    def run_queued_reserve(self, email, approve_manually, **arguments):
+        """ Queues the reservation and waits for the worker to make it (see
+        workqueue.py). Returns the token of the reservation or None if it is
+        still queued when the wait times out.
+
+        """
+
+        def run():
+            return workqueue.enqueue_reservation(
+                self.scheduler, email, approve=not approve_manually,
+                **arguments
+            )
+
+        ticket = throttled(run, 'reserve')()
+        status = workqueue.wait_for_reservation(ticket)
+
+        if status is None or status.status == u'queued':
+            self.flash(_(u'Your reservation is being processed'))
+            return None
+
+        if status.status == u'failed':
+            workqueue.raise_failure(status)
+
+        if approve_manually:
+            self.flash(_(u'Added to waitinglist'))
+        else:
+            self.flash(_(u'Reservation successful'))
+
+        return status.reservation_token
+
     def filter_additional_data(self, additional_data):
         """Only store forms defined in the formsets list """
 
@@ -789,6 +828,64 @@ class ReservationDenialForm(ReservationDecisionForm):
         self.redirect_to_context()
 
 
+class ReservationGroupApprovalForm(ResourceBaseForm, ReservationListView,
+                                   ReservationUrls):
+    """ Approves the pending reservations of an allocation group in the
+    order they were made, as long as they fit. The others stay on the
+    waitinglist.
+
+    """
+
+    permission = 'seantis.reservation.ApproveReservations'
+
+    grok.name('approve-group-reservations')
+    grok.require(permission)
+
+    fields = field.Fields(IGroupIdForm)
+    hidden_fields = ('group', )
+
+    context_buttons = ('approve', )
+
+    template = ViewPageTemplateFile('templates/decide_reservation.pt')
+
+    label = _(u'Approve waitinglist')
+
+    show_links = False
+
+    def defaults(self):
+        return dict(group=self.group)
+
+    @property
+    def hint(self):
+        if not self.pending_reservations():
+            return _(u'No such reservation')
+
+        return _(u'Do you really want to approve the following reservations?')
+
+    @button.buttonAndHandler(_(u'Approve'))
+    @extract_action_data
+    def approve(self, data):
+
+        def approve():
+            tokens = self.pending_reservations().keys()
+            failures = self.scheduler.approve_reservations(tokens)
+
+            self.flash(_(
+                u'${approved} reservations approved, ${failed} left on the '
+                u'waitinglist',
+                mapping={
+                    'approved': len(tokens) - len(failures),
+                    'failed': len(failures)
+                }
+            ))
+
+        utils.handle_action(action=approve, success=self.redirect_to_context)
+
+    @button.buttonAndHandler(_(u'Cancel'))
+    def cancel(self, action):
+        self.redirect_to_context()
+
+
 class ReservedSlotsRemovalForm(
     ReservationIdForm,
     ReservationListView,
@@ -5,10 +5,14 @@ import json
 import pytz
 import pkg_resources
 
+from hashlib import sha1
+
 from datetime import datetime
+from uuid import UUID
 
 from Products.ATContentTypes.interface import IATFolder
 
+from AccessControl import getSecurityManager
 from Acquisition import aq_inner
 from five import grok
 from plone.dexterity.content import Container
@@ -18,13 +22,16 @@ from plone.memoize import view
 from zope.component import queryAdapter
 from zope.event import notify
 from zope.interface import implements
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
 from zope.lifecycleevent.interfaces import IObjectRemovedEvent
 
+from seantis.reservation import eventcache
 from seantis.reservation import exposure
 from seantis.reservation import utils
 from seantis.reservation import db
 from seantis.reservation import _
 from seantis.reservation.events import ResourceViewedEvent
+from seantis.reservation.prefetch import CalendarPrefetch
 from seantis.reservation.timeframe import timeframes_by_context
 from seantis.reservation.form import AllocationGroupView
 from seantis.reservation.interfaces import IResourceBase
@@ -67,6 +74,12 @@ class Resource(Container):
         return timeframes_by_context(self)
 
 
+# covers added and removed resources as well
+@grok.subscribe(IResourceBase, IObjectMovedEvent)
+def on_moved_resource(resource, event):
+    utils.invalidate_resource_cache(getattr(resource, 'REQUEST', None))
+
+
 @grok.subscribe(IResourceBase, IObjectRemovedEvent)
 def on_removed_resource(resource, event):
     request = getattr(resource, 'REQUEST', None)
@@ -180,7 +193,9 @@ class View(grok.View):
         eventurl = baseurl + '/slots'
 
         options = {}
-        options['events'] = eventurl
+
+        # the events are cached by the browser (see CalendarRequest.etag)
+        options['events'] = {'url': eventurl, 'cache': True}
         options['minTime'] = first_hour or resource.first_hour
         options['maxTime'] = last_hour or resource.last_hour
 
@@ -295,13 +310,72 @@ class CalendarRequest(object):
         if not all((start, end)):
             return json.dumps([])
 
-        events = self.events()
+        if self.is_not_modified():
+            return u''
 
-        return json.dumps(events, cls=utils.UUIDEncoder)
+        return self.events_json()
 
     def events(self):
         raise NotImplementedError
 
+    def events_json(self):
+        return json.dumps(self.events(), cls=utils.UUIDEncoder)
+
+    def calendar_resources(self):
+        """Returns the resources (objects or uuids) shown by the calendar."""
+        raise NotImplementedError
+
+    def etag(self, *extra):
+        """Returns the ETag of the events in the requested range. It changes
+        with the versions of the resources (see db.resource_versions), the
+        timeframes and permissions deciding which allocations are exposed,
+        the user and the language. Additional values may be passed.
+
+        """
+        timeframes = exposure.timeframe_indexes(self.calendar_resources())
+        versions = db.resource_versions(timeframes.keys())
+
+        parts = [
+            self.request.get('start'),
+            self.request.get('end'),
+            self.request.get('LANGUAGE'),
+            getSecurityManager().getUser().getId()
+        ]
+
+        for uuid in sorted(timeframes):
+            index = timeframes[uuid]
+            frames = index is not None and list(index.frames) or None
+
+            parts.append((uuid.hex, versions[uuid], frames))
+
+        parts.extend(extra)
+
+        return '"%s"' % sha1(repr(parts)).hexdigest()
+
+    def is_not_modified(self):
+        """Sets the ETag of the events and returns True if the client has
+        them already, in which case the response is a 304 Not Modified.
+        Only GET requests are answered conditionally.
+
+        """
+        if self.request.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD'):
+            return False
+
+        etag = self.etag()
+        response = self.request.response
+
+        response.setHeader('ETag', etag)
+        response.setHeader('Cache-Control', 'private, no-cache')
+
+        expected = self.request.getHeader('If-None-Match') or ''
+        expected = [e.strip() for e in expected.split(',')]
+
+        if etag in expected or '*' in expected:
+            response.setStatus(304)
+            return True
+
+        return False
+
 
 class Slots(grok.View, CalendarRequest):
     permission = 'zope2.View'
@@ -313,6 +387,41 @@ class Slots(grok.View, CalendarRequest):
     def render(self):
         return CalendarRequest.render(self)
 
+    def calendar_resources(self):
+        return [self.context]
+
+    def etag(self):
+        # the events depend on the settings of the resource as well
+        return CalendarRequest.etag(self, self.context.modified())
+
+    def events_json(self):
+        """Returns the rendered events, shared with other users seeing the
+        same events if the event cache is enabled (see eventcache.py).
+
+        """
+        uuid = UUID(self.context.uuid())
+        index = exposure.timeframe_indexes([self.context])[uuid]
+
+        # the urls of the events depend on the roles of the user, the rest
+        # on the resource, the language and the timeframes
+        key = sha1(repr([
+            self.context.absolute_url(),
+            self.request.get('start'),
+            self.request.get('end'),
+            self.request.get('LANGUAGE'),
+            sorted(getSecurityManager().getUser().getRolesInContext(
+                self.context
+            )),
+            index is not None and list(index.frames) or None,
+            self.context.modified()
+        ])).hexdigest()
+
+        version = db.resource_versions([uuid])[uuid]
+
+        return eventcache.cached_events(
+            key, version, lambda: CalendarRequest.events_json(self)
+        )
+
     @property
     def resource(self):
         return self.context
@@ -338,12 +447,17 @@ class Slots(grok.View, CalendarRequest):
             'reserve', dict(group=allocation.group)
         )
 
-    def urls(self, allocation):
+    def urls(self, allocation, in_group=None):
         """Returns the options for the js contextmenu for the given allocation
         as well as other links associated with the event.
 
+        Whether the allocation is in a group is looked up unless passed.
+
         """
 
+        if in_group is None:
+            in_group = allocation.in_group
+
         items = utils.EventUrls(self.context, self.request, exposure)
 
         start = utils.utctimestamp(allocation.display_start)
@@ -355,7 +469,7 @@ class Slots(grok.View, CalendarRequest):
         res_add = lambda n, v, p, t: \
             items.menu_add(_(u'Reservations'), n, v, p, t)
 
-        if allocation.is_separate:
+        if allocation.partly_available or not in_group:
             self._add_separate_reservation_links(items, allocation, start, end)
         else:
             self._add_group_reservation_links(items, allocation, start, end)
@@ -380,7 +494,7 @@ class Slots(grok.View, CalendarRequest):
             'overlay'
         )
 
-        if not allocation.in_group and not allocation.in_recurrence:
+        if not in_group and not allocation.in_recurrence:
             return items
 
         group_add = lambda n, v, p, t: \
@@ -393,7 +507,7 @@ class Slots(grok.View, CalendarRequest):
             group_add(
                 _(u'Remove'), 'remove-allocation', params, 'overlay'
             )
-        elif allocation.in_group:
+        elif in_group:
         # menu entries for group items
 
             group_add(
@@ -415,9 +529,12 @@ class Slots(grok.View, CalendarRequest):
 
         is_exposed = exposure.for_allocations(resource, [resource])
 
+        # load everything needed by the events in a few queries
+        prefetch = CalendarPrefetch(scheduler, *self.range, resource=resource)
+
         # get an event for each exposed allocation
         events = []
-        for alloc in scheduler.allocations_in_range(*self.range):
+        for alloc in prefetch.masters:
 
             if not is_exposed(alloc):
                 continue
@@ -425,15 +542,17 @@ class Slots(grok.View, CalendarRequest):
             start, end = alloc.display_start, alloc.display_end
 
             # get the urls
-            urls = self.urls(alloc)
+            urls = self.urls(alloc, in_group=prefetch.in_group(alloc))
 
             # calculate the availability for title and class
             availability, title, klass = utils.event_availability(
-                resource, self.request, scheduler, alloc
+                resource, self.request, scheduler, alloc,
+                availability=prefetch.availability(alloc),
+                waitinglist_length=prefetch.waitinglist_length(alloc)
             )
 
             if alloc.partly_available:
-                partitions = alloc.availability_partitions(scheduler)
+                partitions = prefetch.availability_partitions(alloc)
             else:
                 # if the allocation is not partly available there can only
                 # be one partition meant to be shown as empty unless the
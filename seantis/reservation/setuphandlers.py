@@ -1,8 +1,15 @@
 from seantis.reservation import ORMBase
 from seantis.reservation import Session
+from seantis.reservation import postgres
 from seantis.reservation.session import serialized
 
 
 @serialized
 def dbsetup(context):
     ORMBase.metadata.create_all(Session.bind)
+
+    if postgres.range_indexes_enabled():
+        postgres.create_range_indexes(Session.connection())
+
+    if postgres.exclusion_constraints_enabled():
+        postgres.create_exclusion_constraints(Session.connection())
@@ -1,7 +1,9 @@
 from Acquisition import aq_base
+from App.config import getConfiguration
 from Products.CMFCore.utils import getToolByName
 from Products.CMFPlone.tests.utils import MockMailHost
 from Products.MailHost.interfaces import IMailHost
+from contextlib import contextmanager
 from collective.betterbrowser import new_browser
 from lxml.cssselect import CSSSelector
 from plone.app.testing import TEST_USER_NAME, TEST_USER_ID
@@ -12,6 +14,7 @@ from seantis.reservation import maintenance
 from seantis.reservation import setuphandlers
 from seantis.reservation.session import ISessionUtility
 from seantis.reservation.session import Session
+from seantis.reservation.session import query_statistics
 from seantis.reservation.testing import SQL_FUNCTIONAL_TESTING
 from seantis.reservation.testing import SQL_INTEGRATION_TESTING
 from seantis.reservation.utils import getSite
@@ -24,6 +27,32 @@ import lxml.html
 import unittest2 as unittest
 
 
+_missing = object()
+
+
+@contextmanager
+def config_flag(name, value):
+    """ Sets the given seantis.reservation configuration key (see
+    utils.get_config) within the context, restoring it afterwards. E.g.:
+
+        with config_flag('range-indexes', 'on'):
+            postgres.create_range_indexes(Session.connection())
+
+    """
+    config = getConfiguration().product_config['seantis.reservation']
+    previous = config.get(name, _missing)
+
+    config[name] = value
+
+    try:
+        yield
+    finally:
+        if previous is _missing:
+            config.pop(name, None)
+        else:
+            config[name] = previous
+
+
 class TestCase(unittest.TestCase):
 
     def setUp(self):
@@ -76,6 +105,9 @@ class TestCase(unittest.TestCase):
         outlaw.execute('DELETE FROM reserved_slots')
         outlaw.execute('DELETE FROM allocations')
         outlaw.execute('DELETE FROM recurrences')
+        outlaw.execute('DELETE FROM reservation_queue')
+        outlaw.execute('DELETE FROM resource_versions')
+        outlaw.execute('DELETE FROM event_cache')
         outlaw.dispose()
 
         self.logout()
@@ -127,6 +159,26 @@ class TestCase(unittest.TestCase):
             getSite(), 'seantis.reservation.resource'
         )
 
+    @contextmanager
+    def assert_query_budget(self, budget, session=None):
+        """ Fails if the code run within the context runs more than the
+        given number of statements through the given session (readonly,
+        serial, replica) or through all sessions. E.g.:
+
+            with self.assert_query_budget(5):
+                view.render()
+
+        """
+        statistics = query_statistics()
+        before = statistics.count(session)
+
+        yield statistics
+
+        count = statistics.count(session) - before
+        self.assertTrue(count <= budget, '%i queries run, %i allowed' % (
+            count, budget
+        ))
+
     def subscribe(self, eventclass):
         subscriber = TestEventSubscriber(eventclass)
         event.subscribers.append(subscriber)
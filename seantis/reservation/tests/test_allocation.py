@@ -188,3 +188,35 @@ class TestAllocation(IntegrationTestCase):
         allocation.end = datetime(2013, 1, 1, 0, 0)
 
         self.assertRaises(AssertionError, lambda: allocation.whole_day)
+
+    @serialized
+    def test_availability_blocked_periods_in_timespan(self):
+        allocation = Allocation(raster=15, resource=uuid())
+        allocation.partly_available = True
+        allocation.start = datetime(2011, 1, 1, 15, 0)
+        allocation.end = datetime(2011, 1, 1, 16, 0)
+        allocation.group = str(uuid())
+        allocation.mirror_of = allocation.resource
+        Session.add(allocation)
+
+        def block(start, end):
+            Session.add(BlockedPeriod(
+                resource=allocation.resource, token=uuid(),
+                start=start, end=end
+            ))
+            Session.flush()
+
+        # blocked periods outside the allocation do not count
+        block(datetime(2010, 1, 1, 15, 0), datetime(2010, 1, 1, 16, 0))
+        block(datetime(2011, 1, 1, 10, 0), datetime(2011, 1, 1, 14, 59))
+        self.assertEqual(allocation.availability, 100.0)
+
+        # blocked periods reaching into the allocation count for their
+        # slots within the allocation
+        block(datetime(2011, 1, 1, 14, 0), datetime(2011, 1, 1, 15, 14))
+        self.assertEqual(allocation.availability, 75.0)
+
+        self.assertEqual(
+            allocation.blocked_slots(allocation._query_blocked_periods()),
+            set([datetime(2011, 1, 1, 15, 0)])
+        )
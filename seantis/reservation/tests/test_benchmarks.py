@@ -0,0 +1,115 @@
+""" Benchmarks comparing different ways of doing the same thing. They take
+a while and are therefore skipped unless the SEANTIS_RESERVATION_BENCHMARKS
+environment variable is set.
+
+"""
+
+import os
+import time
+import transaction
+
+from datetime import datetime, timedelta
+from threading import Thread
+from uuid import uuid1 as new_uuid
+
+from seantis.reservation import db
+from seantis.reservation.session import serialized
+from seantis.reservation.tests import IntegrationTestCase, config_flag
+
+from unittest2 import skipUnless
+
+from logging import getLogger
+log = getLogger('seantis.reservation')
+
+
+def timed(fn, *args, **kwargs):
+    start = time.time()
+    fn(*args, **kwargs)
+    return time.time() - start
+
+
+class AllocatingThread(Thread):
+    """ Allocates the given dates on a new resource, each in a separate
+    transaction, counting the failed transactions. """
+
+    def __init__(self, dates):
+        Thread.__init__(self)
+        self.dates = dates
+        self.failures = 0
+
+    def run(self):
+        scheduler = db.Scheduler(new_uuid(), language='en')
+
+        for dates in self.dates:
+            try:
+                scheduler.allocate(dates)
+                transaction.commit()
+            except Exception:
+                transaction.abort()
+                self.failures += 1
+
+
+def allocate_concurrently(dates, threads):
+    """ Allocates the given dates on a separate resource per thread, returning
+    the number of failed transactions. """
+
+    threads = [AllocatingThread(dates) for i in xrange(threads)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return sum(t.failures for t in threads)
+
+
+@skipUnless(
+    os.environ.get('SEANTIS_RESERVATION_BENCHMARKS'), 'benchmarks disabled'
+)
+class TestBenchmarks(IntegrationTestCase):
+
+    def dates(self, count):
+        start = datetime(2013, 1, 1, 8, 0)
+        return [
+            (start + timedelta(days=i), start + timedelta(days=i, hours=1))
+            for i in xrange(count)
+        ]
+
+    @serialized
+    def test_allocate_bulk(self):
+        dates = self.dates(10000)
+
+        orm = timed(db.Scheduler(new_uuid()).allocate, dates, quota=4)
+        bulk = timed(db.Scheduler(new_uuid()).allocate_bulk, dates, quota=4)
+        mirrors = timed(
+            db.Scheduler(new_uuid()).allocate_bulk, dates, quota=4,
+            mirrors=True
+        )
+
+        log.info(
+            'allocating 10k dates: orm %.2fs, bulk %.2fs, bulk with mirrors '
+            '%.2fs' % (orm, bulk, mirrors)
+        )
+
+        self.assertLess(bulk, orm)
+
+    def test_write_modes(self):
+        dates = self.dates(50)
+
+        results = {}
+
+        for mode in ('serializable', 'advisory-locks'):
+            with config_flag('write-mode', mode):
+                start = time.time()
+                failures = allocate_concurrently(dates, threads=8)
+                results[mode] = (time.time() - start, failures)
+
+        log.info(
+            'allocating 50 dates on 8 resources in parallel: serializable '
+            '%.2fs (%i failures), advisory locks %.2fs (%i failures)' % (
+                results['serializable'] + results['advisory-locks']
+            )
+        )
+
+        self.assertEqual(0, results['advisory-locks'][1])
@@ -0,0 +1,114 @@
+from datetime import datetime
+from uuid import uuid1 as new_uuid
+
+from seantis.reservation import db
+from seantis.reservation.session import serialized
+from seantis.reservation.tests import IntegrationTestCase
+
+reservation_email = u'test@example.com'
+
+
+class TestCapacity(IntegrationTestCase):
+
+    def setUp(self):
+        super(TestCapacity, self).setUp()
+        self.sc = db.Scheduler(new_uuid())
+
+        self.start = datetime(2011, 1, 1, 15, 0)
+        self.end = datetime(2011, 1, 1, 16, 0)
+
+    def reserve(self, start=None, end=None):
+        token = self.sc.reserve(
+            reservation_email, (start or self.start, end or self.end)
+        )
+        self.sc.approve_reservation(token)
+
+    @serialized
+    def test_siblings(self):
+        master = self.sc.allocate((self.start, self.end), quota=3)[0]
+        capacity = self.sc.capacity(master)
+
+        self.assertEqual(3, len(capacity.siblings))
+        self.assertEqual(2, len(capacity.mirrors))
+        self.assertIs(master, capacity.siblings[0])
+
+    @serialized
+    def test_find_spot(self):
+        master = self.sc.allocate((self.start, self.end), quota=3)[0]
+
+        capacity = self.sc.capacity(master)
+        self.assertIs(master, capacity.find_spot(self.start, self.end))
+        self.assertEqual(3, capacity.free_count(self.start, self.end))
+
+        self.reserve()
+
+        capacity = self.sc.capacity(master)
+        spot = capacity.find_spot(self.start, self.end)
+        self.assertFalse(spot.is_master)
+        self.assertTrue(spot.is_available(self.start, self.end))
+        self.assertEqual(2, capacity.free_count(self.start, self.end))
+
+        self.reserve()
+        self.reserve()
+
+        capacity = self.sc.capacity(master)
+        self.assertIsNone(capacity.find_spot(self.start, self.end))
+        self.assertEqual(0, capacity.free_count(self.start, self.end))
+
+    @serialized
+    def test_partly_available(self):
+        master = self.sc.allocate(
+            (self.start, self.end), quota=2, partly_available=True
+        )[0]
+
+        half = datetime(2011, 1, 1, 15, 30)
+        self.reserve(self.start, half)
+
+        capacity = self.sc.capacity(master)
+        self.assertEqual(1, capacity.free_count(self.start, half))
+        self.assertEqual(2, capacity.free_count(half, self.end))
+
+        self.assertFalse(
+            capacity.find_spot(self.start, half).is_master
+        )
+        self.assertTrue(
+            capacity.find_spot(half, self.end).is_master
+        )
+
+    @serialized
+    def test_blocked_periods(self):
+        master = self.sc.allocate(
+            (self.start, self.end), quota=2, partly_available=True
+        )[0]
+
+        half = datetime(2011, 1, 1, 15, 30)
+        self.sc.block_period(self.start, half, new_uuid())
+
+        capacity = self.sc.capacity(master)
+
+        # like allocation.is_blocked, only the allocations carrying the
+        # resource of the blocked period are blocked
+        for sibling in capacity.siblings:
+            self.assertEqual(
+                sibling.is_available(self.start, half),
+                capacity.is_available(sibling, self.start, half)
+            )
+            self.assertEqual(
+                sibling.is_blocked(self.start, half),
+                capacity.is_blocked(sibling, self.start, half)
+            )
+
+        self.assertTrue(capacity.is_blocked(master, self.start, half))
+        self.assertFalse(capacity.is_blocked(master, half, self.end))
+
+    @serialized
+    def test_scheduler_functions(self):
+        master = self.sc.allocate((self.start, self.end), quota=4)[0]
+        self.reserve()
+
+        self.assertEqual(
+            3, self.sc.free_allocations_count(master, self.start, self.end)
+        )
+        self.assertFalse(
+            self.sc.find_spot(master, self.start, self.end).is_master
+        )
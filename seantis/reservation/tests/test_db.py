@@ -1,14 +1,19 @@
 # -*- coding: utf-8 -*-
+import mock
+import transaction
+
 from datetime import datetime, timedelta
 from uuid import uuid1 as new_uuid
 
-from seantis.reservation.tests import IntegrationTestCase
+
+from seantis.reservation.tests import IntegrationTestCase, config_flag
 from seantis.reservation.error import (
     OverlappingAllocationError,
     AffectedReservationError,
     AlreadyReservedError,
     ReservationTooLong,
     InvalidAllocationError,
+    InvalidReservationToken,
     UnblockableAlreadyReservedError
 )
 
@@ -16,9 +21,11 @@ from seantis.reservation import events
 from seantis.reservation import utils
 from seantis.reservation import Session
 from seantis.reservation.session import serialized
+from seantis.reservation.models import BlockedPeriod
 from seantis.reservation.models import Allocation
 from seantis.reservation.models import Recurrence
 from seantis.reservation import db
+from seantis.reservation import postgres
 from seantis.reservation.db import unblock_periods
 
 from seantis.reservation.error import ReservationOutOfBounds
@@ -26,6 +33,10 @@ from seantis.reservation.models.reserved_slot import ReservedSlot
 from seantis.reservation.error import NoRecurringReservationError
 from seantis.reservation.error import NoReservedSlotsLeftError
 from seantis.reservation.models.reservation import Reservation
+from seantis.reservation.models.reservation import (
+    timespan_entries_by_reservation,
+    timespans_by_reservation
+)
 Scheduler = db.Scheduler
 
 reservation_email = u'test@example.com'
@@ -267,6 +278,66 @@ class TestRemoveReservationSlots(BaseTestDB):
         self.assertRaises(NoRecurringReservationError, remove_not_recurring)
 
 
+class TestTimespans(BaseTestDB):
+
+    @serialized
+    def test_timespans_by_reservation(self):
+        day = lambda d, h: datetime(2011, 1, d, h)
+
+        # a recurring reservation with one occurrence removed
+        dates = [(day(d, 15), day(d, 16)) for d in range(1, 11)]
+        self._setup_allocations(dates, rrule='RRULE:FREQ=DAILY;COUNT=10')
+        self.sc.remove_reservation_slots(self.token, day(3, 15), day(3, 16))
+        recurring = self.token
+
+        # a group reservation
+        self._allocate(
+            [(day(20, 15), day(20, 16)), (day(21, 15), day(21, 16))],
+            rrule='', grouped=True
+        )
+        self._reserve(group=self.allocations[0].group)
+        grouped = self.token
+
+        # a pending reservation
+        self._allocate([(day(25, 15), day(25, 16))], rrule='')
+        pending = self.sc.reserve(
+            reservation_email, (day(25, 15), day(25, 16))
+        )
+
+        reservations = dict(
+            (r.token, r) for r in self.sc.managed_reservations()
+        )
+
+        timespans = timespans_by_reservation(reservations.values())
+
+        self.assertEqual(
+            [(s, e) for s, e in dates if s != day(3, 15)],
+            sorted(timespans[reservations[recurring]])
+        )
+        self.assertEqual(
+            [(day(20, 15), day(20, 16)), (day(21, 15), day(21, 16))],
+            sorted(timespans[reservations[grouped]])
+        )
+        self.assertEqual(
+            [(day(25, 15), day(25, 16))], timespans[reservations[pending]]
+        )
+
+        entries = timespan_entries_by_reservation(
+            reservations.values(), start=day(5, 0), end=day(8, 0)
+        )
+        self.assertEqual(3, len(entries[reservations[recurring]]))
+        self.assertEqual(0, len(entries[reservations[grouped]]))
+
+        for entry in entries[reservations[recurring]]:
+            self.assertEqual(recurring, entry.token)
+            self.assertTrue(entry.allocation_id)
+
+        for reservation in reservations.values():
+            self.assertEqual(
+                reservation.timespans(), timespans[reservation]
+            )
+
+
 class TestScheduler(IntegrationTestCase):
 
     @serialized
@@ -917,6 +988,158 @@ class TestScheduler(IntegrationTestCase):
 
         sc.allocate(dates)
 
+    def test_allocation_overlap_reports_all_conflicts(self):
+        sc = Scheduler(new_uuid())
+
+        weeks = [datetime(2013, 1, 1, 12, 0) + timedelta(days=7 * i)
+                 for i in range(10)]
+
+        sc.allocate([(w, w + timedelta(hours=1)) for w in weeks[::3]])
+
+        dates = [(w, w + timedelta(hours=2)) for w in weeks]
+
+        try:
+            sc.allocate(dates)
+        except OverlappingAllocationError, e:
+            self.assertEqual(len(e.conflicts), 4)
+            self.assertEqual(
+                [c[0] for c in e.conflicts], weeks[::3]
+            )
+            self.assertEqual(
+                [c[2].start for c in e.conflicts], weeks[::3]
+            )
+            self.assertEqual((e.start, e.end), e.conflicts[0][:2])
+        else:
+            self.fail("OverlappingAllocationError was not raised")
+
+        # the dates in between are free
+        self.assertEqual(6, len(sc.allocate(
+            [d for ix, d in enumerate(dates) if ix % 3]
+        )))
+
+    def test_availability_by_day(self):
+        sc1 = Scheduler(new_uuid())
+        sc2 = Scheduler(new_uuid())
+
+        day = datetime(2013, 1, 1)
+        span = lambda h1, h2: (day + timedelta(hours=h1),
+                               day + timedelta(hours=h2))
+
+        sc1.allocate(span(8, 10), quota=3)
+        sc1.allocate(span(12, 14), partly_available=True, raster=30)
+        sc2.allocate(span(8, 12), partly_available=True, raster=15)
+        sc2.allocate(
+            [(s + timedelta(days=1), e + timedelta(days=1))
+             for s, e in (span(8, 9), span(10, 11))], quota=2
+        )
+
+        sc1.approve_reservation(sc1.reserve(reservation_email, span(8, 10)))
+        sc1.approve_reservation(sc1.reserve(reservation_email, span(8, 10)))
+        sc1.approve_reservation(
+            sc1.reserve(reservation_email, span(12.5, 13))
+        )
+        sc2.block_period(
+            day + timedelta(hours=9, minutes=7), span(10, 10)[0], new_uuid()
+        )
+
+        resources = [sc1.uuid, sc2.uuid]
+        start, end = day, day + timedelta(days=2)
+
+        exposed = lambda allocation: True
+        hidden = lambda allocation: not (
+            allocation.mirror_of == sc2.uuid
+            and allocation.start.date() == day.date()
+        )
+
+        for is_exposed in (exposed, hidden):
+            expected = db.materialized_availability_by_day(
+                start, end, resources, is_exposed
+            )
+            actual = db.aggregated_availability_by_day(
+                start, end, resources, is_exposed
+            )
+
+            self.assertEqual(sorted(expected), sorted(actual))
+
+            for date in expected:
+                self.assertAlmostEqual(expected[date][0], actual[date][0])
+                self.assertEqual(expected[date][1], actual[date][1])
+
+        self.assertEqual(
+            set([sc1.uuid]),
+            db.availability_by_day(start, end, resources, hidden)[
+                day.date()
+            ][1]
+        )
+
+    def test_allocate_bulk(self):
+        sc = Scheduler(new_uuid())
+
+        days = [datetime(2013, 1, 1, 12, 0) + timedelta(days=i)
+                for i in range(20)]
+
+        result = sc.allocate_bulk(
+            [(d, d + timedelta(hours=1)) for d in days], quota=3,
+            partly_available=True, raster=30
+        )
+
+        self.assertEqual(20, len(result))
+        self.assertEqual(20, sc.managed_allocations().count())
+
+        masters = sc.managed_allocations().filter(
+            Allocation.id.in_([r.id for r in result])
+        ).all()
+        self.assertEqual(sorted(days), sorted(m.start for m in masters))
+
+        for master in masters:
+            self.assertTrue(master.is_master)
+            self.assertEqual(3, master.quota)
+            self.assertEqual(30, master.raster)
+            self.assertTrue(master.partly_available)
+            self.assertEqual(master.recurrence_id, masters[0].recurrence_id)
+            self.assertTrue(master.created)
+
+        self.assertTrue(masters[0].recurrence_id)
+        self.assertEqual(20, len(set(r.group for r in result)))
+
+        # the bulk allocations are reservable like any other allocation
+        first = (days[0], days[0] + timedelta(hours=1))
+        sc.approve_reservation(sc.reserve(reservation_email, first))
+
+        master = [m for m in masters if m.start == days[0]][0]
+        self.assertEqual(2, sc.free_allocations_count(master, *first))
+
+        # overlaps are checked like in Scheduler.allocate
+        self.assertRaises(
+            OverlappingAllocationError, sc.allocate_bulk,
+            (days[1], days[1] + timedelta(hours=2))
+        )
+
+    def test_allocate_bulk_mirrors(self):
+        sc = Scheduler(new_uuid())
+
+        start = datetime(2013, 1, 1, 12, 0)
+        end = datetime(2013, 1, 1, 13, 0)
+
+        result = sc.allocate_bulk(
+            [(start, end)], quota=4, grouped=True, mirrors=True
+        )
+
+        self.assertEqual(1, len(result))
+        self.assertEqual(4, sc.managed_allocations().count())
+
+        master = sc.allocation_by_id(result[0].id)
+        siblings = master.siblings()
+
+        self.assertEqual(4, len(siblings))
+        self.assertTrue(all(s.id for s in siblings))
+        self.assertEqual(1, len(set(s.group for s in siblings)))
+
+        for i in range(4):
+            sc.approve_reservation(sc.reserve(reservation_email, (start, end)))
+
+        self.assertEqual(0, sc.free_allocations_count(master, start, end))
+
     def test_block_periods_event_fired(self):
         sc = Scheduler(new_uuid())
         start, end = (
@@ -1302,6 +1525,209 @@ class TestScheduler(IntegrationTestCase):
             AffectedReservationError, sc.remove_allocation, allocation.id
         )
 
+    @serialized
+    def test_optimistic_slots(self):
+        start = datetime(2011, 1, 1, 8, 0)
+        end = datetime(2011, 1, 1, 16, 0)
+        half = datetime(2011, 1, 1, 12, 0)
+
+        def approve_reservations(sc):
+            sc.allocate(
+                (start, end), quota=3, partly_available=True,
+                approve_manually=True
+            )
+
+            # the second half of the master is taken, the whole day has to
+            # be reserved on the next free mirror
+            sc.approve_reservation(sc.reserve(reservation_email, (half, end)))
+            sc.approve_reservation(
+                sc.reserve(reservation_email, (start, end), quota=2)
+            )
+
+            self.assertRaises(
+                AlreadyReservedError, sc.approve_reservation,
+                sc.reserve(reservation_email, (half, end))
+            )
+
+            sc.approve_reservation(
+                sc.reserve(reservation_email, (start, half))
+            )
+
+            query = Session.query(ReservedSlot)
+            query = query.filter(ReservedSlot.resource.in_(
+                [s.resource for s in sc.allocation_by_date(start, end)
+                 .siblings()]
+            ))
+
+            return sorted(
+                (str(s.resource) == str(sc.uuid), s.start) for s in query
+            )
+
+        with config_flag('optimistic-slots', 'on'):
+            optimistic = approve_reservations(Scheduler(new_uuid()))
+
+        pessimistic = approve_reservations(Scheduler(new_uuid()))
+
+        self.assertEqual(pessimistic, optimistic)
+        self.assertEqual(32 * 3, len(optimistic))
+
+    @serialized
+    def test_optimistic_slots_conflict(self):
+        sc = Scheduler(new_uuid())
+
+        dates = (datetime(2011, 1, 1, 8, 0), datetime(2011, 1, 1, 9, 0))
+        sc.allocate(dates, quota=3, approve_manually=True)
+
+        insert = postgres.insert_ignoring_conflicts
+        calls = []
+
+        # the master and the first mirror are taken by someone else
+        def conflicting(*args, **kwargs):
+            calls.append(True)
+            return len(calls) <= 2 and [] or insert(*args, **kwargs)
+
+        with config_flag('optimistic-slots', 'on'):
+            with mock.patch.object(
+                postgres, 'insert_ignoring_conflicts', conflicting
+            ):
+                token = sc.reserve(reservation_email, dates)
+                slots = sc.approve_reservation(token)
+
+        self.assertEqual(3, len(calls))
+
+        # the first mirror is not left behind without slots
+        allocations = sc.managed_allocations().all()
+        self.assertEqual(2, len(allocations))
+        self.assertEqual(
+            set(a.resource for a in allocations if not a.is_master),
+            set(s.resource for s in slots)
+        )
+
+    @serialized
+    def test_approve_reservations(self):
+        sc = Scheduler(new_uuid())
+
+        start = datetime(2011, 1, 1, 8, 0)
+        end = datetime(2011, 1, 1, 16, 0)
+        half = datetime(2011, 1, 1, 12, 0)
+
+        sc.allocate(
+            (start, end), quota=3, partly_available=True,
+            approve_manually=True
+        )
+
+        tokens = [
+            sc.reserve(reservation_email, (start, end), quota=2),
+            sc.reserve(reservation_email, (half, end), quota=2),
+            sc.reserve(reservation_email, (start, half)),
+            sc.reserve(reservation_email, (half, end))
+        ]
+        unknown = new_uuid()
+
+        # the second reservation does not fit anymore, the others do
+        failures = sc.approve_reservations(tokens + [unknown])
+
+        self.assertEqual(set([tokens[1], unknown]), set(failures))
+        self.assertIs(type(failures[tokens[1]]), AlreadyReservedError)
+        self.assertIs(type(failures[unknown]), InvalidReservationToken)
+
+        self.assertEqual(
+            [u'approved', u'pending', u'approved', u'approved'],
+            [sc.reservation_by_token(t).one().status for t in tokens]
+        )
+
+        self.assertEqual(32 * 3, sc.managed_reserved_slots().count())
+
+        # nothing is left for the second reservation, the approved
+        # reservations are skipped
+        failures = sc.approve_reservations(tokens)
+        self.assertEqual([tokens[1]], failures.keys())
+        self.assertEqual(32 * 3, sc.managed_reserved_slots().count())
+
+    @serialized
+    def test_deny_and_revoke_reservations(self):
+        sc = Scheduler(new_uuid())
+
+        dates = (datetime(2011, 1, 1, 8, 0), datetime(2011, 1, 1, 9, 0))
+        sc.allocate(dates, quota=4, approve_manually=True)
+
+        tokens = [sc.reserve(reservation_email, dates) for i in range(4)]
+        self.assertEqual({}, sc.approve_reservations(tokens[:2]))
+
+        # approved reservations are not denied
+        failures = sc.deny_reservations(tokens[1:])
+
+        self.assertEqual([tokens[1]], failures.keys())
+        self.assertEqual(2, sc.managed_reservations().count())
+
+        # the periods blocked on other resources are removed as well
+        other = Scheduler(new_uuid())
+        other.block_period(dates[0], dates[1], tokens[0])
+        version = other.version()
+
+        # pending reservations are not revoked
+        pending = sc.reserve(reservation_email, dates)
+
+        failures = sc.revoke_reservations(
+            tokens + [pending], u'', send_email=False
+        )
+
+        self.assertEqual(set(tokens[2:] + [pending]), set(failures))
+        self.assertEqual(1, sc.managed_reservations().count())
+        self.assertEqual(
+            u'pending', sc.reservation_by_token(pending).one().status
+        )
+        self.assertEqual(0, sc.managed_reserved_slots().count())
+        self.assertEqual(0, Session.query(BlockedPeriod).count())
+        self.assertEqual(version + 1, other.version())
+
+    @serialized
+    def test_resource_versions(self):
+        sc = Scheduler(new_uuid())
+        other = Scheduler(new_uuid())
+
+        self.assertEqual(0, sc.version())
+
+        dates = (datetime(2011, 1, 1, 8, 0), datetime(2011, 1, 1, 9, 0))
+        sc.allocate(dates, quota=2, approve_manually=True)
+
+        self.assertEqual(1, sc.version())
+
+        # nested writes bump the version once
+        token = sc.reserve(reservation_email, dates)
+        sc.approve_reservation(token)
+
+        self.assertEqual(3, sc.version())
+
+        sc.block_period(
+            datetime(2011, 1, 1, 8, 0), datetime(2011, 1, 1, 8, 15),
+            new_uuid()
+        )
+        self.assertEqual(4, sc.version())
+
+        # failed writes do not count
+        self.assertRaises(
+            InvalidReservationToken, sc.approve_reservation, new_uuid()
+        )
+        self.assertEqual(4, sc.version())
+
+        # the bump is committed and rolled back together with the change
+        transaction.commit()
+
+        sc.reserve(reservation_email, dates)
+        self.assertEqual(5, sc.version())
+
+        transaction.abort()
+        self.assertEqual(4, sc.version())
+
+        versions = db.resource_versions([sc.uuid, other.uuid.hex])
+        self.assertEqual({sc.uuid: 4, other.uuid: 0}, versions)
+
+        db.extinguish_resource(sc.uuid)
+        transaction.commit()
+
+        self.assertEqual(5, sc.version())
+
     @serialized
     def test_imaginary_mirrors(self):
         sc = Scheduler(new_uuid())
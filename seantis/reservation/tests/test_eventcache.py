@@ -0,0 +1,134 @@
+import json
+import time
+
+from zope.component import getUtility
+
+from seantis.reservation import eventcache
+from seantis.reservation import utils
+from seantis.reservation.session import ISessionUtility
+from seantis.reservation.tests import IntegrationTestCase, config_flag
+
+
+class TestEventCache(IntegrationTestCase):
+
+    def tearDown(self):
+        eventcache._caches.clear()
+        super(TestEventCache, self).tearDown()
+
+    def test_memory_backend(self):
+        cache = eventcache.MemoryBackend(10)
+
+        self.assertIsNone(cache.get('a', 1))
+
+        cache.set('a', 1, '[1, 2]')
+        self.assertEqual('[1, 2]', cache.get('a', 1))
+
+        # events of another version are dropped
+        self.assertIsNone(cache.get('a', 2))
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.size)
+
+        # the least recently used events are evicted
+        cache.set('a', 1, '[1]')
+        cache.set('b', 1, '[2]')
+        cache.set('c', 1, '[3]')
+        cache.get('a', 1)
+        cache.set('d', 1, '[4]')
+
+        self.assertEqual(3, len(cache))
+        self.assertIsNone(cache.get('b', 1))
+        self.assertEqual('[1]', cache.get('a', 1))
+
+        # events larger than the cache are not cached
+        cache.set('e', 1, '[1, 2, 3, 4]')
+        self.assertIsNone(cache.get('e', 1))
+
+        # the size is counted in bytes
+        cache.clear()
+        cache.set('f', 1, u'["\xe4"]')
+        self.assertEqual(6, cache.total_size())
+
+        statistics = cache.statistics.as_dict()
+        self.assertEqual(3, statistics['hits'])
+        self.assertEqual(4, statistics['misses'])
+        self.assertEqual(1, statistics['evictions'])
+        self.assertEqual(3.0 / 7, statistics['hit_ratio'])
+
+    def test_postgres_backend(self):
+        dsn = getUtility(ISessionUtility).get_dsn(utils.getSite())
+        cache = eventcache.PostgresBackend(10, dsn)
+
+        try:
+            self.assertIsNone(cache.get('a', 1))
+
+            cache.set('a', 1, '[1, 2]')
+            self.assertEqual('[1, 2]', cache.get('a', 1))
+            self.assertIsNone(cache.get('a', 2))
+
+            cache.set('a', 2, '[1]')
+            self.assertEqual('[1]', cache.get('a', 2))
+            self.assertEqual(1, len(cache))
+
+            # the oldest events are evicted, once the interval passed
+            cache.set('b', 1, '[2]')
+            cache.set('c', 1, '[3]')
+            cache.set('d', 1, '[4]')
+
+            self.assertEqual(4, len(cache))
+            self.assertEqual(12, cache.total_size())
+
+            cache.evict(time.time() + eventcache.EVICTION_INTERVAL)
+
+            self.assertEqual(3, len(cache))
+            self.assertIsNone(cache.get('a', 2))
+            self.assertEqual('[4]', cache.get('d', 1))
+            self.assertEqual(1, cache.statistics.evictions)
+        finally:
+            cache.clear()
+
+    def test_cached_events(self):
+        rendered = []
+
+        def render():
+            rendered.append(True)
+            return '[]'
+
+        # without the cache the events are rendered every time
+        self.assertIsNone(eventcache.get_cache())
+        eventcache.cached_events('a', 1, render)
+        eventcache.cached_events('a', 1, render)
+        self.assertEqual(2, len(rendered))
+
+        with config_flag('event-cache', 'memory'):
+            with config_flag('event-cache-size', '1'):
+                cache = eventcache.get_cache()
+                self.assertIs(cache, eventcache.get_cache())
+                self.assertEqual(1024 * 1024, cache.max_size)
+
+                for i in range(2):
+                    self.assertEqual(
+                        '[]', eventcache.cached_events('a', 1, render)
+                    )
+                self.assertEqual(3, len(rendered))
+
+                # a new version of the resource renders the events again
+                eventcache.cached_events('a', 2, render)
+                self.assertEqual(4, len(rendered))
+
+                self.assertEqual(1, cache.statistics.hits)
+                self.assertEqual(2, cache.statistics.misses)
+
+    def test_statistics_view(self):
+        view = self.portal.unrestrictedTraverse(
+            '@@reservation-event-cache-statistics'
+        )
+        self.assertEqual(dict(enabled=False), json.loads(view()))
+
+        with config_flag('event-cache', 'memory'):
+            eventcache.cached_events('a', 1, lambda: '[]')
+
+            statistics = json.loads(view())
+            self.assertTrue(statistics['enabled'])
+            self.assertEqual(1, statistics['misses'])
+            self.assertEqual(1, statistics['entries'])
+            self.assertEqual(2, statistics['size'])
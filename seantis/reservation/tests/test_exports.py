@@ -1,13 +1,19 @@
 # -*- coding: utf-8 -*-
+import json
+import zipfile
+from cStringIO import StringIO
 from datetime import datetime
 
 from Acquisition import aq_base
+from unittest2 import skipUnless
 
 from seantis.reservation.tests import IntegrationTestCase
 from seantis.reservation import utils
 from seantis.reservation.session import serialized
 from seantis.reservation import exports
-from seantis.reservation.export import ExportView
+from seantis.reservation.export import ExportView, CsvExportView
+from seantis.reservation.export import csv_chunks, json_chunks
+from seantis.reservation.export import xlsx_chunks, HAS_XLSXWRITER
 
 
 class TestExports(IntegrationTestCase):
@@ -106,6 +112,106 @@ class TestExports(IntegrationTestCase):
         self.assertEqual(len(dataset), 1)
         self.assertEqual(dataset[0][0], None)
 
+    @serialized
+    def test_reservations_export_streaming(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        sc = resource.scheduler()
+
+        start = datetime(2012, 2, 1, 12, 0)
+        end = datetime(2012, 2, 1, 16, 0)
+        dates = (start, end)
+
+        sc.allocate(dates, approve_manually=False, quota=5)
+
+        for ix in range(5):
+            sc.reserve(
+                u'test@example.com', dates,
+                data=utils.mock_data_dictionary({'number': unicode(ix)})
+            )
+
+        resources = {resource.uuid(): resource}
+        dataset = exports.reservations.dataset(resources, 'en')
+
+        headers, records = exports.reservations.records(resources, 'en')
+        self.assertEqual(dataset.headers, headers)
+        self.assertEqual(len(list(records)), 5)
+
+        # the output is independent of the chunk sizes
+        for chunk_size in (1, 2, 500):
+            chunks = exports.reservations.stream_records(
+                resources, chunk_size=chunk_size
+            )
+            self.assertEqual(
+                [r.token for c in chunks for r in c],
+                [r.token for r in exports.reservations.fetch_records(
+                    resources
+                )]
+            )
+
+            headers, records = exports.reservations.records(resources, 'en')
+            self.assertEqual(
+                dataset.csv, ''.join(csv_chunks(headers, records, chunk_size))
+            )
+
+            headers, records = exports.reservations.records(resources, 'en')
+            self.assertEqual(
+                json.loads(dataset.json),
+                json.loads(''.join(json_chunks(headers, records, chunk_size)))
+            )
+
+        request = self.request()
+        request['source'] = 'reservations'
+
+        view = CsvExportView(resource, request)
+        self.assertEqual('', view.render())
+
+        response = view.request.RESPONSE
+        self.assertNotIn('content-length', response.headers)
+        self.assertEqual(
+            response.headers['content-type'], 'application/csv;charset=utf-8'
+        )
+
+    @skipUnless(HAS_XLSXWRITER, 'requires XlsxWriter')
+    @serialized
+    def test_reservations_export_xlsx(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        sc = resource.scheduler()
+
+        dates = (datetime(2012, 2, 1, 12, 0), datetime(2012, 2, 1, 16, 0))
+        sc.allocate(dates, approve_manually=False, quota=2)
+
+        tokens = [
+            utils.string_uuid(sc.reserve(u'test@example.com', dates))
+            for i in range(2)
+        ]
+
+        headers, records = exports.reservations.records(
+            {resource.uuid(): resource}, 'en'
+        )
+
+        output = ''.join(xlsx_chunks(headers, records, chunk_size=1024))
+        workbook = zipfile.ZipFile(StringIO(output))
+
+        self.assertIn('xl/worksheets/sheet1.xml', workbook.namelist())
+        self.assertNotIn('xl/worksheets/sheet2.xml', workbook.namelist())
+
+        sheet = workbook.read('xl/worksheets/sheet1.xml')
+
+        for token in tokens:
+            self.assertIn(token, sheet)
+
+        # an empty export still contains the headers
+        output = ''.join(xlsx_chunks(headers, iter([])))
+        sheet = zipfile.ZipFile(StringIO(output)).read(
+            'xl/worksheets/sheet1.xml'
+        )
+
+        self.assertIn('Token', sheet)
+
     def test_export_view(self):
 
         class MyExportView(ExportView):
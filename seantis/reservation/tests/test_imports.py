@@ -0,0 +1,195 @@
+import json
+import transaction
+from cStringIO import StringIO
+from datetime import datetime
+from uuid import uuid1 as new_uuid
+
+from seantis.reservation import db
+from seantis.reservation import utils
+from seantis.reservation.imports import reservations
+from seantis.reservation.error import (
+    AlreadyReservedError,
+    ReservationOutOfBounds,
+    ReservationParametersInvalid
+)
+from seantis.reservation.tests import IntegrationTestCase
+
+
+class TestImports(IntegrationTestCase):
+
+    def allocate(self, start, end, **options):
+        sc = db.Scheduler(new_uuid(), language='en')
+        sc.allocate((start, end), **options)
+        transaction.commit()
+
+        return sc
+
+    def test_parse_entry(self):
+        resource = new_uuid()
+
+        records = reservations.parse_entry(1, dict(
+            resource=resource.hex,
+            email=u'test@example.com',
+            dates=[
+                ['2014-01-01 10:00', '2014-01-01 12:00'],
+                ['2014-01-02T10:00:00', '2014-01-02T12:00:00']
+            ],
+            data='{"form": {"values": []}}'
+        ))
+
+        self.assertEqual(2, len(records))
+        self.assertEqual(resource, records[0].resource)
+        self.assertEqual(datetime(2014, 1, 1, 10), records[0].start)
+        self.assertEqual(datetime(2014, 1, 2, 12), records[1].end)
+        self.assertEqual(1, records[1].quota)
+        self.assertEqual({u'form': {u'values': []}}, records[1].data)
+
+        self.assertRaises(
+            ReservationParametersInvalid, reservations.parse_entry, 1,
+            dict(resource='x', start='2014-01-01 10:00', end='2014-01-01')
+        )
+        self.assertRaises(
+            ReservationParametersInvalid, reservations.parse_entry, 1,
+            dict(resource=resource.hex, start='tomorrow', end='2014-01-01')
+        )
+
+    def test_import_csv(self):
+        start = datetime(2014, 1, 1, 10, 0)
+        end = datetime(2014, 1, 1, 12, 0)
+
+        sc = self.allocate(start, end, quota=2, approve_manually=False)
+        resource = utils.string_uuid(sc.uuid)
+
+        rows = [
+            'resource,email,start,end,quota',
+            '%s,a@example.com,2014-01-01 10:00,2014-01-01 12:00,' % resource,
+            '%s,b@example.com,2014-01-01 10:00,2014-01-01 12:00,1' % resource,
+            '%s,c@example.com,2014-01-01 10:00,2014-01-01 12:00,1' % resource,
+            '%s,d@example.com,2014-01-02 10:00,2014-01-02 12:00,1' % resource,
+            '%s,invalid,2014-01-01 10:00,2014-01-01 12:00,1' % resource,
+            '%s,e@example.com,today,2014-01-01 12:00,1' % resource,
+        ]
+
+        result = reservations.import_reservations(
+            StringIO('\n'.join(rows)), 'csv', language='en', chunk_size=2
+        )
+
+        self.assertEqual(2, len(result.imported))
+        self.assertEqual(
+            [4, 5, 6, 7], sorted(c.line for c in result.conflicts)
+        )
+
+        errors = dict((c.line, type(c.error)) for c in result.conflicts)
+        self.assertIs(AlreadyReservedError, errors[4])
+        self.assertIs(ReservationOutOfBounds, errors[5])
+        self.assertIs(ReservationParametersInvalid, errors[7])
+
+        report = result.report()
+        self.assertEqual(2, report['imported'])
+        self.assertEqual([], report['pending'])
+        self.assertEqual(
+            'AlreadyReservedError', sorted(
+                report['conflicts'], key=lambda c: c['line']
+            )[0]['error']
+        )
+
+        query = sc.managed_reservations()
+        self.assertEqual(2, query.count())
+        self.assertEqual(set([u'approved']), set(r.status for r in query))
+        self.assertEqual(2, sc.managed_reserved_slots().count())
+
+    def test_import_json(self):
+        start = datetime(2014, 1, 1, 10, 0)
+        end = datetime(2014, 1, 1, 12, 0)
+
+        sc = self.allocate(start, end, quota=1, partly_available=True)
+
+        stream = StringIO(json.dumps([
+            dict(
+                resource=utils.string_uuid(sc.uuid),
+                email=u'club@example.com',
+                dates=[
+                    ['2014-01-01 10:00', '2014-01-01 11:00'],
+                    ['2014-01-01 11:00', '2014-01-01 12:00'],
+                ],
+                data={u'club': {u'values': []}}
+            )
+        ]))
+
+        result = reservations.import_reservations(
+            stream, 'json', language='en', approve=False
+        )
+
+        self.assertEqual(2, len(result.imported))
+        self.assertEqual([], result.conflicts)
+
+        query = sc.managed_reservations()
+        self.assertEqual(set([u'pending']), set(r.status for r in query))
+        self.assertEqual(0, sc.managed_reserved_slots().count())
+
+    def test_import_manual_approval(self):
+        start = datetime(2014, 1, 1, 10, 0)
+        end = datetime(2014, 1, 1, 12, 0)
+
+        sc = self.allocate(start, end, quota=1, approve_manually=True)
+
+        rows = [
+            'resource,email,start,end',
+            '%s,a@example.com,2014-01-01 10:00,2014-01-01 12:00' % (
+                utils.string_uuid(sc.uuid)
+            )
+        ]
+
+        result = reservations.import_reservations(
+            StringIO('\n'.join(rows)), 'csv', language='en'
+        )
+
+        self.assertEqual(1, len(result.imported))
+        self.assertEqual(result.imported, result.pending)
+        self.assertEqual(
+            [utils.string_uuid(result.imported[0])],
+            result.report()['pending']
+        )
+        self.assertEqual(u'pending', sc.managed_reservations().one().status)
+        self.assertEqual(0, sc.managed_reserved_slots().count())
+
+        result = reservations.import_reservations(
+            StringIO('\n'.join(rows)), 'csv', language='en',
+            force_approve=True
+        )
+
+        self.assertEqual(1, len(result.imported))
+        self.assertEqual([], result.pending)
+        self.assertEqual(1, sc.managed_reserved_slots().count())
+
+    def test_import_transaction(self):
+        start = datetime(2014, 1, 1, 10, 0)
+        end = datetime(2014, 1, 1, 12, 0)
+
+        sc = self.allocate(start, end, quota=1, approve_manually=False)
+
+        rows = [
+            'resource,email,start,end',
+            '%s,a@example.com,2014-01-01 10:00,2014-01-01 12:00' % (
+                utils.string_uuid(sc.uuid)
+            )
+        ]
+
+        # the import leaves the transaction to the caller
+        result = reservations.import_reservations(
+            StringIO('\n'.join(rows)), 'csv', language='en'
+        )
+        self.assertEqual(1, len(result.imported))
+
+        transaction.abort()
+        self.assertEqual(0, sc.managed_reservations().count())
+
+        # unless it is asked to commit each chunk
+        result = reservations.ReservationImport(language='en').run(
+            reservations.readers['csv'](StringIO('\n'.join(rows))),
+            commit=True
+        )
+        self.assertEqual(1, len(result.imported))
+
+        transaction.abort()
+        self.assertEqual(1, sc.managed_reservations().count())
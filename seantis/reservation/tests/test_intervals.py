@@ -0,0 +1,42 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+from unittest2 import TestCase
+
+from seantis.reservation.intervals import IntervalIndex, index_by_resource
+
+Period = namedtuple('Period', ['resource', 'start', 'end'])
+
+
+class TestIntervals(TestCase):
+
+    def test_overlapping(self):
+        day = lambda d, h=0: datetime(2013, 1, d) + timedelta(hours=h)
+
+        lasting = Period('a', day(1), day(20))
+        short = Period('a', day(5), day(5, 2))
+        touching = Period('a', day(5, 2), day(6))
+        late = Period('a', day(25), day(26))
+
+        index = IntervalIndex([late, touching, lasting, short])
+        self.assertEqual(4, len(index))
+
+        self.assertEqual([lasting], index.overlapping(day(2), day(3)))
+        self.assertEqual(
+            [lasting, short, touching], index.overlapping(day(5, 1), day(5, 2))
+        )
+        self.assertEqual([lasting], index.overlapping(day(20), day(21)))
+        self.assertEqual([], index.overlapping(day(21), day(24)))
+        self.assertEqual([late], index.overlapping(day(24), day(30)))
+
+        self.assertEqual([], IntervalIndex().overlapping(day(1), day(2)))
+
+    def test_index_by_resource(self):
+        start, end = datetime(2013, 1, 1), datetime(2013, 1, 2)
+
+        indexes = index_by_resource([
+            Period('a', start, end), Period('b', start, end)
+        ])
+
+        self.assertEqual(1, len(indexes['a'].overlapping(start, end)))
+        self.assertEqual(1, len(indexes['b'].overlapping(start, end)))
+        self.assertEqual(0, len(indexes['c'].overlapping(start, end)))
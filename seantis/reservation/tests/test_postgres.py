@@ -0,0 +1,180 @@
+import mock
+
+from datetime import datetime, timedelta
+from uuid import uuid1 as new_uuid
+
+from seantis.reservation import db
+from seantis.reservation import postgres
+from seantis.reservation import Session
+from seantis.reservation.capacity import Capacity
+from seantis.reservation.error import AlreadyReservedError
+from seantis.reservation.error import UnblockableAlreadyReservedError
+from seantis.reservation.models import ReservedSlot
+from seantis.reservation.session import serialized
+from seantis.reservation.tests import IntegrationTestCase, config_flag
+
+
+class TestRangeIndexes(IntegrationTestCase):
+
+    def test_range_indexes_enabled(self):
+        self.assertFalse(postgres.range_indexes_enabled())
+
+        with config_flag('range-indexes', 'off'):
+            self.assertFalse(postgres.range_indexes_enabled())
+
+        with config_flag('range-indexes', 'on'):
+            self.assertTrue(postgres.range_indexes_enabled())
+
+    @serialized
+    def test_range_queries(self):
+        sc = db.Scheduler(new_uuid())
+
+        start = datetime(2013, 1, 1, 12, 0)
+        dates = [
+            (start + timedelta(days=i), start + timedelta(days=i, hours=2))
+            for i in range(10)
+        ]
+
+        allocations = sc.allocate(dates, quota=2)
+        sc.block_period(dates[3][0], dates[3][1], new_uuid())
+
+        def lookups():
+            touching = (dates[2][1], dates[4][0])
+            return (
+                sc.allocations_in_range(*touching).count(),
+                db.all_allocations_in_range(*dates[5]).count(),
+                allocations[3].is_blocked(),
+                allocations[4].is_blocked(),
+                sc.capacity(allocations[3]).is_blocked(allocations[3]),
+                sc.capacity(allocations[4]).is_blocked(allocations[4])
+            )
+
+        expected = lookups()
+        self.assertEqual((2, 1, True, False, True, False), expected)
+
+        with config_flag('range-indexes', 'on'):
+            postgres.create_range_indexes(Session.connection())
+
+            self.assertEqual(expected, lookups())
+
+            # creating the indexes twice does nothing
+            postgres.create_range_indexes(Session.connection())
+
+
+class TestExclusionConstraints(IntegrationTestCase):
+
+    def test_exclusion_constraints_enabled(self):
+        self.assertFalse(postgres.exclusion_constraints_enabled())
+
+        with config_flag('exclusion-constraints', 'on'):
+            self.assertTrue(postgres.exclusion_constraints_enabled())
+
+    # the table and the triggers are created in the test transaction, which
+    # is rolled back at the end of the test
+    @serialized
+    def test_exclusion_constraints(self):
+        sc = db.Scheduler(new_uuid())
+
+        start = datetime(2013, 1, 1, 12, 0)
+        end = datetime(2013, 1, 1, 14, 0)
+
+        sc.allocate((start, end), partly_available=True, quota=1)
+
+        token = sc.reserve(
+            u'test@example.com', (start, start + timedelta(hours=1))
+        )
+        sc.approve_reservation(token)
+
+        with config_flag('exclusion-constraints', 'on'):
+            postgres.create_exclusion_constraints(Session.connection())
+
+            # existing slots are part of the occupancy
+            self.assertEqual(4, Session.execute(
+                'SELECT count(*) FROM occupancy WHERE kind = 0'
+            ).scalar())
+
+            # blocking reserved slots fails
+            self.assertRaises(
+                UnblockableAlreadyReservedError, sc.block_period,
+                start + timedelta(minutes=45), end, new_uuid()
+            )
+
+            # reserving blocked slots fails
+            pending = sc.reserve(
+                u'test@example.com', (end - timedelta(minutes=30), end)
+            )
+            sc.block_period(end - timedelta(minutes=15), end, new_uuid())
+
+            self.assertRaises(
+                AlreadyReservedError, sc.approve_reservation, pending
+            )
+
+            # removed slots leave the occupancy
+            sc.remove_reservation(token)
+
+            self.assertEqual(0, Session.execute(
+                'SELECT count(*) FROM occupancy WHERE kind = 0'
+            ).scalar())
+
+            sc.block_period(start, start + timedelta(hours=1), new_uuid())
+
+            # creating the constraints twice does nothing
+            postgres.create_exclusion_constraints(Session.connection())
+
+    @serialized
+    def test_exclusion_constraints_mirrors(self):
+        sc = db.Scheduler(new_uuid())
+
+        start = datetime(2013, 1, 1, 12, 0)
+        end = datetime(2013, 1, 1, 14, 0)
+
+        sc.allocate((start, end), quota=2)
+
+        first = sc.reserve(u'test@example.com', (start, end))
+        sc.approve_reservation(first)
+
+        second = sc.reserve(u'test@example.com', (start, end))
+        sc.approve_reservation(second)
+
+        with config_flag('exclusion-constraints', 'on'):
+            postgres.create_exclusion_constraints(Session.connection())
+
+            # only the slot of the mirror allocation is left
+            sc.remove_reservation(first)
+
+            slot = Session.query(ReservedSlot).filter(
+                ReservedSlot.reservation_token == second
+            ).one()
+            self.assertNotEqual(sc.uuid, slot.resource)
+
+            # the slots of mirrors are occupying the master resource, so the
+            # constraint rejects the blocked period
+            self.assertRaises(
+                UnblockableAlreadyReservedError, sc.block_period,
+                start, end, new_uuid()
+            )
+
+    @serialized
+    def test_exclusion_constraints_optimistic_slots(self):
+        sc = db.Scheduler(new_uuid())
+
+        start = datetime(2013, 1, 1, 12, 0)
+        end = datetime(2013, 1, 1, 14, 0)
+
+        sc.allocate((start, end), quota=2)
+        token = sc.reserve(u'test@example.com', (start, end))
+        sc.block_period(start, end, new_uuid())
+
+        with config_flag('exclusion-constraints', 'on'):
+            with config_flag('optimistic-slots', 'on'):
+                postgres.create_exclusion_constraints(Session.connection())
+
+                # with the blocked period overlooked, the insert of the
+                # slots is rejected by the constraint and mapped to the
+                # reservation error
+                with mock.patch.object(
+                    Capacity, 'is_blocked', return_value=False
+                ):
+                    self.assertRaises(
+                        AlreadyReservedError, sc.approve_reservation, token
+                    )
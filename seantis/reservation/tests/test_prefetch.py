@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+from uuid import uuid1 as new_uuid
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from seantis.reservation import utils
+from seantis.reservation.prefetch import CalendarPrefetch
+from seantis.reservation.resource import Slots
+from seantis.reservation.session import serialized
+from seantis.reservation.tests import IntegrationTestCase
+
+reservation_email = u'test@example.com'
+
+
+def count_queries(fn):
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', count)
+    try:
+        fn()
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count)
+
+    return len(statements)
+
+
+class TestPrefetch(IntegrationTestCase):
+
+    def setUp(self):
+        super(TestPrefetch, self).setUp()
+        self.start = datetime(2013, 1, 1)
+        self.end = datetime(2013, 1, 31)
+
+    def add_allocations(self, scheduler, day):
+        hour = lambda h: self.start + timedelta(days=day, hours=h)
+
+        scheduler.allocate((hour(8), hour(10)), quota=2)
+        scheduler.allocate((hour(12), hour(14)), partly_available=True)
+        scheduler.allocate(
+            [(hour(15), hour(16)), (hour(17), hour(18))], grouped=True
+        )
+
+        scheduler.approve_reservation(
+            scheduler.reserve(reservation_email, (hour(12), hour(13)))
+        )
+        scheduler.approve_reservation(
+            scheduler.reserve(reservation_email, (hour(8), hour(10)))
+        )
+        scheduler.reserve(reservation_email, (hour(8), hour(10)))
+        scheduler.block_period(hour(13.5), hour(14), new_uuid())
+
+    def slots(self, resource):
+        request = self.request()
+        request.set('start', str(utils.utctimestamp(self.start)))
+        request.set('end', str(utils.utctimestamp(self.end)))
+
+        return Slots(resource, request)
+
+    @serialized
+    def test_prefetch(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        sc = resource.scheduler()
+
+        for day in range(3):
+            self.add_allocations(sc, day)
+
+        prefetch = CalendarPrefetch(sc, self.start, self.end, resource)
+        self.assertEqual(12, len(prefetch.masters))
+
+        for allocation in prefetch.masters:
+            self.assertEqual(
+                sc.availability(allocation.start, allocation.end),
+                prefetch.availability(allocation)
+            )
+            self.assertEqual(
+                allocation.waitinglist_length,
+                prefetch.waitinglist_length(allocation)
+            )
+            self.assertEqual(
+                allocation.in_group, prefetch.in_group(allocation)
+            )
+
+            if allocation.partly_available:
+                self.assertEqual(
+                    allocation.availability_partitions(sc),
+                    prefetch.availability_partitions(allocation)
+                )
+
+    @serialized
+    def test_slots_query_count(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        sc = resource.scheduler()
+
+        self.add_allocations(sc, 0)
+
+        view = self.slots(resource)
+        self.assertEqual(4, len(view.events()))
+        few = count_queries(view.events)
+
+        for day in range(1, 10):
+            self.add_allocations(sc, day)
+
+        view = self.slots(resource)
+        self.assertEqual(40, len(view.events()))
+        many = count_queries(view.events)
+
+        self.assertEqual(few, many)
+
+    @serialized
+    def test_slots_query_budget(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        sc = resource.scheduler()
+
+        for day in range(10):
+            self.add_allocations(sc, day)
+
+        view = self.slots(resource)
+
+        with self.assert_query_budget(10):
+            self.assertEqual(40, len(view.events()))
+
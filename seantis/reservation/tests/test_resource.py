@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+from seantis.reservation import utils
+from seantis.reservation.resource import Slots
+from seantis.reservation.session import serialized
+from seantis.reservation.tests import IntegrationTestCase
+
+reservation_email = u'test@example.com'
+
+
+class TestResource(IntegrationTestCase):
+
+    def setUp(self):
+        super(TestResource, self).setUp()
+        self.start = datetime(2013, 1, 1)
+        self.end = datetime(2013, 1, 31)
+
+    def add_allocations(self, scheduler, day):
+        hour = lambda h: self.start + timedelta(days=day, hours=h)
+
+        scheduler.allocate((hour(8), hour(10)), quota=2)
+        scheduler.approve_reservation(
+            scheduler.reserve(reservation_email, (hour(8), hour(10)))
+        )
+
+    def slots(self, resource):
+        request = self.request()
+        request.set('start', str(utils.utctimestamp(self.start)))
+        request.set('end', str(utils.utctimestamp(self.end)))
+
+        return Slots(resource, request)
+
+    @serialized
+    def test_slots_etag(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        sc = resource.scheduler()
+
+        self.add_allocations(sc, 0)
+
+        etag = self.slots(resource).etag()
+        self.assertEqual(etag, self.slots(resource).etag())
+
+        request = self.request()
+        self.assertNotEqual(u'', self.slots(resource).render())
+        self.assertEqual(etag, request.response.getHeader('ETag'))
+
+        # the events are not rendered again if the client has them
+        request.environ['HTTP_IF_NONE_MATCH'] = etag
+
+        self.assertEqual(u'', self.slots(resource).render())
+        self.assertEqual(304, request.response.getStatus())
+
+        # changes to the resource lead to a new etag
+        self.add_allocations(sc, 1)
+        self.assertNotEqual(etag, self.slots(resource).etag())
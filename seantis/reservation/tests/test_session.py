@@ -2,20 +2,36 @@ import transaction
 import mock
 
 from collections import namedtuple
+from contextlib import contextmanager
 from threading import Thread
 from uuid import uuid1 as uuid
 from datetime import datetime
-from seantis.reservation.tests import IntegrationTestCase
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool
+from seantis.reservation.tests import IntegrationTestCase, config_flag
 
 from seantis.reservation.session import (
+    EngineRegistry,
+    SERIALIZABLE,
+    SessionStore,
+    advisory_lock_key,
+    backoff,
     getUtility,
     ISessionUtility,
+    is_retryable,
+    notify,
+    query_statistics,
+    QueryStatistics,
+    retry_transaction,
     serialized_call
 )
 
 from seantis.reservation import Session
-from seantis.reservation.models import Allocation
+from seantis.reservation import utils
+from seantis.reservation.db import Scheduler
+from seantis.reservation.models import Allocation, ReservedSlot
 from seantis.reservation.error import (
+    AlreadyReservedError,
     DirtyReadOnlySession,
     ModifiedReadOnlySession,
     TransactionRollbackError
@@ -35,6 +51,34 @@ class SessionIds(Thread):
         self.readonly_id = id(util.sessionstore.readonly)
 
 
+class SessionEngines(Thread):
+    def __init__(self):
+        Thread.__init__(self)
+        self.serial = None
+        self.readonly = None
+
+    def run(self):
+        util = getUtility(ISessionUtility)
+
+        self.serial = util.sessionstore.serial.registry().bind
+        self.readonly = util.sessionstore.readonly.registry().bind
+
+
+class CallThread(Thread):
+    def __init__(self, call):
+        Thread.__init__(self)
+        self.call = call
+        self.exception = None
+
+    def run(self):
+        try:
+            self.call()
+        except Exception, e:
+            self.exception = e
+        finally:
+            transaction.abort()
+
+
 class ExceptionThread(Thread):
     def __init__(self, call):
         Thread.__init__(self)
@@ -61,6 +105,58 @@ def add_something(resource=None):
     Session.add(allocation)
 
 
+class MockPostgresError(Exception):
+    def __init__(self, pgcode):
+        self.pgcode = pgcode
+
+
+def serialization_failure(pgcode='40001'):
+    return OperationalError('UPDATE', {}, MockPostgresError(pgcode))
+
+
+@contextmanager
+def retries(count):
+    """ Retries serialization failures the given number of times without
+    delay, aborting the transaction afterwards. """
+
+    with config_flag('serialization-retries', str(count)):
+        with config_flag('serialization-retry-delay', '0'):
+            try:
+                yield
+            finally:
+                transaction.abort()
+
+
+class FailingCommit(object):
+    """ A data manager failing the commit of its transaction with the
+    given errors, one per commit. """
+
+    def __init__(self, errors):
+        self.errors = errors
+
+    def abort(self, transaction):
+        pass
+
+    def tpc_begin(self, transaction):
+        pass
+
+    def commit(self, transaction):
+        pass
+
+    def tpc_vote(self, transaction):
+        if self.errors:
+            raise self.errors.pop(0)
+
+    def tpc_finish(self, transaction):
+        pass
+
+    def tpc_abort(self, transaction):
+        pass
+
+    def sortKey(self):
+        return 'seantis.reservation.tests.failing-commit'
+
+
 class TestSession(IntegrationTestCase):
 
     @mock.patch('seantis.reservation.utils.get_config')
@@ -200,3 +296,375 @@ class TestSession(IntegrationTestCase):
                 transaction.commit()
 
             serialized_call(drop)()
+
+    def test_is_retryable(self):
+        self.assertTrue(is_retryable(serialization_failure('40001')))
+        self.assertTrue(is_retryable(serialization_failure('40P01')))
+        self.assertFalse(is_retryable(serialization_failure('23505')))
+        self.assertFalse(is_retryable(ValueError()))
+
+    def test_backoff(self):
+        for attempt in range(1, 20):
+            delay = backoff(attempt, 0.05)
+            self.assertTrue(0 <= delay <= 0.05 * 2 ** min(attempt - 1, 6))
+
+    def test_retry(self):
+        with retries(2):
+            calls = []
+
+            def fail_twice():
+                calls.append(1)
+                add_something()
+
+                if len(calls) < 3:
+                    raise serialization_failure()
+
+            serialized_call(fail_twice)()
+            self.assertEqual(3, len(calls))
+
+            # retries are limited
+            def fail_always():
+                calls.append(1)
+                raise serialization_failure()
+
+            del calls[:]
+            self.assertRaises(OperationalError, serialized_call(fail_always))
+            self.assertEqual(3, len(calls))
+
+    def test_retry_events(self):
+        with retries(2):
+            calls = []
+
+            def fail_once():
+                calls.append(1)
+                notify(u'attempt %i' % len(calls))
+
+                # the events of failed nested calls are dropped
+                try:
+                    serialized_call(lambda: [
+                        notify(u'nested'), fail_always()
+                    ])()
+                except ValueError:
+                    pass
+
+                if len(calls) < 2:
+                    raise serialization_failure()
+
+            def fail_always():
+                raise ValueError
+
+            with mock.patch('seantis.reservation.session.notify_now') as n:
+                serialized_call(fail_once)()
+
+                # only the events of the successful attempt are notified
+                self.assertEqual(2, len(calls))
+                self.assertEqual(
+                    [mock.call(u'attempt 2')], n.call_args_list
+                )
+
+                # without a serialized call the events are notified at once
+                notify(u'now')
+                self.assertEqual(mock.call(u'now'), n.call_args)
+
+    def test_retry_commit(self):
+        with retries(2):
+            calls = []
+
+            # the serialization failure is raised by the commit, after the
+            # serialized call returned
+            errors = [serialization_failure()]
+
+            def reserve():
+                calls.append(1)
+                notify(u'attempt %i' % len(calls))
+                serialized_call(lambda: None)()
+                transaction.get().join(FailingCommit(errors))
+
+            with mock.patch('seantis.reservation.session.notify_now') as n:
+                retry_transaction(reserve)
+
+            self.assertEqual(2, len(calls))
+            self.assertEqual(
+                [mock.call(u'attempt 1'), mock.call(u'attempt 2')],
+                n.call_args_list
+            )
+
+            # retries are limited
+            del calls[:]
+            errors.extend(serialization_failure() for i in range(3))
+
+            self.assertRaises(
+                OperationalError, retry_transaction, reserve
+            )
+            self.assertEqual(3, len(calls))
+
+            # other errors are not retried
+            del calls[:]
+            errors.append(ValueError())
+
+            self.assertRaises(ValueError, retry_transaction, reserve)
+            self.assertEqual(1, len(calls))
+
+    def test_no_retry(self):
+        with retries(2):
+            calls = []
+
+            def fail(exception):
+                calls.append(1)
+                raise exception
+
+            # other errors are not retried
+            self.assertRaises(
+                ValueError, serialized_call(lambda: fail(ValueError()))
+            )
+            self.assertEqual(1, len(calls))
+
+            # nested calls are only retried by the top level call
+            del calls[:]
+            self.assertRaises(OperationalError, serialized_call(
+                serialized_call(lambda: fail(serialization_failure()))
+            ))
+            self.assertEqual(3, len(calls))
+
+            # calls after changes on the serial session are not retried
+            del calls[:]
+            serialized_call(add_something)()
+            self.assertRaises(OperationalError, serialized_call(
+                lambda: fail(serialization_failure())
+            ))
+            self.assertEqual(1, len(calls))
+
+    def test_shared_pool(self):
+        threads = [SessionEngines(), SessionEngines()]
+        for thread in threads:
+            thread.start()
+            thread.join()
+
+        self.assertNotEqual(threads[0].serial, threads[1].serial)
+
+        with config_flag('pool', 'shared'):
+            threads = [SessionEngines(), SessionEngines()]
+            for thread in threads:
+                thread.start()
+                thread.join()
+
+            self.assertEqual(threads[0].serial, threads[1].serial)
+            self.assertEqual(threads[0].readonly, threads[1].readonly)
+            self.assertNotEqual(threads[0].serial, threads[0].readonly)
+
+    def test_engine_registry(self):
+        with config_flag('pool-size', '2'):
+            dsn = getUtility(ISessionUtility).get_dsn(utils.getSite())
+
+            engines = EngineRegistry()
+            engine = engines.get(dsn, SERIALIZABLE)
+
+            self.assertIs(engine, engines.get(dsn, SERIALIZABLE))
+            self.assertEqual(2, engine.pool.size())
+
+            engine.connect().close()
+            engine.connect().close()
+
+            statistics = engines.statistics()[(dsn, SERIALIZABLE)]
+            self.assertEqual(2, statistics['checkouts'])
+            self.assertTrue(statistics['max_wait'] >= 0)
+
+            # idle engines are disposed (but kept in the registry)
+            self.assertEqual(1, engine.pool.checkedin())
+
+            last_checkout = engine.pool.statistics.last_checkout
+            self.assertEqual(0, engines.evict_idle(120, last_checkout + 30))
+            self.assertEqual(0, engines.evict_idle(120, last_checkout + 61))
+            self.assertEqual(1, engines.evict_idle(120, last_checkout + 180))
+
+            self.assertEqual(0, engine.pool.checkedin())
+            self.assertIs(engine, engines.get(dsn, SERIALIZABLE))
+
+            # the statistics survive the disposal
+            statistics = engines.statistics()[(dsn, SERIALIZABLE)]
+            self.assertEqual(2, statistics['checkouts'])
+
+            engine.dispose()
+
+    def test_replica_routing(self):
+        util = getUtility(ISessionUtility)
+
+        def route():
+            store = util.sessionstore
+            self.assertIsNotNone(store.replica)
+            self.assertIs(store.replica, util.session())
+
+            Session.query(Allocation).count()
+            self.assertIs(store.replica, util.session())
+
+            # after writing, the primary is used for the transaction
+            serialized_call(add_something)()
+
+            self.assertRaises(DirtyReadOnlySession, util.session)
+            self.assertIs(store.readonly, util.session())
+            self.assertIs(store.readonly, util.session())
+
+            transaction.abort()
+            self.assertIs(store.replica, util.session())
+
+        # the primary database doubles as replica, as long as the sessions
+        # are kept apart it doesn't matter which database is used (the
+        # thread has no site)
+        with config_flag('dsn-readonly', util.get_dsn(None)):
+            util._replica_dsn_cache.clear()
+
+            try:
+                thread = CallThread(route)
+                thread.start()
+                thread.join()
+
+                if thread.exception:
+                    raise thread.exception
+            finally:
+                util._replica_dsn_cache.clear()
+
+    def test_replica_lag(self):
+        dsn = getUtility(ISessionUtility).get_dsn(utils.getSite())
+        store = SessionStore(dsn, replica_dsn=dsn)
+
+        self.assertIs(store.replica, store.reader())
+
+        # the primary is no replica, so there's no lag, even within an
+        # open transaction of the replica session
+        store.replica.execute('SELECT 1')
+        self.assertEqual(0, store.replica_lag())
+
+        # the lag is checked on a connection of its own
+        self.assertIsInstance(store.lag_engine.pool, NullPool)
+        transaction.abort()
+        self.assertIs(store.replica, store.reader(30))
+
+        with mock.patch.object(SessionStore, 'replica_lag') as replica_lag:
+            store.last_lag_check = (0, None)
+            replica_lag.return_value = 60
+
+            self.assertIs(store.readonly, store.reader(30))
+            self.assertIs(store.replica, store.reader(90))
+            self.assertIs(store.replica, store.reader())
+
+            # the result is cached
+            replica_lag.return_value = 0
+            self.assertIs(store.readonly, store.reader(30))
+            self.assertEqual(1, replica_lag.call_count)
+
+            # unreachable replicas are not used
+            store.last_lag_check = (0, None)
+            replica_lag.return_value = None
+            self.assertIs(store.readonly, store.reader(30))
+
+    def test_advisory_lock_key(self):
+        resource = uuid()
+
+        self.assertEqual(
+            advisory_lock_key(resource), advisory_lock_key(resource.hex)
+        )
+        self.assertNotEqual(advisory_lock_key(resource), advisory_lock_key(
+            uuid()
+        ))
+
+        self.assertTrue(-2 ** 63 <= advisory_lock_key(resource) < 2 ** 63)
+
+    def test_advisory_lock_no_double_booking(self):
+        resource = uuid()
+        dates = (datetime(2013, 1, 1, 12), datetime(2013, 1, 1, 13))
+        tokens = []
+
+        def setup():
+            scheduler = Scheduler(resource, language='en')
+            scheduler.allocate(dates, approve_manually=True)
+
+            for i in range(4):
+                tokens.append(scheduler.reserve(u'test@example.com', dates))
+
+            transaction.commit()
+
+        serialized_call(setup)()
+
+        with config_flag('write-mode', 'advisory-locks'):
+            # the threads create new session stores, using the advisory locks
+            def approve(token):
+                util = getUtility(ISessionUtility)
+                self.assertEqual(
+                    'READ_COMMITTED',
+                    util.sessionstore.serial.registry().bind.dialect
+                    .isolation_level
+                )
+
+                # the approval waits for the lock held by the first thread
+                # until it committed, and then sees the reserved slot
+                Scheduler(resource, language='en').approve_reservation(token)
+
+            threads = [
+                ExceptionThread(lambda token=token: approve(token))
+                for token in tokens
+            ]
+
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+        exceptions = [t.exception for t in threads]
+        failures = [
+            e for e in exceptions if isinstance(e, AlreadyReservedError)
+        ]
+
+        self.assertEqual(1, exceptions.count(None))
+        self.assertEqual(3, len(failures))
+
+        slots = Session.query(ReservedSlot)
+        slots = slots.filter(ReservedSlot.resource == resource)
+        self.assertEqual(1, slots.count())
+
+    def test_query_statistics(self):
+        statistics = query_statistics()
+        statistics.reset()
+
+        Session.query(Allocation).count()
+        Session.query(Allocation).count()
+
+        self.assertEqual(2, statistics.count('readonly'))
+        self.assertEqual(0, statistics.count('serial'))
+        self.assertTrue(statistics.duration('readonly') > 0)
+
+        serialized_call(add_something)()
+
+        self.assertTrue(statistics.count('serial') > 0)
+        self.assertEqual(
+            statistics.count('readonly') + statistics.count('serial'),
+            statistics.count()
+        )
+
+        # the statistics are kept per thread
+        thread = CallThread(lambda: self.assertEqual(
+            0, query_statistics().count()
+        ))
+        thread.start()
+        thread.join()
+
+        self.assertIsNone(thread.exception)
+
+        with self.assert_query_budget(1, 'readonly'):
+            Session.query(Allocation).first()
+
+        with self.assertRaises(AssertionError):
+            with self.assert_query_budget(1):
+                Session.query(Allocation).first()
+                Session.query(Allocation).first()
+
+    def test_query_statistics_summary(self):
+        statistics = QueryStatistics()
+        statistics.add('readonly', 0.002)
+        statistics.add('readonly', 0.001)
+        statistics.add('serial', 0.0005)
+
+        self.assertEqual(
+            '3 queries in 3.5ms (readonly: 2 in 3.0ms, serial: 1 in 0.5ms)',
+            statistics.summary()
+        )
@@ -0,0 +1,94 @@
+import mock
+
+from datetime import date, datetime
+from uuid import UUID
+
+from plone.dexterity.utils import createContentInContainer
+from Products.CMFCore.utils import getToolByName
+
+from seantis.reservation import exposure
+from seantis.reservation import timeframe
+from seantis.reservation.tests import IntegrationTestCase
+
+
+class Frame(object):
+
+    def __init__(self, start, end, visible):
+        self.start = start
+        self.end = end
+        self._visible = visible
+
+    def visible(self):
+        return self._visible
+
+
+class Allocation(object):
+
+    def __init__(self, resource, start):
+        self.mirror_of = resource
+        self.start = start
+
+
+class TestTimeframe(IntegrationTestCase):
+
+    def test_timeframe_index(self):
+        self.assertTrue(timeframe.TimeframeIndex([]).is_exposed(date.today()))
+
+        index = timeframe.TimeframeIndex([
+            Frame(date(2013, 3, 1), date(2013, 3, 31), False),
+            Frame(date(2013, 1, 1), date(2013, 1, 31), True),
+        ])
+
+        self.assertEqual(2, len(index))
+        self.assertFalse(index.is_exposed(date(2012, 12, 31)))
+        self.assertTrue(index.is_exposed(date(2013, 1, 1)))
+        self.assertTrue(index.is_exposed(date(2013, 1, 31)))
+        self.assertFalse(index.is_exposed(date(2013, 2, 1)))
+        self.assertFalse(index.is_exposed(date(2013, 3, 15)))
+        self.assertFalse(index.is_exposed(date(2013, 4, 1)))
+
+    def test_timeframe_cache(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        self.assertEqual(0, len(timeframe.timeframe_index(resource)))
+
+        frame = createContentInContainer(
+            self.portal, 'seantis.reservation.timeframe',
+            title=u'January', start=date(2013, 1, 1), end=date(2013, 1, 31)
+        )
+
+        index = timeframe.timeframe_index(resource)
+        self.assertEqual(1, len(index))
+        self.assertIs(index, timeframe.timeframe_index(resource))
+
+        day = date(2013, 1, 2)
+        self.assertTrue(index.is_exposed(day))
+
+        # the resource's owner sees all allocations
+        allocation = Allocation(UUID(resource.uuid()), datetime(2013, 2, 1))
+        self.assertTrue(
+            exposure.for_allocations(resource, [resource])(allocation)
+        )
+
+        # transitions clear the cache
+        workflow = getToolByName(self.portal, 'portal_workflow')
+        workflow.doActionFor(frame, 'hide')
+
+        self.assertIsNot(index, timeframe.timeframe_index(resource))
+        self.assertFalse(timeframe.timeframe_index(resource).is_exposed(day))
+
+    def test_timeframe_cache_without_counter(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+
+        # without catalog counter changes of other processes go unnoticed,
+        # so the index is not cached
+        with mock.patch.object(timeframe, 'catalog_counter') as counter:
+            counter.return_value = None
+
+            self.assertIsNot(
+                timeframe.timeframe_index(resource),
+                timeframe.timeframe_index(resource)
+            )
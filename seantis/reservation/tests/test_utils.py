@@ -1,8 +1,13 @@
+import mock
+
 from datetime import date
 from datetime import datetime
 from datetime import time
 from datetime import timedelta
 
+from Products.CMFCore.utils import getToolByName
+from zope.annotation.interfaces import IAnnotations
+
 from seantis.reservation import utils
 from seantis.reservation.tests import IntegrationTestCase
 
@@ -15,6 +20,36 @@ class UtilsTestCase(IntegrationTestCase):
 
         self.assertEqual(utils.pairs(one), utils.pairs(two))
 
+    def test_find_overlaps(self):
+        dates = [
+            (datetime(2013, 1, 3, 12, 0), datetime(2013, 1, 3, 13, 0)),
+            (datetime(2013, 1, 1, 12, 0), datetime(2013, 1, 1, 13, 0)),
+            (datetime(2013, 1, 2, 12, 0), datetime(2013, 1, 2, 13, 0)),
+        ]
+        self.assertEqual(utils.find_overlaps(dates), [])
+
+        # touching dates are considered overlapping, like in utils.overlaps
+        dates.append(
+            (datetime(2013, 1, 1, 13, 0), datetime(2013, 1, 1, 14, 0))
+        )
+        dates.append(
+            (datetime(2013, 1, 3, 8, 0), datetime(2013, 1, 3, 18, 0))
+        )
+
+        self.assertEqual(utils.find_overlaps(dates), [
+            (
+                (datetime(2013, 1, 1, 12, 0), datetime(2013, 1, 1, 13, 0)),
+                (datetime(2013, 1, 1, 13, 0), datetime(2013, 1, 1, 14, 0))
+            ),
+            (
+                (datetime(2013, 1, 3, 8, 0), datetime(2013, 1, 3, 18, 0)),
+                (datetime(2013, 1, 3, 12, 0), datetime(2013, 1, 3, 13, 0))
+            )
+        ])
+
+        for first, second in utils.find_overlaps(dates):
+            self.assertTrue(utils.overlaps(*(first + second)))
+
     def test_decoded_for_displays(self):
         self.assertEqual(
             utils.decode_for_display(datetime(year=2012, month=1, day=12)),
@@ -282,3 +317,59 @@ class UtilsTestCase(IntegrationTestCase):
             datetime(2013, 7, 1, 1, 0),
             datetime(2013, 7, 1, 23, 59, 59, 999999)
         ), utils.get_date_range(datetime(2013, 7, 1), time(1, 0), time(0, 0)))
+
+    def test_lru_cache(self):
+        cache = utils.LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+
+        self.assertEqual(1, cache.get('a'))
+
+        cache['c'] = 3
+
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+    def test_get_resource_by_uuid(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        uuid = utils.string_uuid(resource)
+
+        brain = utils.get_resource_by_uuid(uuid)
+        self.assertEqual(resource.absolute_url(), brain.getURL())
+
+        # the brain is kept for the rest of the request
+        self.assertIs(brain, utils.get_resource_by_uuid(uuid))
+
+        # the path is kept for other requests, which do not use the catalog
+        IAnnotations(self.request()).pop(utils.RESOURCE_MEMO_KEY)
+
+        key = (self.portal.getPhysicalPath(), resource.portal_type, uuid)
+
+        catalog = getToolByName(self.portal, 'portal_catalog')
+        with mock.patch.object(catalog.__class__, '__call__') as search:
+            cached = utils.get_resource_by_uuid(uuid)
+            self.assertFalse(search.called)
+
+        self.assertEqual(brain.getPath(), cached.getPath())
+        self.assertEqual(brain.getURL(), cached.getURL())
+        self.assertEqual(resource, cached.getObject())
+
+        # the view permission is checked on the object
+        resource.manage_permission('View', roles=[], acquire=False)
+        self.assertIsNone(utils._cached_resource(self.portal, key))
+
+        resource.manage_permission('View', roles=[], acquire=True)
+        self.assertIsNotNone(utils._cached_resource(self.portal, key))
+
+        # removing the resource clears the cache
+        self.portal.manage_delObjects([resource.id])
+
+        self.assertEqual(0, len(utils.resource_cache))
+        self.assertIsNone(utils.get_resource_by_uuid(uuid))
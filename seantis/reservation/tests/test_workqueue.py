@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+import mock
+import time
+
+from datetime import datetime, timedelta
+from threading import Event, Thread
+from uuid import uuid1 as new_uuid
+
+import transaction
+
+from seantis.reservation import db
+from seantis.reservation import workqueue
+from seantis.reservation.error import AlreadyReservedError
+from seantis.reservation.error import CustomReservationError
+from seantis.reservation.error import ReservationOutOfBounds
+from seantis.reservation.error import ReservationQueueError
+from seantis.reservation.error import ReservationTooLong
+from seantis.reservation.models import Reservation
+from seantis.reservation.tests import IntegrationTestCase, config_flag
+
+
+class QueueWorker(Thread):
+    """ Processes the queue until stopped, like the clockserver does. """
+
+    def __init__(self):
+        Thread.__init__(self)
+        self.stopped = Event()
+        self.processed = 0
+        self.exception = None
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                processed = workqueue.process_queue()
+                transaction.commit()
+
+                self.processed += processed
+
+                if not processed:
+                    self.stopped.wait(0.05)
+        except Exception, e:
+            self.exception = e
+        finally:
+            transaction.abort()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class TestWorkQueue(IntegrationTestCase):
+
+    def test_queue_enabled(self):
+        self.assertFalse(workqueue.queue_enabled())
+
+        with config_flag('reservation-queue', 'on'):
+            self.assertTrue(workqueue.queue_enabled())
+
+    def test_encode_dates(self):
+        dates = [
+            (datetime(2014, 1, 1, 10), datetime(2014, 1, 1, 12)),
+            (datetime(2014, 1, 2, 10), datetime(2014, 1, 2, 11, 59, 59, 9999))
+        ]
+
+        encoded = workqueue.encode_dates(dates)
+        self.assertEqual('2014-01-01T10:00:00', encoded[0][0])
+        self.assertEqual(dates, workqueue.decode_dates(encoded))
+
+    def test_raise_failure(self):
+        def failure(error, message=None):
+            return type('Status', (object, ), dict(
+                status=u'failed', error=error, message=message
+            ))
+
+        self.assertRaises(
+            AlreadyReservedError, workqueue.raise_failure,
+            failure('AlreadyReservedError')
+        )
+        self.assertRaises(
+            ReservationQueueError, workqueue.raise_failure,
+            failure('KeyError', u'oops')
+        )
+
+        # the errors are created with their message
+        with self.assertRaises(ReservationTooLong) as context:
+            workqueue.raise_failure(failure('ReservationTooLong', u'long'))
+
+        self.assertEqual(u'long', unicode(context.exception))
+
+        with self.assertRaises(CustomReservationError) as context:
+            workqueue.raise_failure(failure('CustomReservationError', u'x'))
+
+        self.assertEqual(u'x', context.exception.msg)
+
+        # errors which need more than a message are not recreated
+        self.assertRaises(
+            ReservationQueueError, workqueue.raise_failure,
+            failure('OverlappingAllocationError', u'')
+        )
+
+    def test_enqueue_again(self):
+        sc = db.Scheduler(new_uuid(), language='en')
+        dates = (datetime(2014, 1, 1, 10), datetime(2014, 1, 1, 12))
+        session_id = new_uuid()
+
+        # the same reservation of a session is queued once
+        first = workqueue.enqueue_reservation(
+            sc, u'test@example.com', dates, session_id=session_id
+        )
+        second = workqueue.enqueue_reservation(
+            sc, u'test@example.com', dates, session_id=session_id
+        )
+        self.assertEqual(first, second)
+
+        # reservations of other sessions or without session are not
+        other = workqueue.enqueue_reservation(
+            sc, u'test@example.com', dates, session_id=new_uuid()
+        )
+        anonymous = [
+            workqueue.enqueue_reservation(sc, u'test@example.com', dates)
+            for i in range(2)
+        ]
+
+        self.assertEqual(4, len(set([first, other] + anonymous)))
+
+    def test_timeout(self):
+        self.assertEqual(workqueue.DEFAULT_TIMEOUT, workqueue.get_timeout())
+
+        with config_flag('reservation-queue-timeout', '1'):
+            self.assertEqual(1, workqueue.get_timeout())
+
+        # the requests don't wait longer than the maximum
+        with config_flag('reservation-queue-timeout', '600'):
+            self.assertEqual(workqueue.MAX_TIMEOUT, workqueue.get_timeout())
+
+    def test_error_message(self):
+        self.assertEqual(u'', workqueue.error_message(AlreadyReservedError()))
+        self.assertEqual(
+            u'x', workqueue.error_message(CustomReservationError(u'x'))
+        )
+        self.assertEqual(
+            u'Zürich', workqueue.error_message(ValueError('Zürich'))
+        )
+        self.assertEqual(
+            u"(1, 2)", workqueue.error_message(ValueError(1, 2))
+        )
+
+    def test_process_queue_failure(self):
+        sc = db.Scheduler(new_uuid(), language='en')
+        ticket = workqueue.enqueue_reservation(
+            sc, u'test@example.com',
+            (datetime(2014, 1, 1, 10), datetime(2014, 1, 1, 12))
+        )
+
+        # messages with non-ascii bytes don't stop the worker
+        failure = CustomReservationError('Raum Zürich ist belegt')
+
+        with mock.patch.object(
+            workqueue, 'make_reservation', side_effect=failure
+        ):
+            self.assertEqual(1, workqueue.process_queue())
+
+        transaction.commit()
+
+        status = workqueue.queue_status(ticket)
+        self.assertEqual(u'failed', status.status)
+        self.assertEqual(u'Raum Zürich ist belegt', status.message)
+
+    def test_max_waiting(self):
+        self.assertTrue(workqueue.get_max_waiting() >= 1)
+
+        with config_flag('reservation-queue-max-waiting', '0'):
+            self.assertEqual(0, workqueue.get_max_waiting())
+
+            sc = db.Scheduler(new_uuid(), language='en')
+            ticket = workqueue.enqueue_reservation(
+                sc, u'test@example.com',
+                (datetime(2014, 1, 1, 10), datetime(2014, 1, 1, 12))
+            )
+
+            # no request may wait, the status is returned right away
+            started = time.time()
+            status = workqueue.wait_for_reservation(ticket, timeout=10)
+
+            self.assertEqual(u'queued', status.status)
+            self.assertTrue(time.time() - started < 5)
+
+    def test_worker_thread(self):
+        sc = db.Scheduler(new_uuid(), language='en')
+
+        start = datetime(2014, 1, 1, 10, 0)
+        end = datetime(2014, 1, 1, 12, 0)
+
+        sc.allocate((start, end), quota=2)
+        transaction.commit()
+
+        tickets = [
+            workqueue.enqueue_reservation(
+                sc, u'test@example.com', (start, end),
+                data={u'form': {u'values': []}}, session_id=new_uuid()
+            ) for i in range(3)
+        ]
+
+        tickets.append(workqueue.enqueue_reservation(
+            sc, u'test@example.com', (end, end + timedelta(hours=1))
+        ))
+
+        # nothing happens without the worker
+        self.assertEqual(
+            u'queued',
+            workqueue.wait_for_reservation(tickets[0], timeout=0).status
+        )
+
+        worker = QueueWorker()
+        worker.start()
+
+        try:
+            statuses = [
+                workqueue.wait_for_reservation(ticket, timeout=10)
+                for ticket in tickets
+            ]
+        finally:
+            worker.stop()
+
+        self.assertIsNone(worker.exception)
+        self.assertEqual(4, worker.processed)
+
+        self.assertEqual(
+            [u'done', u'done', u'done', u'failed'],
+            [status.status for status in statuses]
+        )
+
+        self.assertRaises(
+            ReservationOutOfBounds, workqueue.raise_failure, statuses[3]
+        )
+
+        tokens = [status.reservation_token for status in statuses[:3]]
+        reservations = sc.managed_reservations().filter(
+            Reservation.token.in_(tokens)
+        )
+
+        self.assertEqual(3, reservations.count())
+        self.assertEqual(
+            [u'pending'] * 3, [r.status for r in reservations]
+        )
+
+    def test_process_queue_sequentially(self):
+        sc = db.Scheduler(new_uuid(), language='en')
+
+        start = datetime(2014, 1, 1, 10, 0)
+        end = datetime(2014, 1, 1, 12, 0)
+
+        sc.allocate((start, end), quota=1)
+        transaction.commit()
+
+        tickets = [
+            workqueue.enqueue_reservation(
+                sc, u'test@example.com', (start, end), approve=True
+            ) for i in range(2)
+        ]
+
+        # the batches are limited
+        self.assertEqual(1, workqueue.process_queue(batch_size=1))
+        self.assertEqual(1, workqueue.process_queue())
+        self.assertEqual(0, workqueue.process_queue())
+
+        transaction.commit()
+
+        first, second = [workqueue.queue_status(t) for t in tickets]
+
+        self.assertEqual(u'done', first.status)
+        self.assertEqual(
+            u'approved',
+            sc.reservation_by_token(first.reservation_token).one().status
+        )
+
+        # the second reservation comes too late
+        self.assertEqual(u'failed', second.status)
+        self.assertRaises(
+            AlreadyReservedError, workqueue.raise_failure, second
+        )
+
+        # processed reservations are removed after a while
+        self.assertEqual(0, workqueue.remove_processed())
+        self.assertEqual(2, workqueue.remove_processed(timedelta(0)))
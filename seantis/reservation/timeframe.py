@@ -1,16 +1,23 @@
+from operator import itemgetter
+
 from five import grok
 from plone.directives import dexterity
 from plone.dexterity.content import Item
 from plone.memoize import view
 from Products.CMFCore.utils import getToolByName
+from Products.CMFCore.interfaces import IActionSucceededEvent
 from Products.CMFCore.interfaces import IFolderish
 from z3c.form import button
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
 
 from seantis.reservation import _
 from seantis.reservation.interfaces import ITimeframe, OverviewletManager
+from seantis.reservation.sortedcollection import SortedCollection
 from seantis.reservation import utils
 
-# TODO cache all timeframe stuff for an hour or so.. no frequent updates needed
+# the timeframe indexes of the resources, keyed by the path of the resource
+timeframe_cache = utils.LRUCache(1000)
 
 
 class Timeframe(Item):
@@ -53,6 +60,94 @@ def timeframes_by_context(context):
     )
 
 
+class TimeframeIndex(object):
+    """The timeframes applying to a resource, sorted by start and stored
+    together with their visibility.
+
+    The timeframes of a folder do not overlap (see validate_timeframe), so
+    the timeframe containing a day is found through bisection.
+
+    """
+
+    def __init__(self, frames):
+        self.frames = SortedCollection(
+            ((f.start, f.end, f.visible()) for f in frames),
+            key=itemgetter(0)
+        )
+
+    def __len__(self):
+        return len(self.frames)
+
+    def is_exposed(self, day):
+        """Returns True if the allocations starting on the given day may be
+        shown, which is the case if there are no timeframes at all or if
+        the day lies within a visible timeframe.
+
+        """
+        if not self.frames:
+            return True
+
+        try:
+            start, end, visible = self.frames.find_le(day)
+        except ValueError:
+            return False
+
+        return day <= end and visible
+
+
+def catalog_counter():
+    """Returns the counter of the catalog, which is increased with each
+    change of the catalog, or None if the catalog does not count.
+
+    """
+    catalog = getToolByName(utils.getSite(), 'portal_catalog')
+    counter = getattr(catalog, 'getCounter', None)
+
+    return counter() if counter is not None else None
+
+
+def timeframe_index(context):
+    """Returns the TimeframeIndex of the given resource (object or brain).
+
+    The index is cached until a timeframe is added, changed or removed.
+    Changes made by other processes are noticed through the catalog counter.
+    Without catalog counter (older catalogs) the index is not cached, as
+    those changes would go unnoticed.
+
+    """
+    counter = catalog_counter()
+
+    if counter is None:
+        return TimeframeIndex(timeframes_by_context(context))
+
+    key = tuple(utils.context_path(context))
+    cached = timeframe_cache.get(key)
+
+    if cached is not None and cached[0] == counter:
+        return cached[1]
+
+    index = TimeframeIndex(timeframes_by_context(context))
+    timeframe_cache[key] = (counter, index)
+
+    return index
+
+
+# covers added and removed timeframes as well
+@grok.subscribe(ITimeframe, IObjectMovedEvent)
+def on_moved_timeframe(timeframe, event):
+    timeframe_cache.clear()
+
+
+@grok.subscribe(ITimeframe, IObjectModifiedEvent)
+def on_modified_timeframe(timeframe, event):
+    timeframe_cache.clear()
+
+
+@grok.subscribe(ITimeframe, IActionSucceededEvent)
+def on_timeframe_transition(timeframe, event):
+    timeframe_cache.clear()
+
+
 def overlapping_timeframe(context, start, end):
     if context.portal_type == 'seantis.reservation.timeframe':
         folder = context.aq_inner.aq_parent
@@ -24,8 +24,12 @@ from zope.component import getUtility
 from zope.component.hooks import getSite
 
 from seantis.reservation import Session
+from seantis.reservation import postgres
 from seantis.reservation import utils
+from seantis.reservation.models import QueuedReservation
 from seantis.reservation.models import Reservation, ReservedSlot
+from seantis.reservation.models import ResourceVersion
+from seantis.reservation.models import CachedEvents
 from seantis.reservation.models import customtypes
 from seantis.reservation.session import (
     ISessionUtility,
@@ -553,3 +557,59 @@ def upgrade_1105_to_1106(context):
     js_id = '++resource++seantis.reservation.js/jquery.timetable.js'
     js_registry.unregisterResource(js_id)
     js_registry.cookResources()
+
+
+@db_upgrade
+def upgrade_1106_to_1107(operations, metadata):
+    connection = operations.get_bind()
+
+    if postgres.range_indexes_enabled(connection.dialect):
+        postgres.create_range_indexes(connection)
+    else:
+        log.info('Range indexes are not enabled, skipping their creation')
+
+
+@db_upgrade
+def upgrade_1107_to_1108(operations, metadata):
+    connection = operations.get_bind()
+
+    if postgres.exclusion_constraints_enabled(connection.dialect):
+        postgres.create_exclusion_constraints(connection)
+    else:
+        log.info(
+            'Exclusion constraints are not enabled, skipping their creation'
+        )
+
+
+@db_upgrade
+def upgrade_1108_to_1109(operations, metadata):
+    QueuedReservation.__table__.create(
+        bind=operations.get_bind(), checkfirst=True
+    )
+
+
+@db_upgrade
+def upgrade_1109_to_1110(operations, metadata):
+    ResourceVersion.__table__.create(
+        bind=operations.get_bind(), checkfirst=True
+    )
+
+
+@db_upgrade
+def upgrade_1110_to_1111(operations, metadata):
+    CachedEvents.__table__.create(
+        bind=operations.get_bind(), checkfirst=True
+    )
+
+
+@db_upgrade
+def upgrade_1111_to_1112(operations, metadata):
+
+    queue_table = Table('reservation_queue', metadata, autoload=True)
+    if 'key' not in queue_table.columns:
+        operations.add_column(
+            'reservation_queue', Column('key', types.String(40))
+        )
+        operations.create_index(
+            'reservation_queue_key_ix', 'reservation_queue', ['key']
+        )
@@ -7,6 +7,7 @@ import functools
 import isodate
 import base64
 import sys
+import threading
 
 from datetime import datetime, timedelta, date, time as datetime_time
 from urlparse import urljoin
@@ -21,12 +22,15 @@ import pytz
 
 from plone.dexterity.utils import SchemaNameEncoder
 
+from AccessControl import getSecurityManager
 from Acquisition import aq_inner
 from App.config import getConfiguration
 from zope.component import getMultiAdapter
 from zope.component.hooks import getSite
 from zope import i18n
 from zope import interface
+from zope.annotation.interfaces import IAnnotations
+from Products.CMFCore.permissions import View
 from Products.CMFCore.utils import getToolByName
 from Products.CMFPlone.i18nl10n import weekdayname_msgid_abbr, monthname_msgid
 from z3c.form.interfaces import ActionExecutionError
@@ -224,6 +228,29 @@ def count_overlaps(dates, start, end):
     return count
 
 
+def find_overlaps(dates):
+    """ Returns the overlapping pairs found in the given list of start / end
+    tuples, using the same definition of overlapping as 'overlaps'.
+
+    Instead of comparing each date with every other date (like calling
+    count_overlaps for each date would), the dates are sorted and swept
+    through once. Every date overlapping one of the dates before it is
+    reported together with the earlier date ending last.
+
+    """
+    conflicts = []
+    latest = None
+
+    for start, end in sorted(dates):
+        if latest and start <= latest[1]:
+            conflicts.append((latest, (start, end)))
+
+        if not latest or end > latest[1]:
+            latest = (start, end)
+
+    return conflicts
+
+
 def overlaps(start, end, otherstart, otherend):
     if otherstart <= start and start <= otherend:
         return True
@@ -275,6 +302,43 @@ class memoize(object):
         return functools.partial(self.__call__, obj)
 
 
+class LRUCache(object):
+    """A dictionary holding up to the given number of items. If full, the
+    least recently used item is dropped. Safe to use by multiple threads.
+
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                return default
+
+            self.items[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def __len__(self):
+        return len(self.items)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
 @memoize
 def _exposure():
     # keep direct imports out of utils as it will lead to circular imports
@@ -536,28 +600,135 @@ def uuid_query(uuid):
         uuid[:8], uuid[8:12], uuid[12:16], uuid[16:20], uuid[20:]]))
 
 
-@memoize
+# the paths of the resources found by get_resource_by_uuid, kept for the
+# whole process, keyed by site, portal type and uuid
+resource_cache = LRUCache(1000)
+
+# the request annotation with the brains found by get_resource_by_uuid
+RESOURCE_MEMO_KEY = 'seantis.reservation.resources'
+
+# whether the resources are translatable, keyed by site
+_resource_translations = {}
+
+
 def has_resource_translations_enabled():
     """Return whether plone.multilingual behavior is enabled for
-    seantis.reservation.resource.
+    seantis.reservation.resource. The result is cached per site.
 
     """
 
-    ttool = getToolByName(getSite(), 'portal_types')
-    fti = ttool.getTypeInfo('seantis.reservation.resource')
-    iface_name = 'plone.multilingualbehavior.interfaces.IDexterityTranslatable'
-    return iface_name in fti.behaviors
+    site = getSite()
+    key = site.getPhysicalPath()
 
+    if key not in _resource_translations:
+        ttool = getToolByName(site, 'portal_types')
+        fti = ttool.getTypeInfo('seantis.reservation.resource')
+        iface_name = (
+            'plone.multilingualbehavior.interfaces.IDexterityTranslatable'
+        )
+        _resource_translations[key] = iface_name in fti.behaviors
 
-def get_resource_by_uuid(
-    uuid, ensure_portal_type='seantis.reservation.resource'
-):
-    """Returns the zodb object with the given uuid."""
+    return _resource_translations[key]
 
-    catalog = getToolByName(getSite(), 'portal_catalog')
+
+def invalidate_resource_cache(request=None):
+    """Clears the resources cached by get_resource_by_uuid for the process
+    and the given request. Called whenever a resource is added, moved or
+    removed.
+
+    """
+    resource_cache.clear()
+
+    if request is not None:
+        IAnnotations(request, {}).pop(RESOURCE_MEMO_KEY, None)
+
+
+def _resource_memo(site):
+    """Returns the brains found by get_resource_by_uuid in the current
+    request, or None if there is no request."""
+
+    request = getattr(site, 'REQUEST', None)
+
+    if request is None:
+        return None
+
+    annotations = IAnnotations(request, None)
+
+    if annotations is None:
+        return None
+
+    return annotations.setdefault(RESOURCE_MEMO_KEY, {})
+
+
+class CachedResourceBrain(object):
+    """Stands in for the catalog brain of a resource found through the
+    resource_cache, offering the parts of the brain used with resources.
+
+    """
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.UID = IUUID(obj)
+        self.portal_type = obj.portal_type
+
+    def getObject(self):
+        return self.obj
+
+    def getPath(self):
+        return '/'.join(self.obj.getPhysicalPath())
+
+    def getURL(self):
+        return self.obj.absolute_url()
+
+
+def _cached_resource(site, key):
+    """Returns the resource whose path is cached under the given key, or None
+    if it is not cached, not found at the path anymore or not viewable by the
+    current user. The catalog is not searched.
+
+    """
+    path = resource_cache.get(key)
+
+    if path is None:
+        return None
+
+    obj = site.unrestrictedTraverse(path, None)
+
+    if obj is None:
+        return None
+
+    portal_type, uuid = key[1:]
+
+    uid = IUUID(obj, None)
+
+    if uid is None or string_uuid(uid) != uuid:
+        return None
+
+    if portal_type and obj.portal_type != portal_type:
+        return None
+
+    if not getSecurityManager().checkPermission(View, obj):
+        return None
+
+    return CachedResourceBrain(obj)
+
+
+def _find_resource(site, uuid, ensure_portal_type):
+    catalog = getToolByName(site, 'portal_catalog')
     kwargs = {}
 
-    if HAS_MULTILINGUAL and has_resource_translations_enabled():
+    # with translations enabled the process cache is not used, as a
+    # translation added by another process would go unnoticed
+    translations = HAS_MULTILINGUAL and has_resource_translations_enabled()
+    key = (site.getPhysicalPath(), ensure_portal_type, uuid)
+
+    if not translations:
+        brain = _cached_resource(site, key)
+
+        if brain is not None:
+            return brain
+
+    if translations:
         kwargs['TranslationGroup'] = uuid_query(uuid)
     else:
         kwargs['UID'] = uuid_query(uuid)
@@ -567,7 +738,42 @@ def get_resource_by_uuid(
 
     results = catalog(**kwargs)
 
-    return results[0] if len(results) == 1 else None
+    if len(results) != 1:
+        return None
+
+    if not translations:
+        resource_cache[key] = results[0].getPath()
+
+    return results[0]
+
+
+def get_resource_by_uuid(
+    uuid, ensure_portal_type='seantis.reservation.resource'
+):
+    """Returns the catalog brain of the zodb object with the given uuid.
+
+    The brains are kept for the rest of the request. The paths are
+    additionally kept for the whole process (see resource_cache), so later
+    requests traverse to the resource and check the View permission on it,
+    instead of searching the catalog. Those requests get a
+    CachedResourceBrain instead of a catalog brain.
+
+    """
+
+    site = getSite()
+    uuid = string_uuid(uuid)
+
+    memo = _resource_memo(site)
+
+    if memo is None:
+        return _find_resource(site, uuid, ensure_portal_type)
+
+    key = (getSecurityManager().getUser().getId(), ensure_portal_type, uuid)
+
+    if key not in memo:
+        memo[key] = _find_resource(site, uuid, ensure_portal_type)
+
+    return memo[key]
 
 
 def get_resource_title(resource):
@@ -714,15 +920,20 @@ def allocation_class(allocation):
         return 'approve-automatically'
 
 
-def event_availability(context, request, scheduler, allocation):
+def event_availability(context, request, scheduler, allocation,
+                       availability=None, waitinglist_length=None):
     """Returns the availability, the text with the availability and the class
     for the availability to display on the calendar view.
 
+    The availability and the waitinglist length are looked up unless they
+    are passed.
+
     """
     a = allocation
     translate = translator(context, request)
 
-    availability = scheduler.availability(a.start, a.end)
+    if availability is None:
+        availability = scheduler.availability(a.start, a.end)
     spots = int(round(allocation.quota * availability / 100))
 
     # get the title shown on the calendar block
@@ -740,7 +951,10 @@ def event_availability(context, request, scheduler, allocation):
 
     # with approval the number of people in the waitinglist have to be shown
     if allocation.approve_manually:
-        length = allocation.waitinglist_length
+        if waitinglist_length is None:
+            length = allocation.waitinglist_length
+        else:
+            length = waitinglist_length
         if length == 0:
             text += '\n' + translate(_(u'Waitinglist is Free'))
         elif length == 1:
@@ -805,6 +1019,15 @@ def get_config(key):
     return configuration.get(key)
 
 
+def get_config_flag(key):
+    """ Returns True if the given configuration key is set to on, true, yes
+    or 1. Missing keys are off.
+
+    """
+    flag = (get_config(key) or '').strip().lower()
+    return flag in ('on', 'true', 'yes', '1')
+
+
 # obsolete in python 2.7
 def total_timedelta_seconds(td):
     return (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10 ** 6) / \
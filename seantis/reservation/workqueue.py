@@ -0,0 +1,403 @@
+""" The work queue runs the reservations of popular resources one after the
+other, instead of letting them compete for the same allocations.
+
+When the registration for a popular course opens, many requests try to
+reserve the same allocations at once. Each of them runs in its own
+serializable transaction and most of them are aborted by postgres, since
+they all read and write the same records.
+
+In queued mode the requests only append their reservation to the
+reservation_queue table, in a short transaction of their own, and wait for
+it to be made. A single worker takes the queued reservations in batches
+and runs them through the scheduler one by one, so they do not conflict.
+
+The queued mode is off by default and may be enabled in the
+product-config:
+
+    <product-config seantis.reservation>
+        reservation-queue on
+        reservation-queue-timeout 3
+        reservation-queue-max-waiting 3
+        reservation-queue-user queueworker
+        reservation-queue-password secret
+    </product-config>
+
+The worker is the process-reservation-queue view (see maintenance.py),
+which is called every second by a clockserver once a resource was viewed.
+The view requires the manager permission, so the clockserver logs in with
+the given user, which must be a manager of the site (or of the zope root).
+Only one worker runs at a time per database, which is ensured by an
+advisory lock.
+
+Requests waiting for more than reservation-queue-timeout seconds (at most
+MAX_TIMEOUT) give up waiting and tell the user that the reservation is
+being processed, their reservation stays queued. Since the reservations
+are made with the session id of the user they show up in the user's
+reservations once the worker made them.
+
+The clockserver needs a zope thread to run the worker, just like the
+waiting requests and all other requests. So only
+reservation-queue-max-waiting requests wait at once per process (half the
+number of zope threads by default), the others return right after queueing
+their reservation.
+
+Queueing is not part of the zope transaction. If a request is run again
+(i.e. after a ConflictError), the reservation queued by the first run is
+used instead of queueing the same reservation again (see queue_key).
+
+"""
+
+import json
+import time
+import threading
+
+from logging import getLogger
+log = getLogger('seantis.reservation')
+
+from datetime import timedelta
+from hashlib import sha1
+from uuid import uuid4 as new_uuid
+
+import isodate
+
+from App.config import getConfiguration
+from sqlalchemy import func, select
+
+from seantis.reservation import db
+from seantis.reservation import error
+from seantis.reservation import utils
+from seantis.reservation import Session
+from seantis.reservation.models import QueuedReservation
+from seantis.reservation.session import get_independent_engine
+from seantis.reservation.session import is_retryable
+from seantis.reservation.session import serialized
+from seantis.reservation.session import serialized_call
+
+# the key of the advisory lock held by the worker
+QUEUE_LOCK_KEY = 0x7365616e74697300
+
+# the number of queued reservations processed in one transaction
+BATCH_SIZE = 50
+
+# the time in seconds between two lookups of a waiting request
+POLL_INTERVAL = 0.1
+
+# the default and the maximum time in seconds a request waits for its
+# queued reservation
+DEFAULT_TIMEOUT = 3
+MAX_TIMEOUT = 10
+
+# the time for which processed reservations are kept in the queue
+RETENTION = timedelta(days=1)
+
+# the time in which the same reservation of a session is only queued once
+KEY_WINDOW = timedelta(minutes=5)
+
+# limits the number of requests waiting at once, see waiting_requests
+_waiting = {}
+_waiting_lock = threading.Lock()
+
+
+def queue_enabled():
+    """ Returns True if the reservations are made through the queue (see
+    module docstring). """
+    return utils.get_config_flag('reservation-queue')
+
+
+def get_timeout():
+    """ Returns the number of seconds a request waits for its queued
+    reservation. """
+    timeout = utils.get_config('reservation-queue-timeout')
+    return min(float(timeout or DEFAULT_TIMEOUT), MAX_TIMEOUT)
+
+
+def get_max_waiting():
+    """ Returns the number of requests which may wait for their queued
+    reservation at once, half the number of zope threads unless configured
+    otherwise. """
+
+    max_waiting = utils.get_config('reservation-queue-max-waiting')
+
+    if max_waiting is None:
+        threads = getattr(getConfiguration(), 'zserver_threads', None) or 4
+        return max(threads // 2, 1)
+
+    return max(int(max_waiting), 0)
+
+
+def waiting_requests():
+    """ Returns the semaphore held by the requests waiting for their
+    queued reservation. """
+
+    max_waiting = get_max_waiting()
+
+    if max_waiting not in _waiting:
+        with _waiting_lock:
+            if max_waiting not in _waiting:
+                _waiting[max_waiting] = threading.BoundedSemaphore(
+                    max_waiting
+                )
+
+    return _waiting[max_waiting]
+
+
+def get_engine(dsn=None):
+    """ Returns the engine used to queue and poll reservations on the given
+    dsn (the one of the current site by default).
+
+    The engine has its own pool, so its connections are never shared with
+    the sessions and its transactions are independent of the zope
+    transaction.
+
+    """
+    return get_independent_engine(dsn)
+
+
+def encode_dates(dates):
+    return [
+        [start.isoformat(), end.isoformat()]
+        for start, end in utils.pairs(dates)
+    ]
+
+
+def decode_dates(dates):
+    return [
+        (isodate.parse_datetime(start), isodate.parse_datetime(end))
+        for start, end in dates
+    ]
+
+
+def queue_key(resource, arguments, approve):
+    """ Returns the key of a reservation queued by a session. The same
+    reservation queued by the same session within KEY_WINDOW is only
+    queued once.
+
+    """
+    return sha1(json.dumps(
+        [utils.string_uuid(resource), arguments, approve], sort_keys=True
+    )).hexdigest()
+
+
+def enqueue_reservation(scheduler, email, dates=None, group=None, data=None,
+                        session_id=None, quota=1, rrule=None,
+                        description=None, approve=False):
+    """ Queues a reservation with the same arguments as Scheduler.reserve,
+    to be made (and approved if requested) by the worker. Returns the ticket
+    of the queued reservation.
+
+    The reservation is queued immediately, regardless of the outcome of the
+    current transaction. Reservations with a session id which are queued
+    again (i.e. because the request was run again), return the ticket of the
+    reservation queued first.
+
+    """
+    assert (dates or group) and not (dates and group)
+
+    arguments = dict(
+        email=email,
+        dates=dates and encode_dates(dates) or None,
+        group=group and utils.string_uuid(group) or None,
+        data=data,
+        session_id=session_id and utils.string_uuid(session_id) or None,
+        quota=quota,
+        rrule=rrule,
+        description=description
+    )
+
+    table = QueuedReservation.__table__
+    key = session_id and queue_key(scheduler.uuid, arguments, approve)
+
+    with get_engine().begin() as connection:
+
+        if key:
+            # the lock keeps concurrent runs from queueing the same key
+            connection.execute(select([
+                func.pg_advisory_xact_lock(int(key[:16], 16) - 2 ** 63)
+            ]))
+
+            query = select([table.c.ticket])
+            query = query.where(table.c.key == key)
+            query = query.where(
+                table.c.created > utils.utcnow() - KEY_WINDOW
+            )
+
+            ticket = connection.execute(query.limit(1)).scalar()
+
+            if ticket:
+                return ticket
+
+        ticket = new_uuid()
+
+        connection.execute(table.insert().values(
+            ticket=ticket,
+            resource=scheduler.uuid,
+            language=scheduler.language,
+            arguments=arguments,
+            key=key or None,
+            approve=approve,
+            status=u'queued'
+        ))
+
+    return ticket
+
+
+def queue_status(ticket, dsn=None):
+    """ Returns the queued reservation with the given ticket as it was last
+    committed by the worker, or None if it does not exist (anymore). """
+
+    table = QueuedReservation.__table__
+    query = table.select().where(table.c.ticket == ticket)
+
+    return get_engine(dsn).execute(query).first()
+
+
+def wait_for_reservation(ticket, timeout=None, dsn=None,
+                         interval=POLL_INTERVAL):
+    """ Waits until the queued reservation with the given ticket was
+    processed or until the timeout (in seconds, at most MAX_TIMEOUT) is
+    reached. Returns the queued reservation as returned by queue_status.
+
+    If too many requests are waiting already (see get_max_waiting), the
+    queued reservation is returned right away.
+
+    """
+    timeout = get_timeout() if timeout is None else timeout
+    timeout = min(timeout, MAX_TIMEOUT)
+    deadline = time.time() + timeout
+
+    waiting = waiting_requests()
+
+    if not waiting.acquire(False):
+        return queue_status(ticket, dsn)
+
+    try:
+        while True:
+            status = queue_status(ticket, dsn)
+
+            if status is None or status.status != u'queued':
+                return status
+
+            if time.time() >= deadline:
+                return status
+
+            time.sleep(interval)
+    finally:
+        waiting.release()
+
+
+def raise_failure(status):
+    """ Raises the error which caused the given queued reservation to fail.
+
+    The error is recreated from its type and message. Errors of unknown
+    types, as well as errors which need more than a message to be created,
+    are raised as ReservationQueueError.
+
+    """
+    assert status.status == u'failed'
+
+    exception_class = getattr(error, status.error or '', None)
+
+    if exception_class is error.CustomReservationError:
+        raise exception_class(status.message)
+
+    if exception_class in error.errormap and issubclass(
+        exception_class, error.ReservationError
+    ) and exception_class.__init__ is error.ReservationError.__init__:
+        raise exception_class(*(status.message and [status.message] or []))
+
+    raise error.ReservationQueueError(status.message)
+
+
+def error_message(exception):
+    """ Returns the message of the given exception as unicode. Messages
+    given as bytes (i.e. containing a resource title) are decoded, so they
+    don't fail the worker. """
+
+    message = getattr(exception, 'msg', None)
+
+    if message is None:
+        if len(exception.args) == 1:
+            message = exception.args[0]
+        else:
+            message = exception.args and repr(exception.args) or u''
+
+    if not isinstance(message, basestring):
+        message = repr(message)
+
+    return utils.safe_unicode(message)
+
+
+def make_reservation(job):
+    """ Makes the given queued reservation, returning the token. """
+
+    arguments = dict(job.arguments)
+
+    if arguments['dates']:
+        arguments['dates'] = decode_dates(arguments['dates'])
+
+    scheduler = db.Scheduler(job.resource, language=job.language)
+    token = scheduler.reserve(**arguments)
+
+    if job.approve:
+        scheduler.approve_reservation(token)
+
+    return token
+
+
+@serialized
+def process_queue(batch_size=BATCH_SIZE):
+    """ Makes the next batch of queued reservations, oldest first. Each
+    reservation is made in a savepoint of its own, so a failing reservation
+    only marks its queued reservation as failed.
+
+    Returns the number of processed reservations. If another worker is
+    running no reservations are processed.
+
+    """
+    locked = Session.execute(
+        select([func.pg_try_advisory_xact_lock(QUEUE_LOCK_KEY)])
+    ).scalar()
+
+    if not locked:
+        return 0
+
+    query = Session.query(QueuedReservation)
+    query = query.filter(QueuedReservation.status == u'queued')
+    query = query.order_by(QueuedReservation.id)
+
+    jobs = query.limit(batch_size).all()
+
+    for job in jobs:
+        try:
+            token = serialized_call(make_reservation)(job)
+        except Exception, e:
+
+            # the whole batch is retried (see session.py)
+            if is_retryable(e):
+                raise
+
+            log.info('Queued reservation %s failed: %r' % (job.ticket, e))
+
+            job.status = u'failed'
+            job.error = type(e).__name__
+            job.message = error_message(e)
+        else:
+            job.status = u'done'
+            job.reservation_token = token
+
+    return len(jobs)
+
+
+@serialized
+def remove_processed(retention=RETENTION):
+    """ Removes the queued reservations processed before the given
+    retention period. Returns the number of removed reservations.
+
+    """
+    query = Session.query(QueuedReservation)
+    query = query.filter(QueuedReservation.status != u'queued')
+    query = query.filter(
+        QueuedReservation.modified < utils.utcnow() - retention
+    )
+
+    return query.delete('fetch')
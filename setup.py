@@ -38,6 +38,10 @@ postgres_require = [
     'psycopg2',
 ]
 
+xlsx_require = [
+    'XlsxWriter',
+]
+
 
 def get_long_description():
     readme = open('README.rst').read()
@@ -103,7 +107,8 @@ setup(name=name, version=version, description=description,
           tests=tests_require,
           teamraum=teamraum_require,
           multilingual=multilingual_require,
-          postgres=postgres_require
+          postgres=postgres_require,
+          xlsx=xlsx_require
       ),
       entry_points="""
       # -*- Entry points: -*-